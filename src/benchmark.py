@@ -0,0 +1,329 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import types
+import random
+import shutil
+import argparse
+import struct
+import tempfile
+import contextlib
+from datetime import date, timedelta
+from typing import List, Dict
+import yaml
+import avro.schema
+import helpers.common as common_helper
+import helpers.avro_container as avro_container_helper
+import helpers.planning as planning_helper
+import local_aws
+
+src_dir = os.path.abspath(os.path.dirname(__file__))
+root_dir = os.path.abspath(os.path.dirname(src_dir))
+
+# Value field of the RawDatum schema for each value type
+VALUE_FIELDS = {
+    'double': 'doubleValue',
+    'integer': 'integerValue',
+    'string': 'stringValue',
+    'boolean': 'booleanValue',
+    'json': 'jsonValue'
+}
+# Local bucket names used by the pipeline benchmark
+COLD_TIER_BUCKET = 'cold-tier'
+REPARTITIONED_BUCKET = 'repartitioned'
+GLUE_ASSETS_BUCKET = 'glue-assets'
+
+def generate_objects(key_count: int, timeseries_ids: list) -> list:
+    """Generate S3 objects of a day partition in the cold tier key layout
+    """
+    day_prefix = 'raw/startYear=2022/startMonth=5/startDay=5/'
+    objects = []
+    for i in range(key_count):
+        timeseries_id = timeseries_ids[i * 7919 % len(timeseries_ids)]
+        key = f'{day_prefix}seriesBucket={timeseries_id[:2]}/raw_{timeseries_id}_{1651708800 + i}_{i % 1000000000}.avro'
+        objects.append({'Key': key, 'ETag': f'{i:032x}', 'Size': 1024})
+    return objects
+
+def benchmark_key_planning(max_keys: int, timeseries_count: int) -> None:
+    """Time the grouping of a day's keys per timeseries for growing key
+    counts, against target and previously processed timeseries sets
+    """
+    random.seed(0)
+    timeseries_ids = [str(uuid.UUID(int=random.getrandbits(128))) for _ in range(timeseries_count)]
+    # Keys are parsed by helpers.s3, which is set up with the local stand-ins even though no object is read
+    install_local_environment(load_benchmark_config([]), os.path.join(tempfile.gettempdir(), 'sitewise-benchmark-keys'), timeseries_ids)
+    target_timeseries_ids = set(timeseries_ids[:timeseries_count * 9 // 10])
+    previous_timeseries_ids = set(timeseries_ids[:timeseries_count // 2])
+
+    print(f'Key planning against {len(target_timeseries_ids)} target and {len(previous_timeseries_ids)} previous timeseries')
+    print(f'\t{"keys":>10} {"secs":>8} {"keys/s":>12} {"ns/key":>8} {"kept":>10}')
+    key_count = 10000
+    while key_count <= max_keys:
+        objects = generate_objects(key_count, timeseries_ids)
+        start = time.perf_counter()
+        grouped_objects = planning_helper.group_objects_by_timeseries(objects, target_timeseries_ids, previous_timeseries_ids)
+        filtered_objects = planning_helper.flatten_grouped_objects(grouped_objects)
+        seconds = time.perf_counter() - start
+        print(f'\t{key_count:>10} {seconds:>8.3f} {key_count / seconds:>12.0f} {seconds / key_count * 1e9:>8.0f} {len(filtered_objects):>10}')
+        del objects, grouped_objects, filtered_objects
+        key_count *= 10
+
+def parse_value_mix(value_mix: str) -> Dict[str, float]:
+    """Parse the weights of the value types, such as 'double=6,integer=2'
+    """
+    weights = {}
+    for item in value_mix.split(','):
+        value_type, weight = item.split('=')
+        if value_type not in VALUE_FIELDS: raise Exception(f"\nInvalid value type '{value_type}', expected one of {', '.join(VALUE_FIELDS)}")
+        weights[value_type] = float(weight)
+    return weights
+
+def encode_value(avro_type, value) -> bytes:
+    """Encode a value of a RawDatum field, which is either a primitive 
+    type or a union of null and a primitive type
+    """
+    if isinstance(avro_type, list):
+        if value is None: return avro_container_helper.encode_long(avro_type.index('null'))
+        return avro_container_helper.encode_long(1 - avro_type.index('null')) + encode_value(avro_type[1 - avro_type.index('null')], value)
+    if avro_type in ('long', 'int'): return avro_container_helper.encode_long(value)
+    if avro_type == 'double': return struct.pack('<d', value)
+    if avro_type == 'boolean': return b'\x01' if value else b'\x00'
+    encoded = value.encode('utf-8')
+    return avro_container_helper.encode_long(len(encoded)) + encoded
+
+def synthetic_value(value_type: str, rng: random.Random, time_in_seconds: int):
+    if value_type == 'double': return rng.uniform(-1000, 1000)
+    if value_type == 'integer': return rng.randint(-2 ** 31, 2 ** 31 - 1)
+    if value_type == 'string': return f'state-{rng.randint(0, 20)}'
+    if value_type == 'boolean': return rng.random() < 0.5
+    return json.dumps({'value': round(rng.uniform(0, 100), 3), 'at': time_in_seconds})
+
+def generate_cold_tier(s3_client, bucket: str, data_prefix: str, days: List[date], timeseries_ids: List[str], 
+                       records_per_series: int, objects_per_series: int, value_mix: Dict[str, float], codec: str) -> tuple:
+    """Write synthetic raw data files in the cold tier layout, with the 
+    records of each timeseries and day split over several objects. Each
+    timeseries gets a value type drawn from the value mix. Returns the 
+    number of objects and bytes written
+    """
+    rng = random.Random(0)
+    schema_json = json.load(open(f'{root_dir}/avro_schema.json'))
+    schema = avro.schema.parse(json.dumps(schema_json))
+    fields = [(field['name'], field['type']) for field in schema_json['fields']]
+    value_types = rng.choices(list(value_mix), weights=list(value_mix.values()), k=len(timeseries_ids))
+    object_count = 0
+    byte_count = 0
+    for day in days:
+        day_start = int(time.mktime(day.timetuple()))
+        day_prefix = f'{data_prefix}startYear={day.year}/startMonth={day.month}/startDay={day.day}/'
+        for timeseries_id, value_type in zip(timeseries_ids, value_types):
+            value_field = VALUE_FIELDS[value_type]
+            records_per_object = -(-records_per_series // objects_per_series)
+            for object_index in range(objects_per_series):
+                first_record = object_index * records_per_object
+                last_record = min(first_record + records_per_object, records_per_series)
+                if first_record >= last_record: break
+                # Records are encoded directly, the avro package encodes too slowly for large datasets
+                buffer = io.BytesIO()
+                writer = avro_container_helper.AvroContainerWriter(buffer, schema, codec=codec)
+                block = bytearray()
+                block_records = 0
+                for record_index in range(first_record, last_record):
+                    time_in_seconds = day_start + record_index * 86400 // records_per_series
+                    record = {'seriesId': timeseries_id, 'timeInSeconds': time_in_seconds, 'offsetInNanos': rng.randrange(1000000000),
+                              'quality': 'GOOD' if rng.random() < 0.98 else 'UNCERTAIN', 'doubleValue': None, 'stringValue': None, 
+                              'integerValue': None, 'booleanValue': None, 'jsonValue': None, 'recordVersion': None}
+                    record[value_field] = synthetic_value(value_type, rng, time_in_seconds)
+                    for name, avro_type in fields: block += encode_value(avro_type, record[name])
+                    block_records += 1
+                    if len(block) >= avro_container_helper.SYNC_INTERVAL or record_index == last_record - 1:
+                        writer.append_block(block_records, bytes(block), 'null')
+                        block = bytearray()
+                        block_records = 0
+                data = buffer.getvalue()
+                start_time = day_start + first_record * 86400 // records_per_series
+                key = f'{day_prefix}seriesBucket={timeseries_id[:2]}/raw_{timeseries_id}_{start_time}_{object_index}.avro'
+                s3_client.put_object(Bucket=bucket, Key=key, Body=data)
+                object_count += 1
+                byte_count += len(data)
+    return object_count, byte_count
+
+def generate_records(record_count: int, value_types: List[str]) -> List[Dict]:
+    """Generate RawDatum records cycling through the value types, with 
+    some records versioned
+    """
+    rng = random.Random(0)
+    timeseries_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(100)]
+    records = []
+    for i in range(record_count):
+        time_in_seconds = 1651708800 + i // len(timeseries_ids)
+        value_type = value_types[i % len(value_types)]
+        record = {'seriesId': timeseries_ids[i % len(timeseries_ids)], 'timeInSeconds': time_in_seconds, 'offsetInNanos': rng.randrange(1000000000),
+                  'quality': 'GOOD' if rng.random() < 0.98 else 'UNCERTAIN', 'doubleValue': None, 'stringValue': None, 
+                  'integerValue': None, 'booleanValue': None, 'jsonValue': None, 'recordVersion': i if i % 10 == 0 else None}
+        record[VALUE_FIELDS[value_type]] = synthetic_value(value_type, rng, time_in_seconds)
+        records.append(record)
+    return records
+
+def benchmark_engines(record_count: int, codec: str) -> None:
+    """Time the records/s of the AVRO engines encoding and decoding 
+    RawDatum records of all value types
+    """
+    schema = avro.schema.parse(json.dumps(json.load(open(f'{root_dir}/avro_schema.json'))))
+    records = generate_records(record_count, list(VALUE_FIELDS))
+    engines = []
+    for name in avro_container_helper.ENGINES:
+        try: engines.append(avro_container_helper.create_engine(name))
+        except ImportError: print(f'The {name} engine is not installed, skipped')
+
+    print(f'AVRO engines on {record_count} records of value types {", ".join(VALUE_FIELDS)}, {codec} codec')
+    print(f'\t{"engine":<10} {"encode rec/s":>13} {"block decode rec/s":>19} {"container decode rec/s":>23}')
+    for engine in engines:
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        writer = avro_container_helper.AvroContainerWriter(buffer, schema, codec=codec, engine=engine)
+        for record in records: writer.append(record)
+        writer.flush()
+        encode_seconds = time.perf_counter() - start
+        data = buffer.getvalue()
+
+        reader = avro_container_helper.AvroContainerReader(io.BytesIO(data))
+        blocks = list(reader.iter_blocks())
+        start = time.perf_counter()
+        for block_record_count, block_data in blocks:
+            for _ in avro_container_helper.iter_block_records(block_record_count, block_data, codec, schema, engine=engine): pass
+        block_decode_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in avro_container_helper.iter_container_records(io.BytesIO(data), schema, engine=engine): pass
+        container_decode_seconds = time.perf_counter() - start
+        print(f'\t{engine.name:<10} {record_count / encode_seconds:>13.0f} {record_count / block_decode_seconds:>19.0f} '
+              f'{record_count / container_decode_seconds:>23.0f}')
+
+def load_benchmark_config(overrides: List[str]) -> Dict:
+    """Load config.yml for the local buckets, with overrides such as 
+    'merge.mode=record' applied
+    """
+    with open(f'{root_dir}/config.yml', 'r') as file:
+        config = yaml.safe_load(file)
+    config['s3']['cold_tier']['bucket_name'] = COLD_TIER_BUCKET
+    config['s3']['repartitioned']['bucket_name'] = REPARTITIONED_BUCKET
+    config['s3']['glue_assets']['bucket_name'] = GLUE_ASSETS_BUCKET
+    config['discovery']['inventory_bucket_name'] = ''
+    # The local SiteWise stand-in is not rate limited, and the metrics are summarized instead of printed
+    config['catalog']['requests_per_second'] = 1000
+    config['metrics']['enabled'] = False
+    for override in overrides:
+        path, value = override.split('=', 1)
+        section = config
+        names = path.split('.')
+        for name in names[:-1]: section = section[name]
+        if names[-1] not in section: raise Exception(f"\nUnknown config option '{path}'")
+        section[names[-1]] = yaml.safe_load(value)
+    common_helper.validate_config_inputs(config)
+    return config
+
+def install_local_environment(config: Dict, s3_dir: str, timeseries_ids: List[str]):
+    """Make the helpers use the config provided and the local S3 and 
+    SiteWise stand-ins, instead of the generated globals and AWS
+    """
+    config_module = types.ModuleType('helpers.globals')
+    config_module.config = config
+    config_module.avro_schema = json.load(open(f'{root_dir}/avro_schema.json'))
+    sys.modules['helpers.globals'] = config_module
+    s3_client = local_aws.LocalS3Client(s3_dir)
+    common_helper.local_clients['s3'] = s3_client
+    common_helper.local_clients['iotsitewise'] = local_aws.LocalSiteWiseClient(timeseries_ids)
+    return s3_client
+
+def directory_size(directory_path: str) -> int:
+    return sum(os.path.getsize(os.path.join(dir_path, file_name)) 
+               for dir_path, _, file_names in os.walk(directory_path) for file_name in file_names)
+
+def benchmark_pipeline(args) -> None:
+    """Generate synthetic cold tier data and process it with job_script 
+    against the local S3 and SiteWise stand-ins, reporting throughput and
+    memory per stage
+    """
+    config = load_benchmark_config(args.set or [])
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='sitewise-benchmark-')
+    s3_dir = f'{work_dir}/s3'
+    rng = random.Random(0)
+    timeseries_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(args.series)]
+    s3_client = install_local_environment(config, s3_dir, timeseries_ids)
+    last_day = date(2022, 5, 5)
+    days = [last_day - timedelta(days=i) for i in range(args.days)]
+
+    print(f'Generating {args.days} days of {args.series} timeseries with {args.records} records each in {args.objects} objects, '
+          f'value mix {args.value_mix}, {args.codec} codec')
+    start = time.perf_counter()
+    object_count, byte_count = generate_cold_tier(s3_client, COLD_TIER_BUCKET, config['s3']['cold_tier']['data_prefix'], days, 
+        timeseries_ids, args.records, args.objects, parse_value_mix(args.value_mix), args.codec)
+    print(f'\t{object_count} objects, {byte_count / 1048576:.1f} MB in {time.perf_counter() - start:.1f} secs at {s3_dir}')
+
+    sys.argv = ['job_script.py', '--from-date', days[-1].strftime('%Y-%m-%d'), '--to-date', last_day.strftime('%Y-%m-%d')]
+    import job_script
+    print(f'Running the job against the local stand-ins..')
+    start = time.perf_counter()
+    job_output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else job_output): job_script.start()
+        job_script.checkpoints.clear()
+    except Exception:
+        print(job_output.getvalue())
+        raise
+    finally:
+        job_script.download_engine.close()
+        if os.path.exists(job_script.TMP_SITEWISE_PATH): shutil.rmtree(job_script.TMP_SITEWISE_PATH)
+    seconds = time.perf_counter() - start
+    output_bytes = directory_size(f'{s3_dir}/{REPARTITIONED_BUCKET}')
+
+    print(f'\n\t{"stage":<10} {"secs":>8} {"cpu secs":>9} {"objects":>8} {"MB in":>9} {"MB out":>9} {"MB/s":>8} '
+          f'{"records/s":>11} {"peak RSS MB":>12} {"disk MB":>9}')
+    entries = job_script.metrics_emitter.entries
+    for stage, totals in job_script.metrics_emitter.stage_totals().items():
+        stage_entries = [entry for entry in entries if entry['Stage'] == stage]
+        wall_seconds = totals['WallSeconds']
+        mb_per_second = max(totals['BytesIn'], totals['BytesOut']) / 1048576 / wall_seconds if wall_seconds > 0 else 0
+        records_per_second = totals['Records'] / wall_seconds if wall_seconds > 0 else 0
+        print(f'\t{stage:<10} {wall_seconds:>8.2f} {totals["CpuSeconds"]:>9.2f} {totals["Objects"]:>8} '
+              f'{totals["BytesIn"] / 1048576:>9.1f} {totals["BytesOut"] / 1048576:>9.1f} {mb_per_second:>8.1f} {records_per_second:>11.0f} '
+              f'{max(entry["PeakRssBytes"] for entry in stage_entries) / 1048576:>12.1f} '
+              f'{max(entry["DiskBytes"] for entry in stage_entries) / 1048576:>9.1f}')
+    print(f'\n\tEnd to end: {seconds:.2f} secs, {byte_count / 1048576 / seconds:.1f} MB/s of cold tier data, '
+          f'{output_bytes / 1048576:.1f} MB written')
+    if job_script.day_usage:
+        peak_memory_bytes = max(peak_memory for peak_memory, _ in job_script.day_usage.values())
+        print(f'\tPeak memory per day: {peak_memory_bytes / 1048576:.1f} MB of buffers, peak RSS {job_script.metrics_helper.peak_rss_bytes() / 1048576:.1f} MB')
+    if not args.work_dir: shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    keys_parser = subparsers.add_parser('keys', help='Key planning for a day partition')
+    keys_parser.add_argument('--max-keys', type=int, default=10000000, help='Largest number of keys, starting from 10000 by factors of 10')
+    keys_parser.add_argument('--timeseries', type=int, default=50000, help='Number of timeseries')
+    engines_parser = subparsers.add_parser('engines', help='Records/s of the AVRO engines')
+    engines_parser.add_argument('--records', type=int, default=100000, help='Number of records')
+    engines_parser.add_argument('--codec', default='deflate', help='AVRO codec of the blocks')
+    pipeline_parser = subparsers.add_parser('pipeline', help='Job run against synthetic data in a local S3 stand-in')
+    pipeline_parser.add_argument('--days', type=int, default=2, help='Number of days')
+    pipeline_parser.add_argument('--series', type=int, default=200, help='Number of timeseries')
+    pipeline_parser.add_argument('--records', type=int, default=2000, help='Records per timeseries and day')
+    pipeline_parser.add_argument('--objects', type=int, default=2, help='Objects per timeseries and day')
+    pipeline_parser.add_argument('--value-mix', default='double=6,integer=2,string=1,boolean=1', 
+                                 help='Weights of the value types of the timeseries, out of double, integer, string, boolean and json')
+    pipeline_parser.add_argument('--codec', default='deflate', help='AVRO codec of the raw data files')
+    pipeline_parser.add_argument('--set', action='append', metavar='OPTION=VALUE', help='Override a config.yml option, such as merge.mode=record')
+    pipeline_parser.add_argument('--work-dir', help='Directory to keep the local buckets in, a temporary directory by default')
+    pipeline_parser.add_argument('--verbose', action='store_true', help='Print the output of the job')
+    args = parser.parse_args()
+
+    if args.benchmark == 'keys': benchmark_key_planning(args.max_keys, args.timeseries)
+    if args.benchmark == 'engines': benchmark_engines(args.records, args.codec)
+    if args.benchmark == 'pipeline': benchmark_pipeline(args)
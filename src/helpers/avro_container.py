@@ -0,0 +1,325 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import io
+import os
+import bz2
+import json
+import lzma
+import zlib
+import struct
+from typing import Dict, Tuple, Iterator, Callable
+import avro.io
+import avro.schema
+
+MAGIC = b'Obj\x01'
+SYNC_SIZE = 16
+# Same block size the avro DataFileWriter flushes at
+SYNC_INTERVAL = 4000 * SYNC_SIZE
+
+def encode_long(n: int) -> bytes:
+    """Encode an integer as an Avro zig-zag variable-length long
+    """
+    n = (n << 1) ^ (n >> 63)
+    encoded = bytearray()
+    while n & ~0x7F:
+        encoded.append((n & 0x7F) | 0x80)
+        n >>= 7
+    encoded.append(n)
+    return bytes(encoded)
+
+def read_long(f) -> int:
+    """Read an Avro zig-zag variable-length long from the file object,
+    returns None at the end of the file
+    """
+    b = f.read(1)
+    if not b: return None
+    byte = b[0]
+    n = byte & 0x7F
+    shift = 7
+    while byte & 0x80:
+        byte = f.read(1)[0]
+        n |= (byte & 0x7F) << shift
+        shift += 7
+    return (n >> 1) ^ -(n & 1)
+
+def read_bytes(f) -> bytes:
+    """Read length-prefixed Avro bytes from the file object
+    """
+    return f.read(read_long(f))
+
+def compress(codec: str, data: bytes) -> bytes:
+    """Compress a block of data with the Avro codec provided
+    """
+    if codec == 'null': return data
+    if codec == 'deflate':
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush()
+    if codec == 'snappy':
+        import snappy
+        return snappy.compress(data) + struct.pack('>I', zlib.crc32(data) & 0xffffffff)
+    if codec == 'bzip2': return bz2.compress(data)
+    if codec == 'xz': return lzma.compress(data)
+    raise Exception(f"\nUnsupported AVRO codec '{codec}'")
+
+def decompress(codec: str, data: bytes) -> bytes:
+    """Decompress a block of data with the Avro codec provided
+    """
+    if codec == 'null': return data
+    if codec == 'deflate': return zlib.decompress(data, -15)
+    if codec == 'snappy':
+        import snappy
+        uncompressed = snappy.decompress(data[:-4])
+        if struct.unpack('>I', data[-4:])[0] != zlib.crc32(uncompressed) & 0xffffffff:
+            raise Exception("\nChecksum failure for snappy compressed AVRO block")
+        return uncompressed
+    if codec == 'bzip2': return bz2.decompress(data)
+    if codec == 'xz': return lzma.decompress(data)
+    raise Exception(f"\nUnsupported AVRO codec '{codec}'")
+
+def iter_container_blocks(f, sync_marker: bytes) -> Iterator[Tuple[int, bytes]]:
+    """Yield the record count and the compressed data of the consecutive 
+    blocks read from f, such as a byte range of a container starting at
+    a block
+    """
+    while True:
+        record_count = read_long(f)
+        if record_count is None: return
+        data = read_bytes(f)
+        if f.read(SYNC_SIZE) != sync_marker:
+            raise Exception("\nInvalid sync marker found in AVRO file")
+        yield record_count, data
+
+class AvroContainerReader:
+    """Read an Avro object container file block by block without
+    decoding the records
+    """
+    def __init__(self, f):
+        self.f = f
+        if f.read(len(MAGIC)) != MAGIC: raise Exception("\nNot an AVRO object container file")
+        self.metadata = {}
+        block_count = read_long(f)
+        while block_count:
+            if block_count < 0:
+                block_count = -block_count
+                read_long(f)
+            for _ in range(block_count):
+                key = read_bytes(f).decode('utf-8')
+                self.metadata[key] = read_bytes(f)
+            block_count = read_long(f)
+        self.sync_marker = f.read(SYNC_SIZE)
+        self.codec = self.metadata.get('avro.codec', b'null').decode('utf-8') or 'null'
+        self.schema_json = self.metadata['avro.schema'].decode('utf-8')
+
+    def iter_blocks(self) -> Iterator[Tuple[int, bytes]]:
+        """Yield the record count and the compressed data of each block
+        """
+        return iter_container_blocks(self.f, self.sync_marker)
+
+    def close(self) -> None:
+        self.f.close()
+
+class AvroPackageEngine:
+    """Encode and decode records with the pure Python avro package
+    """
+    name = 'avro'
+
+    def record_encoder(self, schema: avro.schema.Schema, buffer: io.BytesIO) -> Callable[[Dict], None]:
+        """Get a function encoding a record into the buffer
+        """
+        datum_writer = avro.io.DatumWriter(schema)
+        encoder = avro.io.BinaryEncoder(buffer)
+        return lambda record: datum_writer.write(record, encoder)
+
+    def iter_block_records(self, record_count: int, data: bytes, schema: avro.schema.Schema) -> Iterator[Dict]:
+        decoder = avro.io.BinaryDecoder(io.BytesIO(data))
+        datum_reader = avro.io.DatumReader(schema)
+        for _ in range(record_count):
+            yield datum_reader.read(decoder)
+
+    def iter_container_records(self, f, schema: avro.schema.Schema) -> Iterator[Dict]:
+        from avro.datafile import DataFileReader
+        reader = DataFileReader(f, avro.io.DatumReader(readers_schema=schema))
+        for record in reader:
+            yield record
+        reader.close()
+
+class FastavroEngine:
+    """Encode and decode records with fastavro, which is implemented in C
+    """
+    name = 'fastavro'
+
+    def __init__(self):
+        import fastavro
+        self.fastavro = fastavro
+        self.parsed_schemas = {}
+
+    def _parse_schema(self, schema: avro.schema.Schema) -> Dict:
+        key = str(schema)
+        if key not in self.parsed_schemas: self.parsed_schemas[key] = self.fastavro.parse_schema(json.loads(key))
+        return self.parsed_schemas[key]
+
+    def record_encoder(self, schema: avro.schema.Schema, buffer: io.BytesIO) -> Callable[[Dict], None]:
+        parsed_schema = self._parse_schema(schema)
+        schemaless_writer = self.fastavro.schemaless_writer
+        return lambda record: schemaless_writer(buffer, parsed_schema, record)
+
+    def iter_block_records(self, record_count: int, data: bytes, schema: avro.schema.Schema) -> Iterator[Dict]:
+        parsed_schema = self._parse_schema(schema)
+        schemaless_reader = self.fastavro.schemaless_reader
+        buffer = io.BytesIO(data)
+        for _ in range(record_count):
+            yield schemaless_reader(buffer, parsed_schema, None)
+
+    def iter_container_records(self, f, schema: avro.schema.Schema) -> Iterator[Dict]:
+        for record in self.fastavro.reader(f, reader_schema=self._parse_schema(schema)):
+            yield record
+        f.close()
+
+ENGINES = {'avro': AvroPackageEngine, 'fastavro': FastavroEngine}
+
+def create_engine(name: str = 'auto'):
+    """Create the engine encoding and decoding records, fastavro when
+    installed and the avro package otherwise with 'auto'
+    """
+    if name != 'auto': return ENGINES[name]()
+    try: return FastavroEngine()
+    except ImportError: return AvroPackageEngine()
+
+# Engine used when none is provided
+default_engine = create_engine()
+
+def set_default_engine(name: str):
+    global default_engine
+    default_engine = create_engine(name)
+    return default_engine
+
+class AvroContainerWriter:
+    """Write an Avro object container file from either whole compressed
+    blocks copied from other containers or individual records
+    """
+    def __init__(self, f, schema: avro.schema.Schema, codec: str = 'snappy', on_block=None, engine=None):
+        self.f = f
+        # Called with the offset, length and record count of each block written
+        self.on_block = on_block
+        self.schema = schema
+        self.codec = codec
+        self.sync_marker = os.urandom(SYNC_SIZE)
+        self.buffer = io.BytesIO()
+        self.encode_record = (engine or default_engine).record_encoder(schema, self.buffer)
+        self.buffered_records = 0
+        self.record_count = 0
+        self.block_count = 0
+        self.blocks_recompressed = 0
+        self.bytes_written = 0
+        self._write_header()
+
+    def _write_header(self) -> None:
+        metadata = {
+            'avro.schema': str(self.schema).encode('utf-8'),
+            'avro.codec': self.codec.encode('utf-8')
+        }
+        header = bytearray(MAGIC)
+        header += encode_long(len(metadata))
+        for key, value in metadata.items():
+            header += encode_long(len(key)) + key.encode('utf-8')
+            header += encode_long(len(value)) + value
+        header += encode_long(0)
+        header += self.sync_marker
+        self.f.write(header)
+        self.bytes_written += len(header)
+
+    def _write_block(self, record_count: int, data: bytes) -> None:
+        block_header = encode_long(record_count) + encode_long(len(data))
+        self.f.write(block_header)
+        self.f.write(data)
+        self.f.write(self.sync_marker)
+        block_offset = self.bytes_written
+        self.bytes_written += len(block_header) + len(data) + SYNC_SIZE
+        if self.on_block: self.on_block(block_offset, self.bytes_written - block_offset, record_count)
+        self.record_count += record_count
+        self.block_count += 1
+
+    def append_block(self, record_count: int, data: bytes, codec: str) -> None:
+        """Append a compressed block as-is, re-compressing only when the
+        source codec is different
+        """
+        self.flush()
+        if codec != self.codec:
+            data = compress(self.codec, decompress(codec, data))
+            self.blocks_recompressed += 1
+        self._write_block(record_count, data)
+
+    def append(self, record: Dict) -> None:
+        """Encode a single record into the current block
+        """
+        self.encode_record(record)
+        self.buffered_records += 1
+        if self.buffer.tell() >= SYNC_INTERVAL: self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered records as a block
+        """
+        if self.buffered_records == 0: return
+        self._write_block(self.buffered_records, compress(self.codec, self.buffer.getvalue()))
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.buffered_records = 0
+
+    def tell(self) -> int:
+        """Get the number of bytes written, excluding buffered records
+        """
+        return self.bytes_written
+
+    def close(self) -> None:
+        self.flush()
+        self.f.close()
+
+_schema_cache = {}
+
+def schemas_match(schema_json: str, schema: avro.schema.Schema) -> bool:
+    """Check if the writer schema of a container is identical to the
+    target schema
+    """
+    key = (schema_json, str(schema))
+    if key not in _schema_cache:
+        try: _schema_cache[key] = avro.schema.parse(schema_json) == schema
+        except Exception: _schema_cache[key] = False
+    return _schema_cache[key]
+
+def iter_block_records(record_count: int, data: bytes, codec: str, schema: avro.schema.Schema, engine=None) -> Iterator[Dict]:
+    """Decode the records of a compressed block written with the schema
+    provided
+    """
+    yield from (engine or default_engine).iter_block_records(record_count, decompress(codec, data), schema)
+
+def iter_container_records(f, schema: avro.schema.Schema, engine=None) -> Iterator[Dict]:
+    """Decode the records of a container, resolved against the schema
+    provided
+    """
+    yield from (engine or default_engine).iter_container_records(f, schema)
+
+def append_container_records(f, writer) -> int:
+    """Decode all records of a container, resolved against the schema of
+    the writer, and re-encode them into the writer
+    """
+    record_count = 0
+    for record in iter_container_records(f, writer.schema):
+        writer.append(record)
+        record_count += 1
+    return record_count
+
+def append_container_blocks(f, writer) -> int:
+    """Copy all blocks of a container into the writer. Falls back to the
+    record path when the schemas don't match
+    """
+    reader = AvroContainerReader(f)
+    if not schemas_match(reader.schema_json, writer.schema):
+        f.seek(0)
+        return append_container_records(f, writer)
+    record_count = 0
+    for block_record_count, data in reader.iter_blocks():
+        writer.append_block(block_record_count, data, reader.codec)
+        record_count += block_record_count
+    reader.close()
+    return record_count
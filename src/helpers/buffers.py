@@ -0,0 +1,180 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import io
+import os
+import threading
+from typing import List, Dict
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+class MemoryReader(io.RawIOBase):
+    """Seekable read-only file object over the first bytes of a buffer
+    """
+    def __init__(self, buffer: bytearray, size: int):
+        self.view = memoryview(buffer)[:size]
+        self.size = size
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        count = min(len(b), self.size - self.position)
+        b[:count] = self.view[self.position:self.position + count]
+        self.position += count
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR: offset += self.position
+        elif whence == io.SEEK_END: offset += self.size
+        self.position = max(0, min(offset, self.size))
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def close(self) -> None:
+        self.view.release()
+        super().close()
+
+class MemoryRangeWriter:
+    """Write byte ranges of an object into a buffer at their offset, from
+    any number of threads
+    """
+    def __init__(self, buffer: bytearray):
+        self.buffer = buffer
+
+    def write_at(self, offset: int, data: bytes) -> None:
+        with memoryview(self.buffer) as view:
+            view[offset:offset + len(data)] = data
+
+    def close(self) -> None:
+        pass
+
+class FileRangeWriter:
+    """Write byte ranges of an object into a local file of known size at 
+    their offset, from any number of threads
+    """
+    def __init__(self, file_path: str, size: int):
+        self.fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(self.fd, size)
+
+    def write_at(self, offset: int, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, offset)
+            view = view[written:]
+            offset += written
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+class SpillingBufferStore:
+    """Hold downloaded objects in reusable in-memory buffers, grouped by
+    day. Objects that don't fit in the memory budget are written to the
+    day's directory on disk instead
+    """
+    def __init__(self, spill_dir_path: str, memory_budget_bytes: int):
+        self.spill_dir_path = spill_dir_path
+        self.memory_budget_bytes = memory_budget_bytes
+        self.lock = threading.Lock()
+        self.free_buffers = []
+        self.allocated_bytes = 0
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.objects = {}
+        self.day_stats = {}
+
+    def _acquire_buffer(self, size: int) -> bytearray:
+        """Reserve memory for an object, reusing a released buffer when
+        one is large enough. Returns None if over the memory budget
+        """
+        with self.lock:
+            for i, free_buffer in enumerate(self.free_buffers):
+                if len(free_buffer) >= size:
+                    self.memory_bytes += size
+                    return self.free_buffers.pop(i)
+            # Drop released buffers that are too small to make room
+            while self.free_buffers and self.allocated_bytes + size > self.memory_budget_bytes:
+                self.allocated_bytes -= len(self.free_buffers.pop(0))
+            if self.allocated_bytes + size > self.memory_budget_bytes: return None
+            self.allocated_bytes += size
+            self.memory_bytes += size
+        return bytearray(size)
+
+    def _update_day_stats(self, day: str, memory_delta: int, disk_delta: int) -> None:
+        with self.lock:
+            stats = self.day_stats.setdefault(day, {'memory_bytes': 0, 'disk_bytes': 0, 'peak_memory_bytes': 0, 'peak_disk_bytes': 0})
+            stats['memory_bytes'] += memory_delta
+            stats['disk_bytes'] += disk_delta
+            stats['peak_memory_bytes'] = max(stats['peak_memory_bytes'], stats['memory_bytes'])
+            stats['peak_disk_bytes'] = max(stats['peak_disk_bytes'], stats['disk_bytes'])
+
+    def reserve(self, day: str, file_name: str, size: int):
+        """Reserve room for an object of known size in memory, or on disk 
+        if the memory budget is exceeded. Returns a writer to fill it with
+        byte ranges
+        """
+        buffer = self._acquire_buffer(size)
+        if buffer is not None:
+            with self.lock: self.objects[(day, file_name)] = (buffer, size)
+            self._update_day_stats(day, size, 0)
+            return MemoryRangeWriter(buffer)
+        writer = FileRangeWriter(f'{self.spill_dir_path}/{day}/{file_name}', size)
+        with self.lock:
+            self.objects[(day, file_name)] = (None, size)
+            self.disk_bytes += size
+        self._update_day_stats(day, 0, size)
+        return writer
+
+    def add(self, day: str, file_name: str, size: int, body) -> None:
+        """Read an object body of known size into memory, or spill it to
+        disk if the memory budget is exceeded
+        """
+        writer = self.reserve(day, file_name, size)
+        try:
+            position = 0
+            while position < size:
+                chunk = body.read(min(READ_CHUNK_SIZE, size - position))
+                if not chunk: raise Exception(f"\nUnexpected end of object '{file_name}'")
+                writer.write_at(position, chunk)
+                position += len(chunk)
+        finally: writer.close()
+
+    def file_names(self, day: str) -> List[str]:
+        """List the names of all objects held for the day
+        """
+        with self.lock: return [file_name for object_day, file_name in self.objects if object_day == day]
+
+    def open(self, day: str, file_name: str):
+        """Open an object held for the day for reading
+        """
+        buffer, size = self.objects[(day, file_name)]
+        if buffer is None: return open(f'{self.spill_dir_path}/{day}/{file_name}', 'rb')
+        return MemoryReader(buffer, size)
+
+    def release(self, day: str, file_name: str) -> None:
+        """Release the memory or disk space used by an object, keeping
+        its buffer for reuse
+        """
+        with self.lock: buffer, size = self.objects.pop((day, file_name))
+        if buffer is None:
+            os.remove(f'{self.spill_dir_path}/{day}/{file_name}')
+            with self.lock: self.disk_bytes -= size
+            self._update_day_stats(day, 0, -size)
+        else:
+            with self.lock:
+                self.memory_bytes -= size
+                self.free_buffers.append(buffer)
+            self._update_day_stats(day, -size, 0)
+
+    def trim(self) -> None:
+        """Drop the released buffers kept for reuse
+        """
+        with self.lock:
+            self.allocated_bytes -= sum(len(free_buffer) for free_buffer in self.free_buffers)
+            self.free_buffers = []
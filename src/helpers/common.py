@@ -4,6 +4,7 @@
 import os
 from typing import List, Dict
 import boto3
+from botocore.config import Config
 
 def visible_child_dirs(dir_path: str) -> List[str]:
     """List all visible child directories exclusing hidden files 
@@ -12,13 +13,18 @@ def visible_child_dirs(dir_path: str) -> List[str]:
     dirs = [x for x in os.listdir(dir_path) if not x.startswith('.')]
     return dirs
 
-def get_client(service_id: str):
-    """Get boto3 client for the service provided
+# Clients returned instead of boto3 clients, to run the jobs against local stand-ins such as in benchmarks
+local_clients = {}
+
+def get_client(service_id: str, max_pool_connections: int = 10):
+    """Get boto3 client for the service provided, with a connection pool
+    of the size provided
     """
+    if service_id in local_clients: return local_clients[service_id]
     profile = os.environ.get('AWS_PROFILE')
     try:
         session = boto3.Session(profile_name=profile)
-        client = session.client(service_id)
+        client = session.client(service_id, config=Config(max_pool_connections=max_pool_connections))
         return client
     except: raise Exception("\nFound an issue with credentials or region!")
 
@@ -30,6 +36,7 @@ def validate_config_inputs(config: Dict) -> None:
     glue_assets = s3_config['glue_assets']
     glue_assets_bucket = glue_assets['bucket_name']
     glue_assets_scripts_prefix = glue_assets['scripts_prefix']
+    glue_assets_status_prefix = glue_assets['status_prefix']
     cold_tier_config = s3_config['cold_tier']
     cold_tier_bucket = cold_tier_config['bucket_name']
     cold_tier_data_prefix = cold_tier_config['data_prefix']
@@ -37,9 +44,61 @@ def validate_config_inputs(config: Dict) -> None:
     repartitioned_bucket = repartitioned_config['bucket_name']
     repartitioned_data_prefix = repartitioned_config['data_prefix']
     repartitioned_index_prefix = repartitioned_config['index_prefix']
+    catalog_config = config['catalog']
+    catalog_ttl_minutes = catalog_config['ttl_minutes']
+    catalog_requests_per_second = catalog_config['requests_per_second']
+    jobs_config = config['jobs']
+    jobs_mode = jobs_config['mode']
+    jobs_max_concurrent_runs = jobs_config['max_concurrent_runs']
+    jobs_max_attempts = jobs_config['max_attempts']
+    jobs_target_gb_per_job = jobs_config['target_gb_per_job']
+    jobs_worker_type = jobs_config['worker_type']
+    jobs_worker_count = jobs_config['worker_count']
+    jobs_throughput_mb_per_dpu = jobs_config['throughput_mb_per_dpu']
+    discovery_config = config['discovery']
+    discovery_max_concurrency = discovery_config['max_concurrency']
+    discovery_inventory_bucket_name = discovery_config['inventory_bucket_name']
+    discovery_inventory_manifest_prefix = discovery_config['inventory_manifest_prefix']
+    download_max_concurrency = config['download']['max_concurrency']
+    download_initial_concurrency = config['download']['initial_concurrency']
+    download_range_size_mb = config['download']['range_size_mb']
+    download_small_object_size_kb = config['download']['small_object_size_kb']
+    download_small_object_batch_size = config['download']['small_object_batch_size']
+    incremental_mode = config['incremental']['mode']
+    merge_config = config['merge']
+    merge_mode = merge_config['mode']
+    merge_target_file_size_mb = merge_config['target_file_size_mb']
+    merge_sort_output = merge_config['sort_output']
+    merge_deduplicate = merge_config['deduplicate']
+    merge_dedup_memory_budget_mb = merge_config['dedup_memory_budget_mb']
+    merge_output_format = merge_config['output_format']
+    merge_parquet_row_group_size = merge_config['parquet_row_group_size']
+    merge_bucket_count = merge_config['bucket_count']
+    merge_avro_engine = merge_config['avro_engine']
+    pipeline_config = config['pipeline']
+    pipeline_enabled = pipeline_config['enabled']
+    pipeline_queue_depth = pipeline_config['queue_depth']
+    streaming_config = config['streaming']
+    streaming_enabled = streaming_config['enabled']
+    streaming_memory_budget_mb = streaming_config['memory_budget_mb']
+    upload_config = config['upload']
+    upload_multipart_enabled = upload_config['multipart_enabled']
+    upload_part_size_mb = upload_config['part_size_mb']
+    upload_max_concurrency = upload_config['max_concurrency']
+    metrics_config = config['metrics']
+    metrics_enabled = metrics_config['enabled']
+    metrics_namespace = metrics_config['namespace']
+    metrics_profile_merge = metrics_config['profile_merge']
+    metrics_profile_prefix = metrics_config['profile_prefix']
+    compaction_config = config['compaction']
+    compaction_max_files_per_day = compaction_config['max_files_per_day']
+    compaction_small_file_size_mb = compaction_config['small_file_size_mb']
+    compaction_min_small_files = compaction_config['min_small_files']
     
     # IoT SiteWise
     if not timeseries_type or timeseries_type not in ('ASSOCIATED', 'DISASSOCIATED'): raise Exception("\nInvalid input for 'timeseries_type'") 
+    if not isinstance(catalog_ttl_minutes, int) or catalog_ttl_minutes < 0: raise Exception("\nInvalid input for 'catalog.ttl_minutes'")
+    if not isinstance(catalog_requests_per_second, (int, float)) or catalog_requests_per_second <= 0: raise Exception("\nInvalid input for 'catalog.requests_per_second'")
     # S3
     if not cold_tier_bucket: raise Exception("\nInvalid input for 's3.cold_tier.bucket_name'")  
     if not cold_tier_data_prefix or cold_tier_data_prefix.startswith('/') \
@@ -52,8 +111,66 @@ def validate_config_inputs(config: Dict) -> None:
     if not repartitioned_index_prefix or repartitioned_index_prefix.startswith('/') \
         or not repartitioned_index_prefix.endswith('/'): 
         raise Exception("\nInvalid input for 's3.repartitioned.index_prefix'")
+    # Jobs
+    if jobs_mode not in ('jobs', 'runs'): raise Exception("\nInvalid input for 'jobs.mode'")
+    if not isinstance(jobs_max_concurrent_runs, int) or jobs_max_concurrent_runs < 1: raise Exception("\nInvalid input for 'jobs.max_concurrent_runs'")
+    if not isinstance(jobs_max_attempts, int) or jobs_max_attempts < 1: raise Exception("\nInvalid input for 'jobs.max_attempts'")
+    if not isinstance(jobs_target_gb_per_job, (int, float)) or jobs_target_gb_per_job < 0: raise Exception("\nInvalid input for 'jobs.target_gb_per_job'")
+    if jobs_worker_type not in ('G.1X', 'G.2X', 'G.4X', 'G.8X', 'auto'): raise Exception("\nInvalid input for 'jobs.worker_type'")
+    if not isinstance(jobs_worker_count, int) or jobs_worker_count < 2: raise Exception("\nInvalid input for 'jobs.worker_count'")
+    if not isinstance(jobs_throughput_mb_per_dpu, (int, float)) or jobs_throughput_mb_per_dpu <= 0: raise Exception("\nInvalid input for 'jobs.throughput_mb_per_dpu'")
+    # Discovery
+    if not isinstance(discovery_max_concurrency, int) or discovery_max_concurrency < 1: raise Exception("\nInvalid input for 'discovery.max_concurrency'")
+    if not isinstance(discovery_inventory_bucket_name, str): raise Exception("\nInvalid input for 'discovery.inventory_bucket_name'")
+    if not isinstance(discovery_inventory_manifest_prefix, str) or discovery_inventory_manifest_prefix.startswith('/') \
+        or (discovery_inventory_bucket_name and not discovery_inventory_manifest_prefix): 
+        raise Exception("\nInvalid input for 'discovery.inventory_manifest_prefix'")
+    # Download
+    if not isinstance(download_max_concurrency, int) or download_max_concurrency < 1: raise Exception("\nInvalid input for 'download.max_concurrency'")
+    if not isinstance(download_initial_concurrency, int) or download_initial_concurrency < 1 \
+        or download_initial_concurrency > download_max_concurrency: 
+        raise Exception("\nInvalid input for 'download.initial_concurrency'")
+    if not isinstance(download_range_size_mb, int) or download_range_size_mb < 0: raise Exception("\nInvalid input for 'download.range_size_mb'")
+    if not isinstance(download_small_object_size_kb, int) or download_small_object_size_kb < 0: raise Exception("\nInvalid input for 'download.small_object_size_kb'")
+    if not isinstance(download_small_object_batch_size, int) or download_small_object_batch_size < 1: raise Exception("\nInvalid input for 'download.small_object_batch_size'")
+    # Incremental
+    if incremental_mode not in ('series', 'objects'): raise Exception("\nInvalid input for 'incremental.mode'")
+    # Merge
+    if merge_mode not in ('block', 'record'): raise Exception("\nInvalid input for 'merge.mode'")
+    if not isinstance(merge_target_file_size_mb, int) or merge_target_file_size_mb < 0: raise Exception("\nInvalid input for 'merge.target_file_size_mb'")
+    if not isinstance(merge_sort_output, bool): raise Exception("\nInvalid input for 'merge.sort_output'")
+    if not isinstance(merge_deduplicate, bool): raise Exception("\nInvalid input for 'merge.deduplicate'")
+    if not isinstance(merge_dedup_memory_budget_mb, int) or merge_dedup_memory_budget_mb < 1: raise Exception("\nInvalid input for 'merge.dedup_memory_budget_mb'")
+    if merge_output_format not in ('avro', 'parquet'): raise Exception("\nInvalid input for 'merge.output_format'")
+    if not isinstance(merge_parquet_row_group_size, int) or merge_parquet_row_group_size < 1: raise Exception("\nInvalid input for 'merge.parquet_row_group_size'")
+    if not isinstance(merge_bucket_count, int) or merge_bucket_count < 0: raise Exception("\nInvalid input for 'merge.bucket_count'")
+    if merge_avro_engine not in ('auto', 'fastavro', 'avro'): raise Exception("\nInvalid input for 'merge.avro_engine'")
+    # Pipeline
+    if not isinstance(pipeline_enabled, bool): raise Exception("\nInvalid input for 'pipeline.enabled'")
+    if not isinstance(pipeline_queue_depth, int) or pipeline_queue_depth < 1: raise Exception("\nInvalid input for 'pipeline.queue_depth'")
+    # Streaming
+    if not isinstance(streaming_enabled, bool): raise Exception("\nInvalid input for 'streaming.enabled'")
+    if not isinstance(streaming_memory_budget_mb, int) or streaming_memory_budget_mb < 0: raise Exception("\nInvalid input for 'streaming.memory_budget_mb'")
+    # Upload
+    if not isinstance(upload_multipart_enabled, bool): raise Exception("\nInvalid input for 'upload.multipart_enabled'")
+    if not isinstance(upload_part_size_mb, int) or upload_part_size_mb < 5: raise Exception("\nInvalid input for 'upload.part_size_mb'")
+    if not isinstance(upload_max_concurrency, int) or upload_max_concurrency < 1: raise Exception("\nInvalid input for 'upload.max_concurrency'")
+    # Metrics
+    if not isinstance(metrics_enabled, bool): raise Exception("\nInvalid input for 'metrics.enabled'")
+    if not isinstance(metrics_namespace, str) or not metrics_namespace: raise Exception("\nInvalid input for 'metrics.namespace'")
+    if not isinstance(metrics_profile_merge, bool): raise Exception("\nInvalid input for 'metrics.profile_merge'")
+    if not isinstance(metrics_profile_prefix, str) or not metrics_profile_prefix or metrics_profile_prefix.startswith('/') \
+            or not metrics_profile_prefix.endswith('/'): 
+        raise Exception("\nInvalid input for 'metrics.profile_prefix'")
+    # Compaction
+    if not isinstance(compaction_max_files_per_day, int) or compaction_max_files_per_day < 1: raise Exception("\nInvalid input for 'compaction.max_files_per_day'")
+    if not isinstance(compaction_small_file_size_mb, int) or compaction_small_file_size_mb < 0: raise Exception("\nInvalid input for 'compaction.small_file_size_mb'")
+    if not isinstance(compaction_min_small_files, int) or compaction_min_small_files < 2: raise Exception("\nInvalid input for 'compaction.min_small_files'")
     # Glue
     if not glue_assets_bucket: raise Exception("\nInvalid input for 's3.glue_assets.bucket_name'")  
     if not glue_assets_scripts_prefix or glue_assets_scripts_prefix.startswith('/') \
             or not glue_assets_scripts_prefix.endswith('/'): 
-        raise Exception("\nInvalid input for 's3.glue_assets.scripts_prefix'")
\ No newline at end of file
+        raise Exception("\nInvalid input for 's3.glue_assets.scripts_prefix'")
+    if not glue_assets_status_prefix or glue_assets_status_prefix.startswith('/') \
+            or not glue_assets_status_prefix.endswith('/'): 
+        raise Exception("\nInvalid input for 's3.glue_assets.status_prefix'")
\ No newline at end of file
@@ -0,0 +1,97 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import math
+import heapq
+import itertools
+from typing import List, Dict, Iterator
+from . import avro_container as avro_container_helper
+from . import parquet as parquet_helper
+from . import merge as merge_helper
+
+def unindexed_file(name: str, size: int) -> Dict:
+    """Entry of a data file missing from the index of its day, written by
+    a run that predates the index. Its record count and series are unknown
+    """
+    return {'name': name, 'bytes': size, 'records': None}
+
+def select_files_to_compact(file_index: Dict, extension: str, max_files: int, small_file_size: int, min_small_files: int, 
+                            target_file_size: int = 0, bucket_count: int = 0, unindexed_files: List[Dict] = ()) -> List[Dict]:
+    """Select the data files of a day partition to compact, out of the 
+    files of the index and the unindexed files in the format provided. A
+    day holding more than max_files files has all of them compacted, 
+    otherwise only its small files once there are at least min_small_files
+    of them, along with all the unindexed files so that the index of the
+    compacted day lists all its files. Returns an empty list when the day
+    doesn't need compaction, or when compacting into files of the target
+    size, at least one per bucket, wouldn't reduce the number of files
+    """
+    unindexed_files = [file for file in unindexed_files if file['name'].endswith(extension)]
+    files = [file for file in file_index['files'] if file['name'].endswith(extension)] + unindexed_files
+    if len(files) <= max_files:
+        files = [file for file in files if file['bytes'] < small_file_size]
+        if len(files) < max(min_small_files, 2): return []
+        files += [file for file in unindexed_files if file['bytes'] >= small_file_size]
+    compacted_file_count = math.ceil(sum(file['bytes'] for file in files) / target_file_size) if target_file_size else 1
+    compacted_file_count = max(compacted_file_count, bucket_count)
+    return files if compacted_file_count < len(files) else []
+
+def iter_file_records(file: Dict, open_file, schema) -> Iterator[Dict]:
+    f = open_file(file['name'])
+    if file['name'].endswith('.parquet'): return parquet_helper.iter_parquet_records(f)
+    return avro_container_helper.iter_container_records(f, schema)
+
+def count_file_records(file: Dict, open_file) -> int:
+    """Count the records of a data file from the headers of its AVRO 
+    blocks or its Parquet metadata, without decoding them
+    """
+    f = open_file(file['name'])
+    if file['name'].endswith('.parquet'):
+        record_count = parquet_helper.count_parquet_records(f)
+        f.close()
+        return record_count
+    reader = avro_container_helper.AvroContainerReader(f)
+    record_count = sum(block_record_count for block_record_count, _ in reader.iter_blocks())
+    reader.close()
+    return record_count
+
+def append_records(records: Iterator[Dict], writer: merge_helper.ShardedWriter) -> int:
+    record_count = 0
+    for record in records:
+        if record['seriesId'] != writer.series_id: writer.start_series(record['seriesId'])
+        writer.append(record)
+        record_count += 1
+    return record_count
+
+def compact_files(files: List[Dict], writer, open_file, load_stats) -> int:
+    """Compact merged data files into the writer and return the number of
+    records written. Files that are all sorted are combined with a k-way
+    merge so the output stays sorted. Otherwise, the compressed blocks of
+    AVRO files are copied as-is along with the statistics recorded for 
+    them, loaded with load_stats, and Parquet records are appended file 
+    by file. Blocks are only copied into a bucketed writer from files of
+    the same bucket count, other files are split into buckets by record.
+    Unindexed files, whose series are unknown, are appended by record
+    """
+    if all(file.get('sorted', False) for file in files):
+        return append_records(heapq.merge(*[iter_file_records(file, open_file, writer.schema) for file in files], 
+                                          key=merge_helper.record_sort_key), writer)
+
+    record_count = 0
+    for file in files:
+        if file['name'].endswith('.parquet') or file['records'] is None or \
+                (isinstance(writer, merge_helper.BucketedWriter) and file.get('bucket_count') != writer.bucket_count):
+            record_count += append_records(iter_file_records(file, open_file, writer.schema), writer)
+            continue
+        stats = load_stats(file)
+        # Without a statistics sidecar, the ranges of the whole file are used for each block
+        file_ranges = {name: file[name] for name in ('series_min', 'series_max', 'time_min', 'time_max')}
+        blocks_stats = stats['blocks'] if stats else itertools.repeat(file_ranges)
+        writer.start_copied_series(file['series'])
+        reader = avro_container_helper.AvroContainerReader(open_file(file['name']))
+        for block_stats, (block_record_count, data) in zip(blocks_stats, reader.iter_blocks()):
+            writer.append_block(block_record_count, data, reader.codec, block_stats)
+            record_count += block_record_count
+        reader.close()
+        writer.start_copied_series(None)
+    return record_count
@@ -0,0 +1,132 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from typing import List, Dict
+
+def plan_download_tasks(s3_objects: List[Dict], range_size: int, small_object_size: int, 
+                        small_object_batch_size: int) -> List[tuple]:
+    """Plan the downloads of S3 objects with their size, largest first so
+    the largest objects don't make up the tail of the download. Objects 
+    larger than range_size are split into byte ranges, objects smaller 
+    than small_object_size are grouped into batches downloaded by the
+    same thread. Returns ('range', object, start, end) and ('objects', 
+    objects) tasks
+    """
+    tasks = []
+    small_objects = []
+    for s3_object in sorted(s3_objects, key=lambda s3_object: s3_object['Size'], reverse=True):
+        if range_size and s3_object['Size'] > range_size:
+            for start in range(0, s3_object['Size'], range_size):
+                tasks.append(('range', s3_object, start, min(start + range_size, s3_object['Size']) - 1))
+        elif s3_object['Size'] < small_object_size:
+            small_objects.append(s3_object)
+        else:
+            tasks.append(('objects', [s3_object]))
+    for i in range(0, len(small_objects), small_object_batch_size):
+        tasks.append(('objects', small_objects[i:i + small_object_batch_size]))
+    return tasks
+
+class RangedDownload:
+    """Byte ranges of an object downloaded concurrently into the same 
+    writer, which is closed once the last range is written
+    """
+    def __init__(self, s3_object: Dict, writer, range_count: int):
+        self.s3_object = s3_object
+        self.writer = writer
+        self.remaining_ranges = range_count
+        self.lock = threading.Lock()
+
+    def range_done(self) -> None:
+        with self.lock:
+            self.remaining_ranges -= 1
+            if self.remaining_ranges == 0: self.writer.close()
+
+    def abort(self) -> bool:
+        """Close the writer if some ranges were not written, returns True
+        if the object is incomplete
+        """
+        with self.lock:
+            if self.remaining_ranges == 0: return False
+            self.remaining_ranges = 0
+            self.writer.close()
+            return True
+
+class DownloadEngine:
+    """Download S3 objects with a long-lived pool of threads shared by all
+    days of the job, scheduled by plan_download_tasks. Keeps the achieved
+    throughput of every batch and of the whole job
+    """
+    def __init__(self, max_concurrency: int, range_size: int = 0, small_object_size: int = 0, small_object_batch_size: int = 1):
+        self.max_concurrency = max_concurrency
+        self.range_size = range_size
+        self.small_object_size = small_object_size
+        self.small_object_batch_size = small_object_batch_size
+        self.executor = ThreadPoolExecutor(max_concurrency, thread_name_prefix='download')
+        self.lock = threading.Lock()
+        self.total_stats = {'objects': 0, 'bytes': 0, 'seconds': 0.0}
+
+    def download(self, s3_objects: List[Dict], download_object, open_ranged_object=None, download_range=None,
+                 discard_ranged_object=None) -> Dict:
+        """Download all objects concurrently and return the number of 
+        objects, bytes and seconds taken. download_object is called with
+        an object and returns the number of bytes downloaded. For objects
+        split into byte ranges, open_ranged_object returns a writer for 
+        the object and download_range returns the bytes of a range. 
+        Pending downloads are cancelled on the first failure, which is
+        raised once the writers of the objects left incomplete are closed
+        and the objects handed to discard_ranged_object
+        """
+        download_start = time.time()
+        range_size = self.range_size if open_ranged_object and download_range else 0
+        tasks = plan_download_tasks(s3_objects, range_size, self.small_object_size, self.small_object_batch_size)
+        ranged_downloads = {}
+
+        def download_objects(objects: List[Dict]) -> int:
+            return sum(download_object(s3_object) for s3_object in objects)
+
+        def download_object_range(ranged_download: RangedDownload, s3_object: Dict, start: int, end: int) -> int:
+            data = download_range(s3_object, start, end)
+            ranged_download.writer.write_at(start, data)
+            ranged_download.range_done()
+            return len(data)
+
+        futures = []
+        done = set()
+        try:
+            for task in tasks:
+                if task[0] == 'objects':
+                    futures.append(self.executor.submit(download_objects, task[1]))
+                    continue
+                _, s3_object, start, end = task
+                if s3_object['Key'] not in ranged_downloads:
+                    range_count = -(-s3_object['Size'] // range_size)
+                    ranged_downloads[s3_object['Key']] = RangedDownload(s3_object, open_ranged_object(s3_object), range_count)
+                futures.append(self.executor.submit(download_object_range, ranged_downloads[s3_object['Key']], s3_object, start, end))
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        finally:
+            for future in futures: future.cancel()
+            # Ranges being downloaded are written before the writers are closed
+            wait(futures)
+            for ranged_download in ranged_downloads.values():
+                if ranged_download.abort() and discard_ranged_object: discard_ranged_object(ranged_download.s3_object)
+        # Raise the failure that stopped the downloads rather than the ones it caused
+        failed_futures = sorted((future for future in futures if not future.cancelled() and future.exception() is not None),
+                                key=lambda future: future not in done)
+        if failed_futures: raise failed_futures[0].exception()
+        stats = {'objects': len(s3_objects), 'bytes': sum(future.result() for future in futures if future.done()), 
+                 'ranged_objects': len(ranged_downloads), 'seconds': time.time() - download_start}
+        with self.lock:
+            for name in self.total_stats: self.total_stats[name] += stats[name]
+        return stats
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+def format_throughput(stats: Dict) -> str:
+    """Format the objects/sec and MB/s achieved by downloads
+    """
+    seconds = max(stats['seconds'], 0.001)
+    return f"{stats['objects'] / seconds:.1f} objects/s, {stats['bytes'] / 1048576 / seconds:.1f} MB/s"
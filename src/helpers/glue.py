@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: MIT-0
 
 from typing import List, Dict
+from botocore.exceptions import ClientError
 from . import common as common_helper
 
 # Create a Boto3 Glue client
@@ -21,6 +22,48 @@ def create_job(job_name: str, job_role: str, command: Dict, default_arguments: D
                     WorkerType=worker_type
                 )
             
+def upsert_job(job_name: str, job_role: str, command: Dict, default_arguments: Dict, tags: Dict, glue_version: str, 
+               worker_count: int, worker_type: str, max_concurrent_runs: int) -> None:
+    """Create a job allowing several concurrent runs, or update it if it
+    already exists
+    """
+    job_definition = {
+        'Role': job_role,
+        'Command': command,
+        'DefaultArguments': default_arguments,
+        'GlueVersion': glue_version,
+        'NumberOfWorkers': worker_count,
+        'WorkerType': worker_type,
+        'ExecutionProperty': {'MaxConcurrentRuns': max_concurrent_runs}
+    }
+    try:
+        glue_client.get_job(JobName=job_name)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'EntityNotFoundException': raise
+        glue_client.create_job(Name=job_name, Tags=tags, **job_definition)
+        return
+    glue_client.update_job(JobName=job_name, JobUpdate=job_definition)
+
+def start_job_run(job_name: str, arguments: Dict, worker_count: int, worker_type: str) -> str:
+    """Start a run of the job with the arguments and workers provided, 
+    returns the id of the run
+    """
+    response = glue_client.start_job_run(JobName=job_name, Arguments=arguments, 
+                                         NumberOfWorkers=worker_count, WorkerType=worker_type)
+    return response['JobRunId']
+
+def get_job_run_state(job_name: str, run_id: str) -> str:
+    """Get the state of a job run
+    """
+    return glue_client.get_job_run(JobName=job_name, RunId=run_id)['JobRun']['JobRunState']
+
+def is_capacity_error(error: Exception) -> bool:
+    """Check if starting a job run failed because too many runs are 
+    already in progress
+    """
+    return isinstance(error, ClientError) and error.response['Error']['Code'] in \
+        ('ConcurrentRunsExceededException', 'ResourceNumberLimitExceededException', 'ThrottlingException')
+
 def start_job(job_name: str) -> None:
     """Start the job based on job name provided
     """
@@ -46,11 +89,11 @@ def get_job_runs(job_name: str) -> List[Dict]:
     return job_run_list
 
 def get_job_run_status(job_name: str) -> str:
-    """Get the status of job run
+    """Get the status of the latest job run
     """
-    job_runs = get_job_runs(job_name)
+    # Runs are returned newest first, only the latest run is considered
+    job_runs = glue_client.get_job_runs(JobName=job_name, MaxResults=1)['JobRuns']
     job_run_status = None
-    # Only considering the first run
     if len(job_runs) > 0: job_run_status = job_runs[0]["JobRunState"]
     return job_run_status
 
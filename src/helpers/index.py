@@ -0,0 +1,117 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import json
+import zlib
+import hashlib
+from typing import List, Dict
+
+# Name of the index object listing the data files of a day partition
+FILE_INDEX_NAME = 'files.json'
+# Name of the index object listing the cold tier objects processed for a day partition
+MANIFEST_NAME = 'manifest.json'
+
+def stats_file_name(data_file_name: str) -> str:
+    """Name of the sidecar index object with the statistics of a data file
+    """
+    return f'{data_file_name}.stats.json'
+
+def series_bucket(series_id: str, bucket_count: int) -> int:
+    """Bucket of a series, the CRC-32 of its UTF-8 encoded seriesId modulo
+    the bucket count. In Athena: crc32(to_utf8(seriesId)) % bucket_count
+    """
+    return zlib.crc32(series_id.encode('utf-8')) % bucket_count
+
+def files_for_series(file_index: Dict, series_id: str) -> List[Dict]:
+    """Files of a day's index that can hold the series provided, from the
+    bucket of bucketed files and the series list of the other files
+    """
+    return [file for file in file_index['files'] 
+            if (series_bucket(series_id, file['bucket_count']) == file['bucket'] if 'bucket' in file else series_id in file['series'])]
+
+def data_file_digest(input_names: List[str], options: Dict) -> str:
+    """Digest of the inputs of a merge and the options changing its 
+    output, used to name the data files written so that merging the 
+    same inputs again writes files of the same name
+    """
+    content = json.dumps({'inputs': sorted(input_names), 'options': options}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+
+def load_file_index(file_path: str) -> Dict:
+    """Load a day's file index from a local file, or return an empty
+    index if it doesn't exist
+    """
+    if not os.path.exists(file_path): return {'files': []}
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+def add_files(file_index: Dict, shards: List[Dict], bucket_count: int = 0) -> Dict:
+    """Add the data files written by a merge to the day's file index,
+    along with their seriesId and time ranges, and their bucket out of
+    the bucket count when bucketed. Files of the same name already in the
+    index, written by a previous attempt, are replaced
+    """
+    shard_names = {shard['name'] for shard in shards}
+    file_index['files'] = [file for file in file_index['files'] if file['name'] not in shard_names]
+    for shard in shards:
+        stats = shard['stats']
+        file = {
+            'name': shard['name'],
+            'records': shard['records'],
+            'bytes': shard['bytes'],
+            'series': sorted(shard['series']),
+            'series_min': stats['series_min'],
+            'series_max': stats['series_max'],
+            'time_min': stats['time_min'],
+            'time_max': stats['time_max'],
+            'sorted': stats['sorted'],
+            'stats': stats_file_name(shard['name'])
+        }
+        if 'bucket' in shard: file.update({'bucket': shard['bucket'], 'bucket_count': bucket_count})
+        file_index['files'].append(file)
+    return file_index
+
+def write_stats_files(directory_path: str, shards: List[Dict]) -> List[str]:
+    """Write the statistics sidecar of each data file written by a merge
+    to a local directory and return their names
+    """
+    file_names = []
+    for shard in shards:
+        file_name = stats_file_name(shard['name'])
+        with open(f'{directory_path}/{file_name}', 'w') as f:
+            json.dump(shard['stats'], f, separators=(',', ':'))
+        file_names.append(file_name)
+    return file_names
+
+def write_file_index(file_path: str, file_index: Dict) -> None:
+    """Write a day's file index to a local file
+    """
+    with open(file_path, 'w') as f:
+        json.dump(file_index, f, separators=(',', ':'))
+
+def load_manifest(file_path: str) -> Dict:
+    """Load a day's manifest of processed cold tier objects from a local
+    file, or return an empty manifest if it doesn't exist. Objects are
+    keyed by their S3 key relative to the day prefix and hold their ETag,
+    size and record count
+    """
+    if not os.path.exists(file_path): return {'objects': {}}
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+def add_objects(manifest: Dict, new_objects: Dict[str, List], record_counts: Dict[str, int]) -> Dict:
+    """Add processed cold tier objects to the day's manifest. New objects
+    map relative keys to their ETag and size, record counts are keyed by
+    file name
+    """
+    for relative_key, (etag, size) in new_objects.items():
+        file_name = relative_key.split('/')[-1]
+        manifest['objects'][relative_key] = [etag, size, record_counts.get(file_name, 0)]
+    return manifest
+
+def write_manifest(file_path: str, manifest: Dict) -> None:
+    """Write a day's manifest to a local file
+    """
+    with open(file_path, 'w') as f:
+        json.dump(manifest, f, separators=(',', ':'))
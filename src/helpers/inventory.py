@@ -0,0 +1,87 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import io
+import re
+import csv
+import gzip
+import json
+from urllib.parse import unquote
+from typing import List, Dict
+from . import s3 as s3_helper
+
+INVENTORY_MANIFEST_NAME = 'manifest.json'
+# Optional fields of the inventory configuration read by the jobs, by CSV field name and Parquet column name
+OPTIONAL_FIELDS = {'Size': 'size', 'ETag': 'e_tag'}
+
+def find_latest_manifest_key(bucket: str, prefix: str) -> str:
+    """Find the key of the most recent S3 Inventory manifest under the
+    prefix. Manifests are stored in folders named after their creation 
+    time, so the last key in lexicographic order is the latest
+    """
+    if prefix.endswith(INVENTORY_MANIFEST_NAME): return prefix
+    manifest_keys = [key for key in s3_helper.get_all_s3_objects(bucket, prefix) if key.endswith(f'/{INVENTORY_MANIFEST_NAME}')]
+    if not manifest_keys: raise Exception(f"\nNo S3 Inventory manifest found at s3://{bucket}/{prefix}")
+    return max(manifest_keys)
+
+def iter_csv_objects(data: bytes, field_names: List[str]):
+    """Yield the key, ETag and size of the objects listed in a gzipped 
+    CSV inventory file. Keys are URL-encoded in CSV inventories
+    """
+    key_index = field_names.index('Key')
+    etag_index = field_names.index('ETag')
+    size_index = field_names.index('Size')
+    for row in csv.reader(io.TextIOWrapper(gzip.GzipFile(fileobj=io.BytesIO(data)), encoding='utf-8')):
+        yield {'Key': unquote(row[key_index]), 'ETag': row[etag_index], 'Size': int(row[size_index] or 0)}
+
+def iter_parquet_objects(data: bytes):
+    """Yield the key, ETag and size of the objects listed in a Parquet 
+    inventory file
+    """
+    import pyarrow.parquet as pq
+    table = pq.read_table(io.BytesIO(data), columns=['key', 'e_tag', 'size'])
+    for key, etag, size in zip(*(table.column(name).to_pylist() for name in ('key', 'e_tag', 'size'))):
+        yield {'Key': key, 'ETag': etag, 'Size': size or 0}
+
+def get_field_names(manifest: Dict) -> List[str]:
+    """Get the names of the fields listed by an inventory from the schema
+    of its manifest, the CSV header or the Parquet message schema
+    """
+    if manifest['fileFormat'] == 'CSV': return [name.strip() for name in manifest['fileSchema'].split(',')]
+    return re.findall(r'(?:required|optional|repeated)\s+\w+\s+(\w+)', manifest['fileSchema'])
+
+def check_optional_fields(manifest: Dict, manifest_uri: str) -> None:
+    """Check that the inventory lists the optional fields read by the jobs
+    """
+    field_names = get_field_names(manifest)
+    for csv_name, parquet_name in OPTIONAL_FIELDS.items():
+        if (csv_name if manifest['fileFormat'] == 'CSV' else parquet_name) not in field_names:
+            raise Exception(f"\nThe S3 Inventory at {manifest_uri} doesn't list the optional field '{csv_name}'. Add it to the "
+                            f"inventory configuration, or clear 'discovery.inventory_bucket_name' to list the objects instead")
+
+def get_inventory_objects(bucket: str, manifest_prefix: str, prefixes: List[str]) -> Dict[str, List[Dict]]:
+    """Get the objects listed in an S3 Inventory for each of the provided
+    prefixes, instead of listing them from the source bucket. Reads the
+    latest manifest under manifest_prefix, or the manifest itself
+    """
+    manifest_key = find_latest_manifest_key(bucket, manifest_prefix)
+    manifest = json.loads(s3_helper.get_s3_object_bytes(bucket, manifest_key))
+    file_format = manifest['fileFormat']
+    if file_format not in ('CSV', 'Parquet'): raise Exception(f"\nUnsupported S3 Inventory format '{file_format}'")
+    check_optional_fields(manifest, f's3://{bucket}/{manifest_key}')
+    field_names = get_field_names(manifest) if file_format == 'CSV' else None
+
+    s3_objects_per_prefix = {prefix: [] for prefix in prefixes}
+    prefix_lengths = sorted(set(len(prefix) for prefix in prefixes))
+    for inventory_file in manifest['files']:
+        data = s3_helper.get_s3_object_bytes(bucket, inventory_file['key'])
+        s3_objects = iter_csv_objects(data, field_names) if file_format == 'CSV' else iter_parquet_objects(data)
+        for s3_object in s3_objects:
+            for prefix_length in prefix_lengths:
+                prefix_objects = s3_objects_per_prefix.get(s3_object['Key'][:prefix_length])
+                if prefix_objects is not None:
+                    prefix_objects.append(s3_object)
+                    break
+    for s3_objects in s3_objects_per_prefix.values():
+        s3_objects.sort(key=lambda s3_object: s3_object['Key'])
+    return s3_objects_per_prefix
@@ -0,0 +1,447 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import heapq
+import pickle
+from typing import List, Dict, Iterator
+import avro.schema
+from . import avro_container as avro_container_helper
+from . import parquet as parquet_helper
+from . import index as index_helper
+
+# Approximate memory held by a decoded record, used to bound the records held per series when deduplicating
+DECODED_RECORD_BYTES = 800
+
+def record_sort_key(record: Dict) -> tuple:
+    """Key records are clustered by in sorted output
+    """
+    return (record['seriesId'], record['timeInSeconds'], record['offsetInNanos'])
+
+def record_version(record: Dict) -> int:
+    """Version of a record, records without a version are older than any
+    versioned record
+    """
+    return -1 if record['recordVersion'] is None else record['recordVersion']
+
+class FileStats:
+    """Collect the seriesId range, time range and record counts of a
+    merged file and of each of its blocks, along with the record count,
+    time range and byte ranges of each series. Time ranges are only known
+    when all records were decoded, not for blocks copied as-is
+    """
+    def __init__(self):
+        self.blocks = []
+        self.file_stats = self._empty_stats()
+        self.block_stats = self._empty_stats()
+        # Record count and time range of each series in the current block, and over the whole file with its byte ranges
+        self.block_series = {}
+        self.series = {}
+        self.last_sort_key = None
+        self.sorted = True
+
+    @staticmethod
+    def _empty_stats() -> Dict:
+        return {'series_min': None, 'series_max': None, 'time_min': None, 'time_max': None, 'time_known': True}
+
+    @staticmethod
+    def _empty_series_stats() -> Dict:
+        return {'records': 0, 'time_min': None, 'time_max': None, 'time_known': True}
+
+    @staticmethod
+    def _extend_time(stats: Dict, time: list = None) -> None:
+        if time is None: stats['time_known'] = False
+        else:
+            if stats['time_min'] is None or time < stats['time_min']: stats['time_min'] = time
+            if stats['time_max'] is None or time > stats['time_max']: stats['time_max'] = time
+
+    @staticmethod
+    def _extend(stats: Dict, series_id: str, time: list = None) -> None:
+        if stats['series_min'] is None or series_id < stats['series_min']: stats['series_min'] = series_id
+        if stats['series_max'] is None or series_id > stats['series_max']: stats['series_max'] = series_id
+        FileStats._extend_time(stats, time)
+
+    @staticmethod
+    def _finalize(stats: Dict) -> Dict:
+        time_known = stats.pop('time_known')
+        if not time_known: stats['time_min'] = stats['time_max'] = None
+        return stats
+
+    def _add_block_series(self, series_id: str, records: int, time_min: list = None, time_max: list = None) -> None:
+        series_stats = self.block_series.setdefault(series_id, self._empty_series_stats())
+        # The record count of a series is unknown once any of its records were attributed to it without being counted
+        series_stats['records'] = None if records is None or series_stats['records'] is None else series_stats['records'] + records
+        self._extend_time(series_stats, time_min)
+        if time_min is not None: self._extend_time(series_stats, time_max)
+
+    def add_record(self, record: Dict) -> None:
+        sort_key = record_sort_key(record)
+        if self.last_sort_key is not None and sort_key < self.last_sort_key: self.sorted = False
+        self.last_sort_key = sort_key
+        time = [record['timeInSeconds'], record['offsetInNanos']]
+        self._extend(self.block_stats, record['seriesId'], time)
+        self._extend(self.file_stats, record['seriesId'], time)
+        self._add_block_series(record['seriesId'], 1, time, time)
+
+    def add_copied_block(self, series_id: str) -> None:
+        # Records of copied blocks aren't decoded, so their order is unknown
+        self.sorted = False
+        self._extend(self.block_stats, series_id)
+        self._extend(self.file_stats, series_id)
+        # All records of the block belong to the series, they are counted once the block is written
+        self._add_block_series(series_id, 0)
+
+    def add_block_stats(self, block_stats: Dict, series_ids: List[str] = None) -> None:
+        """Extend the statistics with those recorded for a block copied 
+        from a merged file. Without the series of the block in its 
+        statistics, the block is attributed to all the series provided
+        """
+        self.sorted = False
+        for stats in (self.block_stats, self.file_stats):
+            for series_id in (block_stats['series_min'], block_stats['series_max']):
+                if series_id is None: continue
+                time_min = block_stats['time_min']
+                self._extend(stats, series_id, time_min)
+                if time_min is not None: self._extend(stats, series_id, block_stats['time_max'])
+        if 'series' in block_stats:
+            for series_id, (records, time_min, time_max) in block_stats['series'].items():
+                self._add_block_series(series_id, records, time_min, time_max)
+        else:
+            for series_id in series_ids or []: self._add_block_series(series_id, None)
+
+    def end_block(self, offset: int, length: int, record_count: int) -> None:
+        block = {'offset': offset, 'length': length, 'records': record_count}
+        block.update(self._finalize(self.block_stats))
+        # A copied block of a single series holds all the records of the block
+        if len(self.block_series) == 1:
+            series_stats = next(iter(self.block_series.values()))
+            if series_stats['records'] == 0: series_stats['records'] = record_count
+        block['series'] = {}
+        for series_id, block_series_stats in self.block_series.items():
+            block_series_stats = self._finalize(block_series_stats)
+            block['series'][series_id] = [block_series_stats['records'], block_series_stats['time_min'], block_series_stats['time_max']]
+            series_stats = self.series.setdefault(series_id, {**self._empty_series_stats(), 'ranges': []})
+            series_stats['records'] = None if block_series_stats['records'] is None or series_stats['records'] is None \
+                else series_stats['records'] + block_series_stats['records']
+            if block_series_stats['time_min'] is None: series_stats['time_known'] = False
+            else:
+                self._extend_time(series_stats, block_series_stats['time_min'])
+                self._extend_time(series_stats, block_series_stats['time_max'])
+            # Consecutive blocks of a series are read with a single range
+            ranges = series_stats['ranges']
+            if ranges and ranges[-1][1] == offset: ranges[-1][1] = offset + length
+            else: ranges.append([offset, offset + length])
+        self.blocks.append(block)
+        self.block_stats = self._empty_stats()
+        self.block_series = {}
+
+    def to_dict(self, file_name: str, record_count: int) -> Dict:
+        stats = {'file': file_name, 'records': record_count, 'sorted': self.sorted}
+        stats.update(self._finalize(self.file_stats))
+        stats['blocks'] = self.blocks
+        stats['series'] = {series_id: self._finalize(series_stats) for series_id, series_stats in sorted(self.series.items())}
+        return stats
+
+class ShardedWriter:
+    """Write merged data into one or more output files, rolling over to a
+    new file once the current one reaches the target size. Keeps track of
+    the series that landed in each file
+    """
+    def __init__(self, schema: avro.schema.Schema, open_shard, target_file_size: int = 0, codec: str = 'snappy',
+                 output_format: str = 'avro', parquet_row_group_size: int = 0):
+        self.schema = schema
+        self.open_shard = open_shard
+        self.target_file_size = target_file_size
+        self.codec = codec
+        self.output_format = output_format
+        self.parquet_row_group_size = parquet_row_group_size
+        self.shards = []
+        self.writer = None
+        self.series_id = None
+        self.copied_series_ids = None
+        self.record_count = 0
+        self.block_count = 0
+        self.blocks_recompressed = 0
+        self._open_next_shard()
+
+    def _open_next_shard(self) -> None:
+        if self.writer is not None: self._close_shard()
+        shard_index = len(self.shards)
+        file_name, f = self.open_shard(shard_index)
+        self.stats = FileStats()
+        if self.output_format == 'parquet':
+            self.writer = parquet_helper.ParquetWriter(f, self.schema, self.parquet_row_group_size, on_block=self.stats.end_block)
+        else:
+            self.writer = avro_container_helper.AvroContainerWriter(f, self.schema, codec=self.codec, on_block=self.stats.end_block)
+        self.shards.append({'name': file_name, 'records': 0, 'bytes': 0, 'series': set(), 'stats': None})
+
+    def _close_shard(self) -> None:
+        self.writer.close()
+        shard = self.shards[-1]
+        shard['records'] = self.writer.record_count
+        shard['bytes'] = self.writer.tell()
+        shard['stats'] = self.stats.to_dict(shard['name'], self.writer.record_count)
+        self.record_count += self.writer.record_count
+        self.block_count += self.writer.block_count
+        self.blocks_recompressed += self.writer.blocks_recompressed
+
+    def _roll_over_if_full(self) -> None:
+        # The next shard is only opened once more data is appended, so no shard is left empty
+        if self.target_file_size and self.writer.tell() >= self.target_file_size:
+            self._close_shard()
+            self.writer = None
+
+    def _open_shard_if_rolled_over(self) -> None:
+        if self.writer is not None: return
+        self._open_next_shard()
+        if self.series_id is not None: self.shards[-1]['series'].add(self.series_id)
+        if self.copied_series_ids: self.shards[-1]['series'].update(self.copied_series_ids)
+
+    def start_series(self, series_id: str) -> None:
+        """Attribute the data appended next to the series provided
+        """
+        self.series_id = series_id
+        if self.writer is not None: self.shards[-1]['series'].add(series_id)
+
+    def append_block(self, record_count: int, data: bytes, codec: str, block_stats: Dict = None) -> None:
+        """Append a compressed block, with the statistics recorded for it if
+        it comes from a merged file
+        """
+        # Blocks can only be copied as-is into AVRO output
+        if self.output_format != 'avro':
+            for record in avro_container_helper.iter_block_records(record_count, data, codec, self.schema):
+                self.append(record)
+            return
+        self._open_shard_if_rolled_over()
+        # Flush the buffered records first, so they end up in their own block
+        self.writer.flush()
+        if block_stats is not None: self.stats.add_block_stats(block_stats, self.copied_series_ids)
+        else: self.stats.add_copied_block(self.series_id)
+        self.writer.append_block(record_count, data, codec)
+        self._roll_over_if_full()
+
+    def start_copied_series(self, series_ids: List[str]) -> None:
+        """Attribute the blocks appended next to all the series provided,
+        for blocks copied from a merged file holding several series
+        """
+        self.copied_series_ids = series_ids
+        if series_ids and self.writer is not None: self.shards[-1]['series'].update(series_ids)
+
+    def append(self, record: Dict) -> None:
+        self._open_shard_if_rolled_over()
+        self.stats.add_record(record)
+        self.writer.append(record)
+        self._roll_over_if_full()
+
+    def close(self) -> None:
+        if self.writer is not None: self._close_shard()
+        self.writer = None
+
+    def closed_shards(self) -> List[Dict]:
+        """Shards completely written, excluding the one being written
+        """
+        return self.shards[:-1] if self.writer is not None else self.shards
+
+    def abort(self) -> None:
+        """Abort the output file being written if it supports it, like
+        a multipart upload
+        """
+        if self.writer is not None and hasattr(self.writer.f, 'abort'): self.writer.f.abort()
+        self.writer = None
+
+class BucketedWriter:
+    """Write merged data into one sharded writer per bucket, each series
+    going to the writer of the bucket its seriesId hashes to. Writers are
+    created with create_writer for the bucket once a series of the bucket
+    is written, so empty buckets have no files
+    """
+    def __init__(self, schema: avro.schema.Schema, bucket_count: int, create_writer):
+        self.schema = schema
+        self.bucket_count = bucket_count
+        self.create_writer = create_writer
+        self.writers = {}
+        self.writer = None
+        self.series_id = None
+
+    def _select_bucket(self, bucket: int) -> None:
+        if bucket not in self.writers: self.writers[bucket] = self.create_writer(bucket)
+        self.writer = self.writers[bucket]
+
+    def start_series(self, series_id: str) -> None:
+        self._select_bucket(index_helper.series_bucket(series_id, self.bucket_count))
+        self.series_id = series_id
+        self.writer.start_series(series_id)
+
+    def start_copied_series(self, series_ids: List[str]) -> None:
+        """Attribute the blocks appended next to all the series provided,
+        which must all hash to the same bucket
+        """
+        if series_ids:
+            buckets = {index_helper.series_bucket(series_id, self.bucket_count) for series_id in series_ids}
+            if len(buckets) > 1: raise ValueError('Copied blocks hold series of several buckets')
+            self._select_bucket(buckets.pop())
+        self.series_id = None
+        if self.writer is not None: self.writer.start_copied_series(series_ids)
+
+    def append(self, record: Dict) -> None:
+        self.writer.append(record)
+
+    def append_block(self, record_count: int, data: bytes, codec: str, block_stats: Dict = None) -> None:
+        self.writer.append_block(record_count, data, codec, block_stats)
+
+    def close(self) -> None:
+        for bucket, writer in self.writers.items():
+            writer.close()
+            for shard in writer.shards: shard['bucket'] = bucket
+        self.writer = None
+
+    def abort(self) -> None:
+        for writer in self.writers.values(): writer.abort()
+
+    def closed_shards(self) -> List[Dict]:
+        return [shard for bucket in sorted(self.writers) for shard in self.writers[bucket].closed_shards()]
+
+    @property
+    def shards(self) -> List[Dict]:
+        return [shard for bucket in sorted(self.writers) for shard in self.writers[bucket].shards]
+
+    @property
+    def record_count(self) -> int:
+        return sum(writer.record_count for writer in self.writers.values())
+
+    @property
+    def block_count(self) -> int:
+        return sum(writer.block_count for writer in self.writers.values())
+
+    @property
+    def blocks_recompressed(self) -> int:
+        return sum(writer.blocks_recompressed for writer in self.writers.values())
+
+def merge_avro_files(file_names: List[str], writer: ShardedWriter, mode: str = 'block',
+                     open_file=lambda file_name: open(file_name, 'rb'), release_file=None,
+                     series_id_from_file_name=None) -> Dict[str, int]:
+    """Merge AVRO files into the writer and return the number of records
+    merged per file. Files are opened with open_file and handed to 
+    release_file, if provided, once merged
+    """
+    record_counts = {}
+    for file_name in file_names:
+        if series_id_from_file_name: writer.start_series(series_id_from_file_name(file_name))
+        f = open_file(file_name)
+        if mode == 'block':
+            record_counts[file_name] = avro_container_helper.append_container_blocks(f, writer)
+        else:
+            record_counts[file_name] = avro_container_helper.append_container_records(f, writer)
+        if release_file: release_file(file_name)
+    return record_counts
+
+def iter_counted(records: Iterator[Dict], record_counts: Dict[str, int], file_name: str) -> Iterator[Dict]:
+    """Pass records through while counting them for the file
+    """
+    record_counts[file_name] = 0
+    for record in records:
+        record_counts[file_name] += 1
+        yield record
+
+def merge_avro_files_sorted(file_names: List[str], writer: ShardedWriter, series_id_from_file_name,
+                            open_file=lambda file_name: open(file_name, 'rb'), release_file=None) -> Dict[str, int]:
+    """Merge AVRO files into the writer sorted by seriesId, timeInSeconds
+    and offsetInNanos and return the number of records merged per file.
+    The files of each series are expected to be sorted already, and are
+    combined with a streaming k-way merge one series at a time
+    """
+    record_counts = {}
+    file_names_by_series = {}
+    for file_name in file_names:
+        file_names_by_series.setdefault(series_id_from_file_name(file_name), []).append(file_name)
+
+    for series_id in sorted(file_names_by_series):
+        writer.start_series(series_id)
+        series_file_names = file_names_by_series[series_id]
+        series_records = [iter_counted(avro_container_helper.iter_container_records(open_file(file_name), writer.schema), record_counts, file_name)
+                          for file_name in series_file_names]
+        for record in heapq.merge(*series_records, key=record_sort_key):
+            writer.append(record)
+        if release_file:
+            for file_name in series_file_names: release_file(file_name)
+    return record_counts
+
+def write_sorted_run(path: str, entries: List[tuple]) -> None:
+    """Write deduplication entries sorted by time, offset and descending 
+    version to a run file on the local disk
+    """
+    with open(path, 'wb') as f:
+        pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+        for entry in sorted(entries, key=lambda entry: entry[0]): pickler.dump(entry)
+
+def iter_sorted_run(path: str) -> Iterator[tuple]:
+    with open(path, 'rb') as f:
+        unpickler = pickle.Unpickler(f)
+        while True:
+            try: yield unpickler.load()
+            except EOFError: break
+    os.remove(path)
+
+def merge_avro_files_deduplicated(file_names: List[str], writer: ShardedWriter, series_id_from_file_name, 
+                                  memory_budget: int, spill_dir: str, open_file=lambda file_name: open(file_name, 'rb'), 
+                                  release_file=None, stats: Dict = None) -> Dict[str, int]:
+    """Merge AVRO files into the writer keeping only the record with the 
+    highest recordVersion for each seriesId, timeInSeconds and 
+    offsetInNanos, and return the number of records read per file. Among
+    records of the same version, the first one read is kept. Series are
+    deduplicated one at a time and written sorted like sorted output. When
+    the records of a series exceed the memory budget, they are spilled to
+    sorted runs in spill_dir and combined with an external k-way merge. 
+    Counts of dropped duplicates and spilled runs are added to stats
+    """
+    if stats is None: stats = {}
+    stats.setdefault('duplicates', 0)
+    stats.setdefault('spilled_runs', 0)
+    max_records_in_memory = max(memory_budget // DECODED_RECORD_BYTES, 1)
+    record_counts = {}
+    file_names_by_series = {}
+    for file_name in file_names:
+        file_names_by_series.setdefault(series_id_from_file_name(file_name), []).append(file_name)
+
+    for series_id in sorted(file_names_by_series):
+        writer.start_series(series_id)
+        series_file_names = file_names_by_series[series_id]
+        # Latest version of each point of the series so far, with the read order to keep the first of equal versions
+        latest = {}
+        run_paths = []
+        sequence = 0
+        read_count = 0
+        for file_name in series_file_names:
+            records = iter_counted(avro_container_helper.iter_container_records(open_file(file_name), writer.schema), record_counts, file_name)
+            for record in records:
+                read_count += 1
+                point = (record['timeInSeconds'], record['offsetInNanos'])
+                entry = latest.get(point)
+                if entry is None or record_version(record) > -entry[0][2]:
+                    latest[point] = ((point[0], point[1], -record_version(record), sequence), record)
+                sequence += 1
+                if len(latest) >= max_records_in_memory:
+                    run_paths.append(f'{spill_dir}/{series_id}-run{len(run_paths):04d}.pkl')
+                    write_sorted_run(run_paths[-1], list(latest.values()))
+                    latest = {}
+            if release_file: release_file(file_name)
+
+        written_count = 0
+        if run_paths:
+            stats['spilled_runs'] += len(run_paths)
+            in_memory_run = iter(sorted(latest.values(), key=lambda entry: entry[0]))
+            latest = None
+            entries = heapq.merge(*[iter_sorted_run(run_path) for run_path in run_paths], in_memory_run, key=lambda entry: entry[0])
+            previous_point = None
+            # Entries of the same point are ordered by descending version, only the first one is kept
+            for (time_in_seconds, offset_in_nanos, _, _), record in entries:
+                if (time_in_seconds, offset_in_nanos) == previous_point: continue
+                previous_point = (time_in_seconds, offset_in_nanos)
+                writer.append(record)
+                written_count += 1
+        else:
+            for point in sorted(latest):
+                writer.append(latest[point][1])
+                written_count += 1
+        stats['duplicates'] += read_count - written_count
+    return record_counts
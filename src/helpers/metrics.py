@@ -0,0 +1,148 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import io
+import json
+import time
+import pstats
+import cProfile
+import resource
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import List, Dict
+
+# Metrics emitted for each stage of a day, with their CloudWatch units
+METRIC_UNITS = {
+    'WallSeconds': 'Seconds',
+    'CpuSeconds': 'Seconds',
+    'Objects': 'Count',
+    'BytesIn': 'Bytes',
+    'BytesOut': 'Bytes',
+    'Records': 'Count',
+    'Duplicates': 'Count',
+    'RecordsPerSecond': 'Count/Second',
+    'PeakRssBytes': 'Bytes',
+    'DiskBytes': 'Bytes'
+}
+# Number of allocation sites written to the tracemalloc report
+TRACEMALLOC_TOP_COUNT = 25
+
+class StageTimer:
+    """Measure the wall time and the CPU time of the process over a stage.
+    When stages run concurrently, the CPU time includes the other stages
+    """
+    def __init__(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    def wall_seconds(self) -> float:
+        return time.perf_counter() - self.wall_start
+
+    def cpu_seconds(self) -> float:
+        return time.process_time() - self.cpu_start
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of the process so far
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class MetricsEmitter:
+    """Emit the metrics of each stage of each day as a JSON line in the
+    CloudWatch Embedded Metric Format. Metrics are published per stage,
+    the day and date range of the job are kept as properties so they
+    don't add dimensions
+    """
+    def __init__(self, namespace: str, properties: Dict, enabled: bool = True):
+        self.namespace = namespace
+        self.properties = properties
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.entries = []
+
+    def emit(self, day: str, stage: str, timer: StageTimer, objects: int = 0, bytes_in: int = 0, 
+             bytes_out: int = 0, records: int = 0, disk_bytes: int = 0, duplicates: int = 0) -> Dict:
+        wall_seconds = timer.wall_seconds()
+        metrics = {
+            'WallSeconds': round(wall_seconds, 3),
+            'CpuSeconds': round(timer.cpu_seconds(), 3),
+            'Objects': objects,
+            'BytesIn': bytes_in,
+            'BytesOut': bytes_out,
+            'Records': records,
+            'Duplicates': duplicates,
+            'RecordsPerSecond': round(records / wall_seconds, 1) if wall_seconds > 0 else 0,
+            'PeakRssBytes': peak_rss_bytes(),
+            'DiskBytes': disk_bytes
+        }
+        entry = {'Stage': stage, 'Day': day, **self.properties, **metrics}
+        with self.lock: self.entries.append(entry)
+        if self.enabled:
+            emf = {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': self.namespace,
+                        'Dimensions': [['Stage']],
+                        'Metrics': [{'Name': name, 'Unit': unit} for name, unit in METRIC_UNITS.items()]
+                    }]
+                },
+                **entry
+            }
+            print(json.dumps(emf, separators=(',', ':')), flush=True)
+        return entry
+
+    def stage_totals(self) -> Dict[str, Dict]:
+        """Sum the metrics of all days per stage
+        """
+        totals = {}
+        with self.lock: entries = list(self.entries)
+        for entry in entries:
+            stage_totals = totals.setdefault(entry['Stage'], {'Days': 0, 'WallSeconds': 0.0, 'CpuSeconds': 0.0, 'Objects': 0, 
+                                                               'BytesIn': 0, 'BytesOut': 0, 'Records': 0})
+            stage_totals['Days'] += 1
+            for name in ('WallSeconds', 'CpuSeconds', 'Objects', 'BytesIn', 'BytesOut', 'Records'): stage_totals[name] += entry[name]
+        return totals
+
+def format_stage_totals(totals: Dict[str, Dict]) -> List[str]:
+    lines = []
+    for stage, stage_totals in totals.items():
+        wall_seconds = stage_totals['WallSeconds']
+        mb_per_second = max(stage_totals['BytesIn'], stage_totals['BytesOut']) / 1048576 / wall_seconds if wall_seconds > 0 else 0
+        records_per_second = stage_totals['Records'] / wall_seconds if wall_seconds > 0 else 0
+        lines.append(f"{stage}: {stage_totals['Days']} days, {wall_seconds:.2f} secs wall, {stage_totals['CpuSeconds']:.2f} secs CPU, "
+                     f"{stage_totals['Objects']} objects, {stage_totals['BytesIn'] / 1048576:.1f} MB in, "
+                     f"{stage_totals['BytesOut'] / 1048576:.1f} MB out, {mb_per_second:.1f} MB/s, {records_per_second:.0f} records/s")
+    return lines
+
+@contextmanager
+def profile(enabled: bool, output_path_prefix: str):
+    """Profile the calling thread with cProfile and trace the memory 
+    allocations with tracemalloc, writing `<prefix>.prof` and 
+    `<prefix>.tracemalloc.txt`. Tracing allocations slows the profiled 
+    code down considerably
+    """
+    if not enabled:
+        yield
+        return
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak_traced_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        profiler.dump_stats(f'{output_path_prefix}.prof')
+        with open(f'{output_path_prefix}.tracemalloc.txt', 'w') as f:
+            f.write(f'Peak traced memory: {peak_traced_bytes / 1048576:.1f} MB\n')
+            for stat in snapshot.statistics('lineno')[:TRACEMALLOC_TOP_COUNT]: f.write(f'{stat}\n')
+
+def format_profile_summary(profile_path: str, count: int = 15) -> str:
+    """Top functions of a cProfile dump by cumulative time
+    """
+    output = io.StringIO()
+    pstats.Stats(profile_path, stream=output).sort_stats('cumulative').print_stats(count)
+    return output.getvalue()
@@ -0,0 +1,115 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+from typing import Dict, Iterator
+import avro.schema
+
+# Number of records converted to Arrow columns at a time
+BATCH_SIZE = 65536
+
+AVRO_TO_ARROW_TYPES = {
+    'string': 'string',
+    'long': 'int64',
+    'int': 'int32',
+    'double': 'float64',
+    'float': 'float32',
+    'boolean': 'bool_',
+    'bytes': 'binary'
+}
+
+def arrow_schema_from_avro(schema: avro.schema.Schema):
+    """Derive the Arrow schema of the Parquet columns from the fields of
+    the AVRO record schema. Unions with null become nullable columns
+    """
+    import pyarrow as pa
+    fields = []
+    for field in schema.to_json()['fields']:
+        field_type = field['type']
+        nullable = isinstance(field_type, list) and 'null' in field_type
+        if isinstance(field_type, list):
+            non_null_types = [t for t in field_type if t != 'null']
+            if len(non_null_types) != 1: raise Exception(f"\nUnsupported AVRO union for Parquet column '{field['name']}'")
+            field_type = non_null_types[0]
+        if field_type not in AVRO_TO_ARROW_TYPES: raise Exception(f"\nUnsupported AVRO type for Parquet column '{field['name']}'")
+        fields.append(pa.field(field['name'], getattr(pa, AVRO_TO_ARROW_TYPES[field_type])(), nullable=nullable))
+    return pa.schema(fields)
+
+def iter_parquet_records(f) -> Iterator[Dict]:
+    """Read the records of a Parquet file, a batch at a time
+    """
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(f).iter_batches(batch_size=BATCH_SIZE):
+        yield from batch.to_pylist()
+
+def count_parquet_records(f) -> int:
+    """Count the records of a Parquet file from its metadata
+    """
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(f).metadata.num_rows
+
+class ParquetWriter:
+    """Write merged records as a Parquet file with snappy compressed
+    columns. Records are buffered per column and converted to Arrow in
+    batches, then written out in row groups of row_group_size records
+    with column statistics
+    """
+    def __init__(self, f, schema: avro.schema.Schema, row_group_size: int, on_block=None):
+        import pyarrow.parquet as pq
+        self.f = f
+        self.schema = schema
+        self.arrow_schema = arrow_schema_from_avro(schema)
+        self.row_group_size = row_group_size
+        # Called with the offset, length and record count of each row group written
+        self.on_block = on_block
+        self.column_names = self.arrow_schema.names
+        self.columns = {name: [] for name in self.column_names}
+        self.buffered_records = 0
+        self.batches = []
+        self.batched_records = 0
+        self.record_count = 0
+        self.block_count = 0
+        self.blocks_recompressed = 0
+        self.bytes_written = 0
+        self.parquet_writer = pq.ParquetWriter(f, self.arrow_schema, compression='snappy', write_statistics=True)
+
+    def append(self, record: Dict) -> None:
+        for name in self.column_names:
+            self.columns[name].append(record.get(name))
+        self.buffered_records += 1
+        if self.batched_records + self.buffered_records >= self.row_group_size: self.flush()
+        elif self.buffered_records >= BATCH_SIZE: self._convert_batch()
+
+    def _convert_batch(self) -> None:
+        import pyarrow as pa
+        if self.buffered_records == 0: return
+        arrays = [pa.array(self.columns[field.name], type=field.type) for field in self.arrow_schema]
+        self.batches.append(pa.RecordBatch.from_arrays(arrays, schema=self.arrow_schema))
+        self.batched_records += self.buffered_records
+        self.columns = {name: [] for name in self.column_names}
+        self.buffered_records = 0
+
+    def flush(self) -> None:
+        """Write the buffered records as a row group
+        """
+        import pyarrow as pa
+        self._convert_batch()
+        if self.batched_records == 0: return
+        row_group_offset = self.f.tell()
+        self.parquet_writer.write_table(pa.Table.from_batches(self.batches), row_group_size=self.batched_records)
+        self.bytes_written = self.f.tell()
+        if self.on_block: self.on_block(row_group_offset, self.bytes_written - row_group_offset, self.batched_records)
+        self.record_count += self.batched_records
+        self.block_count += 1
+        self.batches = []
+        self.batched_records = 0
+
+    def tell(self) -> int:
+        """Get the number of bytes written, excluding buffered records
+        """
+        return self.bytes_written
+
+    def close(self) -> None:
+        self.flush()
+        self.parquet_writer.close()
+        self.bytes_written = self.f.tell()
+        self.f.close()
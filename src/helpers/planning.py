@@ -0,0 +1,106 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+from typing import List, Dict, Set
+
+# Glue worker types with their DPUs and the size of their local disk in GB
+GLUE_WORKER_TYPES = [('G.1X', 1, 64), ('G.2X', 2, 128), ('G.4X', 4, 256), ('G.8X', 8, 512)]
+# Local disk needed for a day relative to its raw data, for the raw files, the merged files and headroom
+DISK_USAGE_FACTOR = 3
+# Time for a Glue job to start and list the timeseries before processing days
+JOB_STARTUP_SECONDS = 60
+
+def timeseries_ids_from_keys(keys: List[str]) -> List[str]:
+    """Extract the timeseries ids of many S3 keys at once, the same way
+    the merge does
+    """
+    # Imported on first use, helpers.s3 creates its client when imported
+    from . import s3 as s3_helper
+    return list(map(s3_helper.timeseries_id_from_key, keys))
+
+def group_objects_by_timeseries(s3_objects: List[Dict], target_timeseries_ids: Set[str], 
+                                excluded_timeseries_ids: Set[str] = frozenset()) -> Dict[str, List[Dict]]:
+    """Group S3 objects per timeseries, keeping the timeseries that are 
+    part of the target set and not part of the excluded set. Timeseries 
+    and their objects keep the listing order
+    """
+    grouped_objects = {}
+    timeseries_ids = timeseries_ids_from_keys([s3_object['Key'] for s3_object in s3_objects])
+    for s3_object, timeseries_id in zip(s3_objects, timeseries_ids):
+        if timeseries_id not in target_timeseries_ids or timeseries_id in excluded_timeseries_ids: continue
+        timeseries_objects = grouped_objects.get(timeseries_id)
+        if timeseries_objects is None: grouped_objects[timeseries_id] = [s3_object]
+        else: timeseries_objects.append(s3_object)
+    return grouped_objects
+
+def group_changed_objects_by_timeseries(s3_objects: List[Dict], day_prefix: str, target_timeseries_ids: Set[str], 
+                                        previous_objects: Dict[str, List]) -> tuple:
+    """Group S3 objects per timeseries, keeping the objects of target 
+    timeseries that are either missing from the previous objects of the 
+    day's manifest or have a different ETag. Returns the grouped objects
+    and the number of changed objects
+    """
+    grouped_objects = group_objects_by_timeseries(s3_objects, target_timeseries_ids)
+    changed_count = 0
+    for timeseries_id in list(grouped_objects):
+        new_objects = []
+        for s3_object in grouped_objects[timeseries_id]:
+            previous_object = previous_objects.get(s3_object['Key'][len(day_prefix):])
+            if previous_object is None:
+                new_objects.append(s3_object)
+            elif previous_object[0] != s3_object['ETag']:
+                new_objects.append(s3_object)
+                changed_count += 1
+        if new_objects: grouped_objects[timeseries_id] = new_objects
+        else: del grouped_objects[timeseries_id]
+    return grouped_objects, changed_count
+
+def manifest_objects_of_timeseries(s3_objects: List[Dict], day_prefix: str, timeseries_ids: Set[str]) -> Dict[str, List]:
+    """Manifest entries of the S3 objects of the timeseries provided, keyed
+    by their key relative to the day prefix, with their ETag, their size 
+    and an unknown record count. Days merged before manifests were kept 
+    only list their timeseries, which were merged with all their objects
+    """
+    grouped_objects = group_objects_by_timeseries(s3_objects, timeseries_ids)
+    return {s3_object['Key'][len(day_prefix):]: [s3_object['ETag'], s3_object['Size'], None] 
+            for s3_object in flatten_grouped_objects(grouped_objects)}
+
+def flatten_grouped_objects(grouped_objects: Dict[str, List[Dict]]) -> List[Dict]:
+    """List the S3 objects of all timeseries, timeseries by timeseries
+    """
+    return [s3_object for timeseries_objects in grouped_objects.values() for s3_object in timeseries_objects]
+
+def plan_job_days(days: List, day_bytes: Dict, days_per_job: int, target_bytes_per_job: int = 0) -> List[List]:
+    """Split consecutive days into jobs of at most days_per_job days. With
+    a target, a job also ends before the day that would take its raw data
+    volume over the target, so each job covers a contiguous date range of
+    about the same volume
+    """
+    jobs = []
+    job_days = []
+    job_bytes = 0
+    for day in days:
+        if job_days and (len(job_days) >= days_per_job or 
+                         (target_bytes_per_job and job_bytes + day_bytes.get(day, 0) > target_bytes_per_job)):
+            jobs.append(job_days)
+            job_days = []
+            job_bytes = 0
+        job_days.append(day)
+        job_bytes += day_bytes.get(day, 0)
+    if job_days: jobs.append(job_days)
+    return jobs
+
+def pick_worker_type(max_day_bytes: int) -> str:
+    """Pick the smallest Glue worker type whose local disk can hold the 
+    largest day of a job
+    """
+    for worker_type, _, disk_gb in GLUE_WORKER_TYPES:
+        if max_day_bytes * DISK_USAGE_FACTOR <= disk_gb * 1024 ** 3: return worker_type
+    return GLUE_WORKER_TYPES[-1][0]
+
+def estimate_job_seconds(job_bytes: int, worker_type: str, throughput_mb_per_dpu: float) -> int:
+    """Estimate the runtime of a job from its raw data volume and the 
+    throughput of its worker type
+    """
+    dpu = next(dpu for name, dpu, _ in GLUE_WORKER_TYPES if name == worker_type)
+    return int(JOB_STARTUP_SECONDS + job_bytes / (throughput_mb_per_dpu * 1024 * 1024 * dpu))
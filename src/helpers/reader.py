@@ -0,0 +1,140 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import io
+import json
+import threading
+import avro.schema
+from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Iterator
+from . import globals
+from . import s3 as s3_helper
+from . import index as index_helper
+from . import avro_container as avro_container_helper
+
+# Load configuration
+config = globals.config
+
+# Blocks closer than this are fetched with a single ranged GET
+RANGE_COALESCE_GAP_BYTES = 256 * 1024
+
+def time_overlaps(time_min: list, time_max: list, start_time: int, end_time: int) -> bool:
+    """Check if a range of [timeInSeconds, offsetInNanos] overlaps the
+    time range in seconds, start included and end excluded. Unknown
+    ranges overlap any time range
+    """
+    if time_min is None or time_max is None: return True
+    return time_max[0] >= start_time and time_min[0] < end_time
+
+def coalesce_ranges(ranges: List[List[int]], max_gap: int) -> List[List[int]]:
+    """Merge byte ranges, start included and end excluded, that overlap
+    or are separated by at most max_gap bytes
+    """
+    coalesced = []
+    for start, end in sorted(ranges):
+        if coalesced and start <= coalesced[-1][1] + max_gap: coalesced[-1][1] = max(coalesced[-1][1], end)
+        else: coalesced.append([start, end])
+    return coalesced
+
+def select_blocks(stats: Dict, series_ids: List[str], start_time: int, end_time: int) -> List[Dict]:
+    """Select the blocks of a data file that can hold records of the series
+    in the time range, from the series recorded for each block or, for
+    statistics written without them, from the seriesId range of the block
+    """
+    blocks = []
+    for block in stats['blocks']:
+        if 'series' in block:
+            selected = any(series_id in block['series'] and time_overlaps(*block['series'][series_id][1:], start_time, end_time)
+                           for series_id in series_ids)
+        else:
+            selected = time_overlaps(block['time_min'], block['time_max'], start_time, end_time) and \
+                any(block['series_min'] <= series_id <= block['series_max'] for series_id in series_ids)
+        if selected: blocks.append(block)
+    return blocks
+
+class RepartitionedReader:
+    """Read the records of a few series over a time range from the AVRO
+    files of the repartitioned bucket. The file index and the statistics
+    sidecars of each day are used to fetch only the blocks that can hold
+    the series with ranged GETs, and only those blocks are decoded
+    """
+    def __init__(self, bucket: str = None, data_prefix: str = None, index_prefix: str = None, max_concurrency: int = 8):
+        repartitioned = config['s3']['repartitioned']
+        self.bucket = bucket or repartitioned['bucket_name']
+        self.data_prefix = data_prefix or repartitioned['data_prefix']
+        self.index_prefix = index_prefix or repartitioned['index_prefix']
+        self.max_concurrency = max_concurrency
+        self.stats = {'files': 0, 'requests': 0, 'bytes': 0, 'blocks': 0, 'records': 0}
+        # Files are read by several threads
+        self.lock = threading.Lock()
+
+    def _count(self, **counts) -> None:
+        with self.lock:
+            for name, count in counts.items(): self.stats[name] += count
+
+    def _load_index_object(self, key: str) -> Dict:
+        if not s3_helper.s3_prefix_exists(self.bucket, key): return None
+        self._count(requests=1)
+        return json.loads(s3_helper.get_s3_object_bytes(self.bucket, key))
+
+    def _get_range(self, key: str, start: int, end: int) -> bytes:
+        data = s3_helper.get_s3_object_range(self.bucket, key, start, end - 1)
+        self._count(requests=1, bytes=len(data))
+        return data
+
+    def plan_reads(self, series_ids: List[str], start_time: int, end_time: int) -> List[Dict]:
+        """List the AVRO data files that can hold records of the series in
+        the time range, in epoch seconds with the end excluded, along with
+        the blocks to read from each of them
+        """
+        reads = []
+        day = datetime.fromtimestamp(start_time, timezone.utc).date()
+        last_day = datetime.fromtimestamp(max(end_time - 1, start_time), timezone.utc).date()
+        while day <= last_day:
+            day_prefix = f'startYear={day.year}/startMonth={day.month}/startDay={day.day}/'
+            day = day + timedelta(days=1)
+            file_index = self._load_index_object(f'{self.index_prefix}{day_prefix}{index_helper.FILE_INDEX_NAME}')
+            if file_index is None: continue
+            files = {file['name']: file for series_id in series_ids for file in index_helper.files_for_series(file_index, series_id)}
+            for file_name, file in sorted(files.items()):
+                if not time_overlaps(file['time_min'], file['time_max'], start_time, end_time): continue
+                if not file_name.endswith('.avro'): raise Exception(f"\nCan't read '{day_prefix}{file_name}', only AVRO data files can be read by blocks")
+                stats = self._load_index_object(f'{self.index_prefix}{day_prefix}{file["stats"]}') if 'stats' in file else None
+                if stats is None or not stats['blocks']: continue
+                blocks = select_blocks(stats, series_ids, start_time, end_time)
+                if blocks: reads.append({'key': f'{self.data_prefix}{day_prefix}{file_name}', 'header_length': stats['blocks'][0]['offset'],
+                                         'blocks': blocks})
+        return reads
+
+    def _read_file(self, file_read: Dict, series_ids: List[str], start_time: int, end_time: int) -> List[Dict]:
+        header = avro_container_helper.AvroContainerReader(io.BytesIO(self._get_range(file_read['key'], 0, file_read['header_length'])))
+        schema = avro.schema.parse(header.schema_json)
+        block_offsets = {block['offset'] for block in file_read['blocks']}
+        ranges = coalesce_ranges([[block['offset'], block['offset'] + block['length']] for block in file_read['blocks']],
+                                 RANGE_COALESCE_GAP_BYTES)
+        records = []
+        for start, end in ranges:
+            f = io.BytesIO(self._get_range(file_read['key'], start, end))
+            offset = start
+            # Blocks between the selected ones, fetched to save requests, are skipped without being decompressed
+            for record_count, data in avro_container_helper.iter_container_blocks(f, header.sync_marker):
+                if offset in block_offsets:
+                    self._count(blocks=1)
+                    for record in avro_container_helper.iter_block_records(record_count, data, header.codec, schema):
+                        if record['seriesId'] in series_ids and start_time <= record['timeInSeconds'] < end_time: records.append(record)
+                offset = start + f.tell()
+        return records
+
+    def read(self, series_ids: List[str], start_time: int, end_time: int) -> Iterator[Dict]:
+        """Read the records of the series in the time range, in epoch
+        seconds with the end excluded. Files are read concurrently and
+        their records are yielded file by file, in the order of each file
+        """
+        series_ids = set(series_ids)
+        reads = self.plan_reads(sorted(series_ids), start_time, end_time)
+        self._count(files=len(reads))
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for records in executor.map(lambda file_read: self._read_file(file_read, series_ids, start_time, end_time), reads):
+                self._count(records=len(records))
+                yield from records
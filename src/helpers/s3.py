@@ -2,6 +2,13 @@
 # SPDX-License-Identifier: MIT-0
 
 import os
+import time
+import random
+import threading
+from contextlib import contextmanager
+from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 from . import globals
 from . import common as common_helper
@@ -18,8 +25,131 @@ local_tmp_raw_dir_name = 'raw'
 TMP_SITEWISE_PATH = f'/tmp/sitewise'
 local_tmp_raw_dir_path = f'{TMP_SITEWISE_PATH}/{local_tmp_raw_dir_name}'
 
-# Create an S3 client
-s3_client = common_helper.get_client('s3')
+# Create an S3 client shared by all threads, with a connection for each concurrent download and upload
+s3_client = common_helper.get_client('s3', max_pool_connections=max(config['download']['max_concurrency'], config['discovery']['max_concurrency'])
+                                           + config['upload']['max_concurrency'])
+
+# Managed transfers run in the calling thread, so a request holds a single slot of the concurrency limiters
+TRANSFER_CONFIG = TransferConfig(use_threads=False)
+
+# S3 requires all parts of a multipart upload but the last to be at least 5 MiB
+MIN_MULTIPART_PART_SIZE = 5 * 1024 * 1024
+
+# Error codes returned by S3 when the request rate is too high
+THROTTLING_ERROR_CODES = ('SlowDown', 'ServiceUnavailable', '503', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded')
+# Attempts made by the concurrency limiter once the retries of the client are exhausted
+MAX_THROTTLED_ATTEMPTS = 5
+# Minimum time between two decreases of the concurrency, so a burst of throttles only halves it once
+DECREASE_INTERVAL_SECONDS = 1.0
+
+def is_throttling_error(error: Exception) -> bool:
+    """Check if an exception was raised because S3 throttled the request
+    """
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+class AdaptiveConcurrencyLimiter:
+    """Limit the number of concurrent S3 requests with an AIMD algorithm.
+    The limit grows by one for every limit successful requests, up to 
+    max_concurrency, and is halved on throttles and errors, down to 
+    min_concurrency. Throttled requests are retried with a backoff
+    """
+    def __init__(self, name: str, initial_concurrency: int, max_concurrency: int, min_concurrency: int = 1):
+        self.name = name
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.peak_limit = self.limit
+        self.in_flight = 0
+        self.throttle_count = 0
+        self.error_count = 0
+        self.last_decrease_time = 0.0
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the concurrent request slots
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit): self.condition.wait()
+            self.in_flight += 1
+        try: yield
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify()
+
+    def on_success(self) -> None:
+        with self.condition:
+            previous_limit = int(self.limit)
+            self.limit = min(self.limit + 1 / self.limit, self.max_concurrency)
+            self.peak_limit = max(self.peak_limit, self.limit)
+            if int(self.limit) > previous_limit: self.condition.notify()
+
+    def _decrease(self) -> None:
+        now = time.monotonic()
+        if now - self.last_decrease_time < DECREASE_INTERVAL_SECONDS: return
+        self.limit = max(self.limit / 2, self.min_concurrency)
+        self.last_decrease_time = now
+
+    def on_throttle(self) -> None:
+        with self.condition:
+            self.throttle_count += 1
+            self._decrease()
+
+    def on_error(self) -> None:
+        with self.condition:
+            self.error_count += 1
+            self._decrease()
+
+    def call(self, function, *args, **kwargs):
+        """Call a function sending S3 requests within a slot, retrying it
+        with a backoff while it is throttled
+        """
+        for attempt in range(MAX_THROTTLED_ATTEMPTS):
+            try:
+                with self.slot(): result = function(*args, **kwargs)
+                self.on_success()
+                return result
+            except Exception as e:
+                if not is_throttling_error(e):
+                    self.on_error()
+                    raise
+                self.on_throttle()
+                if attempt == MAX_THROTTLED_ATTEMPTS - 1: raise
+                time.sleep(random.uniform(0, min(2 ** attempt, 20)))
+
+    def stats(self) -> Dict:
+        """Get the current and peak concurrency, and the number of 
+        throttles and errors
+        """
+        with self.condition:
+            return {'concurrency': int(self.limit), 'peak_concurrency': int(self.peak_limit), 
+                    'throttles': self.throttle_count, 'errors': self.error_count}
+
+    def format_stats(self) -> str:
+        stats = self.stats()
+        return (f"{self.name} concurrency {stats['concurrency']} (peak {stats['peak_concurrency']}, max {self.max_concurrency}), "
+                f"{stats['throttles']} throttles, {stats['errors']} errors")
+
+download_limiter = AdaptiveConcurrencyLimiter('Download', config['download']['initial_concurrency'], config['download']['max_concurrency'])
+upload_limiter = AdaptiveConcurrencyLimiter('Upload', config['upload']['max_concurrency'], config['upload']['max_concurrency'])
+
+def on_needs_retry(limiter: AdaptiveConcurrencyLimiter):
+    """Build a handler counting the throttles the client retries on its
+    own towards the limiter
+    """
+    def handler(response=None, **kwargs):
+        if response is None: return None
+        http_response, parsed = response
+        if http_response.status_code == 503 or parsed.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+            limiter.on_throttle()
+        return None
+    return handler
+
+for operation_name in ('GetObject', 'HeadObject'):
+    s3_client.meta.events.register(f'needs-retry.s3.{operation_name}', on_needs_retry(download_limiter))
+for operation_name in ('PutObject', 'CreateMultipartUpload', 'UploadPart', 'CompleteMultipartUpload'):
+    s3_client.meta.events.register(f'needs-retry.s3.{operation_name}', on_needs_retry(upload_limiter))
             
 def s3_prefix_exists(bucket: str, key: str) -> bool:
     """Check if a prefix exists
@@ -27,32 +157,70 @@ def s3_prefix_exists(bucket: str, key: str) -> bool:
     result = s3_client.list_objects_v2(Bucket=bucket, Prefix=key)
     return True if 'Contents' in result else False
 
-def list_s3_objects(bucket: str, prefix: str, StartAfter: str) -> List[str]:
-    """Get all S3 objects for the page
+def get_s3_object_size(bucket: str, key: str) -> int:
+    """Get the size of an S3 object, or None if it doesn't exist
     """
-    s3_object_keys=[]
+    try:
+        return s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'): return None
+        raise
+
+def list_s3_objects(bucket: str, prefix: str, StartAfter: str) -> List[Dict]:
+    """Get all S3 objects for the page with their key, ETag and size
+    """
+    s3_objects=[]
 
     response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix,
         StartAfter=StartAfter)
 
     if 'Contents' in response:
-        s3_object_keys = [obj["Key"] for obj in response["Contents"]]
-    return s3_object_keys, response["IsTruncated"]
+        s3_objects = [{'Key': obj['Key'], 'ETag': obj['ETag'].strip('"'), 'Size': obj['Size']} for obj in response["Contents"]]
+    return s3_objects, response["IsTruncated"]
+
+def get_all_s3_object_summaries(bucket: str, prefix: str) -> List[Dict]:
+    """Get all S3 objects for the provided prefix from all pages with 
+    their key, ETag and size
+    """
+    s3_objects_all=[]
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for response in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        if 'Contents' in response:
+            s3_objects_all.extend({'Key': obj['Key'], 'ETag': obj['ETag'].strip('"'), 'Size': obj['Size']} for obj in response['Contents'])
+    return s3_objects_all
+
+def get_all_s3_object_summaries_for_prefixes(bucket: str, prefixes: List[str], max_concurrency: int) -> Dict[str, List[Dict]]:
+    """Get all S3 objects for each of the provided prefixes, listing up 
+    to max_concurrency prefixes at a time
+    """
+    with ThreadPoolExecutor(max_concurrency) as executor:
+        s3_objects_per_prefix = executor.map(lambda prefix: get_all_s3_object_summaries(bucket, prefix), prefixes)
+        return dict(zip(prefixes, s3_objects_per_prefix))
+
+def get_s3_prefix_volume(bucket: str, prefix: str) -> tuple:
+    """Count the S3 objects and their bytes for the provided prefix 
+    without keeping the listing
+    """
+    object_count = 0
+    byte_count = 0
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for response in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in response.get('Contents', []):
+            object_count += 1
+            byte_count += obj['Size']
+    return object_count, byte_count
+
+def get_s3_prefix_volumes(bucket: str, prefixes: List[str], max_concurrency: int) -> Dict[str, tuple]:
+    """Count the S3 objects and their bytes for each of the provided 
+    prefixes, listing up to max_concurrency prefixes at a time
+    """
+    with ThreadPoolExecutor(max_concurrency) as executor:
+        return dict(zip(prefixes, executor.map(lambda prefix: get_s3_prefix_volume(bucket, prefix), prefixes)))
 
 def get_all_s3_objects(bucket: str, prefix: str) -> List[str]:
     """Get all S3 objects for the provided prefix from all pages
     """
-    s3_object_keys_all=[]
-    has_more_records=True
-    key_marker=""
-    
-    while has_more_records:
-        s3_object_keys,has_more_records = list_s3_objects(bucket, prefix, key_marker)
-        s3_object_keys_all.extend(s3_object_keys)
-        if len(s3_object_keys) > 0:
-            key_marker = s3_object_keys[-1]
-        
-    return s3_object_keys_all
+    return [s3_object['Key'] for s3_object in get_all_s3_object_summaries(bucket, prefix)]
 
 def filename_from_key(key: str) -> str:
     """Extract the filename from the S3 key
@@ -62,12 +230,13 @@ def filename_from_key(key: str) -> str:
     return file_name
 
 def timeseries_id_from_key(key: str) -> str:
-    """Extract timeseries id from the S3 key name
+    """Extract timeseries id from the S3 key name, the second token of the
+    file name split on '_', without allocating intermediate lists as it
+    runs for every key listed
     """
-    timeseries_id=""
-    file_name = filename_from_key(key)
-    timeseries_id = file_name.split('_')[1]
-    return timeseries_id
+    id_start = key.index('_', key.rfind('/') + 1) + 1
+    id_end = key.find('_', id_start)
+    return key[id_start:id_end] if id_end >= 0 else key[id_start:]
 
 def download_s3_objects(bucket: str, keys: List[str], day_wise_folder: str) -> None:
     """Download S3 objects based on the provided keys
@@ -78,20 +247,156 @@ def download_s3_objects(bucket: str, keys: List[str], day_wise_folder: str) -> N
         with open(file_path, 'w+b') as f:
             download_fileobj(bucket, key, f)
             
-def download_s3_object(bucket: str, key: str, day_wise_folder: str) -> None:
-    """Download S3 object for the provided key
+def download_s3_object(bucket: str, key: str, day_wise_folder: str) -> int:
+    """Download S3 object for the provided key, returns the number of 
+    bytes downloaded
     """
     file_name = filename_from_key(key)
-    timeseries_id = timeseries_id_from_key(key)
     with open(local_tmp_raw_dir_path + '/' + day_wise_folder + '/' + file_name, 'w+b') as f:
         download_fileobj(bucket, key, f)
+        return f.tell()
         
 def download_fileobj(bucket: str, key: str, f) -> None:
-    """Download file object
+    """Download file object within the download concurrency limit
+    """
+    def download():
+        f.seek(0)
+        f.truncate()
+        s3_client.download_fileobj(bucket, key, f, Config=TRANSFER_CONFIG)
+    download_limiter.call(download)
+
+def get_s3_object_body(bucket: str, key: str):
+    """Get the streaming body and the size of an S3 object
+    """
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    return response['Body'], response['ContentLength']
+
+def read_s3_object(bucket: str, key: str, read_function):
+    """Get an S3 object and read its streaming body and size with the 
+    function provided, within the download concurrency limit
+    """
+    return download_limiter.call(lambda: read_function(*get_s3_object_body(bucket, key)))
+
+def get_s3_object_range(bucket: str, key: str, start: int, end: int) -> bytes:
+    """Get an inclusive byte range of an S3 object within the download 
+    concurrency limit
     """
-    s3_client.download_fileobj(bucket, key, f)
+    return download_limiter.call(lambda: s3_client.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end}')['Body'].read())
+
+def get_s3_object_bytes(bucket: str, key: str) -> bytes:
+    """Get the content of a small S3 object
+    """
+    return s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+def put_s3_object(bucket: str, key: str, body: bytes) -> None:
+    """Write the content of a small S3 object
+    """
+    s3_client.put_object(Bucket=bucket, Key=key, Body=body)
+
+def delete_s3_object(bucket: str, key: str) -> None:
+    """Delete an S3 object
+    """
+    s3_client.delete_object(Bucket=bucket, Key=key)
+
+def delete_s3_objects(bucket: str, keys: List[str]) -> None:
+    """Delete S3 objects in batches of up to 1000 keys
+    """
+    for i in range(0, len(keys), 1000):
+        s3_client.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]], 'Quiet': True})
+
+def copy_s3_object(bucket: str, source_key: str, key: str) -> None:
+    """Copy an S3 object within the bucket without downloading it, in
+    parts for large objects
+    """
+    upload_limiter.call(s3_client.copy, {'Bucket': bucket, 'Key': source_key}, bucket, key, Config=TRANSFER_CONFIG)
 
 def upload_file_to_s3(bucket: str, local_file_path: str, s3_key: str) -> None:
-    """Upload a local file to S3 bucket
+    """Upload a local file to S3 bucket within the upload concurrency limit
     """
-    s3_client.upload_file(local_file_path, bucket, s3_key)
\ No newline at end of file
+    upload_limiter.call(s3_client.upload_file, local_file_path, bucket, s3_key, Config=TRANSFER_CONFIG)
+
+class MultipartUploadWriter:
+    """Writable file object that uploads an S3 object in parts while it is
+    being written. Up to max_concurrency parts are uploaded at a time, the
+    upload is completed on close and aborted on failure. Objects smaller 
+    than a part are uploaded with a single request
+    """
+    def __init__(self, bucket: str, key: str, part_size: int, max_concurrency: int):
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_MULTIPART_PART_SIZE)
+        self.buffer = bytearray()
+        self.bytes_written = 0
+        self.upload_id = None
+        self.part_futures = []
+        # Bounds the parts held in memory to the ones being uploaded
+        self.part_slots = threading.BoundedSemaphore(max_concurrency)
+        self.executor = ThreadPoolExecutor(max_concurrency)
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None: self.close()
+        else: self.abort()
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._submit_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def tell(self) -> int:
+        return self.bytes_written
+
+    def flush(self) -> None:
+        # Parts are only uploaded once they reach the part size
+        pass
+
+    def _submit_part(self, data: bytes) -> None:
+        # Fail early if a part already failed
+        for future in self.part_futures:
+            if future.done() and future.exception(): raise future.exception()
+        if self.upload_id is None:
+            self.upload_id = s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+        self.part_slots.acquire()
+        part_number = len(self.part_futures) + 1
+        self.part_futures.append(self.executor.submit(self._upload_part, part_number, data))
+
+    def _upload_part(self, part_number: int, data: bytes) -> Dict:
+        try:
+            response = upload_limiter.call(s3_client.upload_part, Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, 
+                                           PartNumber=part_number, Body=data)
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally: self.part_slots.release()
+
+    def close(self) -> None:
+        """Upload the remaining data and complete the upload
+        """
+        if self.closed: return
+        try:
+            if self.upload_id is None:
+                upload_limiter.call(s3_client.put_object, Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer))
+            else:
+                if self.buffer: self._submit_part(bytes(self.buffer))
+                parts = [future.result() for future in self.part_futures]
+                s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                    MultipartUpload={'Parts': parts})
+        except Exception:
+            self.abort()
+            raise
+        self.buffer = bytearray()
+        self.closed = True
+        self.executor.shutdown()
+
+    def abort(self) -> None:
+        """Abort the upload and discard the uploaded parts
+        """
+        if self.closed: return
+        self.closed = True
+        self.executor.shutdown(cancel_futures=True)
+        if self.upload_id is not None:
+            s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
@@ -2,10 +2,14 @@
 # SPDX-License-Identifier: MIT-0
 
 import os
+import gzip
+import json
 from typing import List, Dict
 import time
+from botocore.exceptions import ClientError
 from . import globals
 from . import common as common_helper
+from . import s3 as s3_helper
 
 dir = os.path.abspath(os.path.dirname(__file__))
 root_dir = os.path.abspath(os.path.dirname(os.path.dirname(dir)))
@@ -13,23 +17,50 @@ root_dir = os.path.abspath(os.path.dirname(os.path.dirname(dir)))
 # Load configuration
 config = globals.config
 timeseries_type = config['timeseries_type']
+catalog_ttl_seconds = config['catalog']['ttl_minutes'] * 60
+catalog_requests_per_second = config['catalog']['requests_per_second']
+glue_assets_bucket_name = config['s3']['glue_assets']['bucket_name']
+catalog_snapshot_key = f"{config['s3']['glue_assets']['scripts_prefix']}timeseries-catalog-{timeseries_type.lower()}.json.gz"
+
+# Maximum page size of ListTimeSeries
+LIST_TIMESERIES_PAGE_SIZE = 250
+MAX_THROTTLING_RETRIES = 8
 
 # Configure SiteWise client
 sw_client = common_helper.get_client('iotsitewise')
 
+# Time of the last ListTimeSeries request, used to pace the requests
+last_request_time = 0.0
+# Creation time of the catalog snapshot last loaded or published
+snapshot_created_at = None
+
+def wait_for_request_slot() -> None:
+    """Wait until the configured request rate allows the next 
+    ListTimeSeries request
+    """
+    global last_request_time
+    wait_seconds = last_request_time + 1 / catalog_requests_per_second - time.monotonic()
+    if wait_seconds > 0: time.sleep(wait_seconds)
+    last_request_time = time.monotonic()
+
 def get_timeseries_ids(next_token: str) -> List[str]:
-    """Get list of timeseries ids for the page
+    """Get list of timeseries ids for the page, retrying with an 
+    exponential backoff when throttled
     """
-    if len(next_token) > 0:
-        response = sw_client.list_time_series(timeSeriesType=timeseries_type, maxResults=50, nextToken=next_token)
-    else:
-        response = sw_client.list_time_series(timeSeriesType=timeseries_type, maxResults=50)
+    kwargs = {'timeSeriesType': timeseries_type, 'maxResults': LIST_TIMESERIES_PAGE_SIZE}
+    if len(next_token) > 0: kwargs['nextToken'] = next_token
+    for attempt in range(MAX_THROTTLING_RETRIES + 1):
+        wait_for_request_slot()
+        try:
+            response = sw_client.list_time_series(**kwargs)
+            break
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ThrottlingException' or attempt == MAX_THROTTLING_RETRIES: raise
+            time.sleep(min(2 ** attempt, 30))
         
-    #print(f'Total number of associated time series: {len(response["TimeSeriesSummaries"])}')
     timeseries_ids = [series["timeSeriesId"] for series in response["TimeSeriesSummaries"]]
     
     if "nextToken" in response:
-        #print(f'{next_token}, {type(response["nextToken"])}')
         return timeseries_ids, response["nextToken"]
     else: 
         return timeseries_ids, ""
@@ -42,9 +73,56 @@ def get_all_timeseries_ids() -> List[str]:
     next_token=""
     
     while has_more_records:
-        time.sleep(2)
         timeseries_ids,next_token = get_timeseries_ids(next_token)
         timeseries_ids_all.extend(timeseries_ids)
         has_more_records=False if next_token == "" else True
     
-    return timeseries_ids_all
\ No newline at end of file
+    return timeseries_ids_all
+
+def load_catalog_snapshot() -> Dict:
+    """Load the snapshot of the timeseries catalog from the Glue assets 
+    bucket, or return None if it doesn't exist or is older than the TTL
+    """
+    if catalog_ttl_seconds == 0: return None
+    if not s3_helper.s3_prefix_exists(glue_assets_bucket_name, catalog_snapshot_key): return None
+    snapshot = json.loads(gzip.decompress(s3_helper.get_s3_object_bytes(glue_assets_bucket_name, catalog_snapshot_key)))
+    if snapshot['timeseries_type'] != timeseries_type: return None
+    if time.time() - snapshot['created_at'] > catalog_ttl_seconds: return None
+    global snapshot_created_at
+    snapshot_created_at = snapshot['created_at']
+    return snapshot
+
+def publish_catalog_snapshot(timeseries_ids: List[str]) -> None:
+    """Publish a snapshot of the timeseries catalog to the Glue assets 
+    bucket
+    """
+    global snapshot_created_at
+    snapshot = {'timeseries_type': timeseries_type, 'created_at': int(time.time()), 'timeseries_ids': timeseries_ids}
+    s3_helper.put_s3_object(glue_assets_bucket_name, catalog_snapshot_key, 
+                            gzip.compress(json.dumps(snapshot, separators=(',', ':')).encode('utf-8')))
+    snapshot_created_at = snapshot['created_at']
+
+def get_timeseries_catalog(publish: bool = False) -> List[str]:
+    """Get the timeseries ids from the catalog snapshot if it is within 
+    the TTL, otherwise list them from SiteWise and optionally publish a
+    new snapshot
+    """
+    snapshot = load_catalog_snapshot()
+    if snapshot is not None:
+        print(f"Loaded timeseries catalog snapshot, {round((time.time() - snapshot['created_at']) / 60)} minutes old")
+        return snapshot['timeseries_ids']
+    timeseries_ids = get_all_timeseries_ids()
+    if publish and catalog_ttl_seconds > 0:
+        publish_catalog_snapshot(timeseries_ids)
+        print(f'Published timeseries catalog snapshot to s3://{glue_assets_bucket_name}/{catalog_snapshot_key}')
+    return timeseries_ids
+
+def refresh_catalog_snapshot() -> None:
+    """Publish a new snapshot of the timeseries catalog once the snapshot 
+    last loaded or published is older than half the TTL, so that jobs 
+    started from now on still find it within the TTL when they load it
+    """
+    if catalog_ttl_seconds == 0: return
+    if snapshot_created_at is not None and time.time() - snapshot_created_at < catalog_ttl_seconds / 2: return
+    publish_catalog_snapshot(get_all_timeseries_ids())
+    print(f'Refreshed timeseries catalog snapshot at s3://{glue_assets_bucket_name}/{catalog_snapshot_key}')
@@ -0,0 +1,174 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import time
+import threading
+from collections import deque
+from typing import List, Dict, Set
+from . import s3 as s3_helper
+
+# Minimum time between two status updates published by a job
+STATUS_PUBLISH_INTERVAL_SECONDS = 30
+# Time window over which the throughput of the fleet is measured
+THROUGHPUT_WINDOW_SECONDS = 600
+STAGES = ('download', 'merge', 'upload')
+
+def status_key(status_prefix: str, from_date: str, to_date: str, job_type: str = 'repartition') -> str:
+    """Key of the status object of the job processing the date range, 
+    jobs other than repartitioning publish under a prefix of their type
+    """
+    if job_type != 'repartition': status_prefix = f'{status_prefix}{job_type}/'
+    return f'{status_prefix}{from_date}_{to_date}.json'
+
+def checkpoint_key(status_prefix: str, from_date: str, to_date: str, job_type: str = 'repartition') -> str:
+    """Key of the checkpoint object of the job processing the date range
+    """
+    return status_key(f'{status_prefix}checkpoints/', from_date, to_date, job_type)
+
+class DayCheckpoints:
+    """Days completed by a job, kept as a small JSON object in the Glue
+    assets bucket until the job succeeds so that a retry of the job 
+    resumes after the days completed by previous attempts
+    """
+    def __init__(self, bucket: str, key: str):
+        self.bucket = bucket
+        self.key = key
+        self.lock = threading.Lock()
+        self.days = set()
+
+    def load(self) -> Set[str]:
+        """Load the days completed by previous attempts
+        """
+        self.days = set()
+        if s3_helper.s3_prefix_exists(self.bucket, self.key):
+            self.days = set(json.loads(s3_helper.get_s3_object_bytes(self.bucket, self.key))['days'])
+        return set(self.days)
+
+    def day_done(self, day: str) -> None:
+        with self.lock:
+            self.days.add(day)
+            body = json.dumps({'days': sorted(self.days)}, separators=(',', ':')).encode('utf-8')
+            s3_helper.put_s3_object(self.bucket, self.key, body)
+
+    def clear(self) -> None:
+        s3_helper.delete_s3_object(self.bucket, self.key)
+
+class JobStatus:
+    """Progress of a job, published as a small JSON object to the Glue 
+    assets bucket so the job controller can aggregate the progress of all
+    jobs. Bytes are planned once the objects of all days are listed, and
+    are done once processed or found to need no processing
+    """
+    def __init__(self, bucket: str, key: str, from_date: str, to_date: str):
+        self.bucket = bucket
+        self.key = key
+        self.lock = threading.Lock()
+        self.last_publish_time = 0.0
+        self.status = {
+            'from_date': from_date,
+            'to_date': to_date,
+            'state': 'RUNNING',
+            'started_at': int(time.time()),
+            'updated_at': int(time.time()),
+            'days_planned': 0,
+            'days_done': 0,
+            'planned_bytes': 0,
+            'done_bytes': 0,
+            'objects': 0,
+            'bytes': 0,
+            'stage_seconds': {stage: 0.0 for stage in STAGES},
+            'days': {}
+        }
+
+    def plan(self, days_planned: int, planned_bytes: int) -> None:
+        with self.lock:
+            self.status['days_planned'] = days_planned
+            self.status['planned_bytes'] = planned_bytes
+        self.publish(force=True)
+
+    def record_stage(self, day: str, stage: str, seconds: float, objects: int = 0, byte_count: int = 0) -> None:
+        """Record the duration of a stage for a day, along with the objects
+        and bytes it processed
+        """
+        with self.lock:
+            day_status = self.status['days'].setdefault(day, {'objects': 0, 'bytes': 0})
+            day_status[f'{stage}_seconds'] = round(seconds, 1)
+            day_status['objects'] += objects
+            day_status['bytes'] += byte_count
+            self.status['stage_seconds'][stage] += seconds
+            self.status['objects'] += objects
+            self.status['bytes'] += byte_count
+        self.publish()
+
+    def day_done(self, byte_count: int) -> None:
+        """Count a day and the listed bytes of the day as done
+        """
+        with self.lock:
+            self.status['days_done'] += 1
+            self.status['done_bytes'] += byte_count
+        self.publish()
+
+    def finish(self, state: str) -> None:
+        with self.lock: self.status['state'] = state
+        self.publish(force=True)
+
+    def publish(self, force: bool = False) -> None:
+        """Write the status object, at most once per publish interval 
+        unless forced
+        """
+        with self.lock:
+            if not force and time.time() - self.last_publish_time < STATUS_PUBLISH_INTERVAL_SECONDS: return
+            self.last_publish_time = time.time()
+            self.status['updated_at'] = int(time.time())
+            body = json.dumps(self.status, separators=(',', ':')).encode('utf-8')
+        s3_helper.put_s3_object(self.bucket, self.key, body)
+
+def load_job_status(bucket: str, key: str) -> Dict:
+    """Load the status object of a job, or return None if the job didn't
+    publish one yet
+    """
+    if not s3_helper.s3_prefix_exists(bucket, key): return None
+    return json.loads(s3_helper.get_s3_object_bytes(bucket, key))
+
+class FleetProgress:
+    """Aggregate the status of all jobs of a backfill into the overall 
+    progress, throughput and estimated time remaining
+    """
+    def __init__(self):
+        self.samples = deque()
+
+    def summarize(self, statuses: List[Dict], planned_bytes: List[int]) -> Dict:
+        """Summarize the statuses of the jobs, None for jobs without one, 
+        with the bytes planned for each job when known upfront
+        """
+        now = time.time()
+        done_bytes = sum(status['done_bytes'] for status in statuses if status)
+        # Jobs that didn't list their days yet count with the planned volume, if any
+        total_bytes = sum(status['planned_bytes'] if status and status['days_planned'] else (job_bytes or 0) 
+                          for status, job_bytes in zip(statuses, planned_bytes))
+        volume_known = all((status and status['days_planned']) or job_bytes is not None 
+                           for status, job_bytes in zip(statuses, planned_bytes))
+        self.samples.append((now, done_bytes))
+        while now - self.samples[0][0] > THROUGHPUT_WINDOW_SECONDS: self.samples.popleft()
+        window_seconds = now - self.samples[0][0]
+        bytes_per_second = (done_bytes - self.samples[0][1]) / window_seconds if window_seconds > 0 else 0
+        eta_seconds = (total_bytes - done_bytes) / bytes_per_second if volume_known and bytes_per_second > 0 else None
+        stage_seconds = {stage: sum(status['stage_seconds'][stage] for status in statuses if status) for stage in STAGES}
+        return {
+            'done_bytes': done_bytes,
+            'total_bytes': total_bytes if volume_known else None,
+            'objects': sum(status['objects'] for status in statuses if status),
+            'days_done': sum(status['days_done'] for status in statuses if status),
+            'mb_per_second': bytes_per_second / 1048576,
+            'eta_seconds': eta_seconds,
+            'stage_seconds': stage_seconds
+        }
+
+def format_fleet_summary(summary: Dict) -> str:
+    total = f"{summary['total_bytes'] / 1024 ** 3:.2f} GB ({summary['done_bytes'] / max(summary['total_bytes'], 1) * 100:.0f}%)" \
+        if summary['total_bytes'] is not None else 'unknown'
+    eta = f"{summary['eta_seconds'] / 60:.0f} min" if summary['eta_seconds'] is not None else 'n/a'
+    stages = ', '.join(f"{stage} {seconds / 60:.0f} min" for stage, seconds in summary['stage_seconds'].items())
+    return (f"{summary['days_done']} days, {summary['objects']} objects, {summary['done_bytes'] / 1024 ** 3:.2f} GB of {total} done "
+            f"at {summary['mb_per_second']:.1f} MB/s, ETA {eta} (time spent in {stages})")
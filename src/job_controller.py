@@ -7,9 +7,15 @@ import os
 import yaml
 from datetime import timedelta, datetime
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 import helpers.glue as glue_helper
 import helpers.common as common_helper
+import helpers.sitewise as sitewise_helper
+import helpers.s3 as s3_helper
+import helpers.planning as planning_helper
+import helpers.status as status_helper
 
 src_dir = os.path.abspath(os.path.dirname(__file__))
 root_dir = os.path.abspath(os.path.dirname(src_dir))
@@ -19,10 +25,18 @@ with open(f'{root_dir}/config.yml', 'r') as file:
     config = yaml.safe_load(file)
 common_helper.validate_config_inputs(config)
 
+# Interval between two checks of the job runs in flight
+RUN_POLL_SECONDS = 30
+# Delay before resubmitting a failed run, doubled on every attempt
+RUN_RETRY_BASE_SECONDS = 60
+RUN_RETRY_MAX_SECONDS = 900
+# Maximum number of run states and status objects fetched at a time
+MONITOR_MAX_CONCURRENCY = 16
+
 class GlueJobRunner:
     def __init__(self, job_name_prefix, glue_role_arn, days_per_job, 
                  from_date, to_date, glue_assets_bucket, 
-                 glue_assets_job_script_key, glue_assets_extra_py_key):
+                 glue_assets_job_script_key, glue_assets_extra_py_key, job_type='repartition'):
         self.job_name_prefix = job_name_prefix
         self.job_role = glue_role_arn
         self.glue_assets_job_script_key = glue_assets_job_script_key
@@ -31,66 +45,235 @@ class GlueJobRunner:
         self.glue_assets_bucket = glue_assets_bucket
         self.days_per_job = int(days_per_job)
         self.glue_assets_extra_py_key = glue_assets_extra_py_key
+        self.job_type = job_type
+        self.status_prefix = config['s3']['glue_assets']['status_prefix']
+        self.started_at = int(time.time())
+        self.fleet_progress = status_helper.FleetProgress()
+        self.succeeded_statuses = {}
 
     def run_jobs(self, job_id):
         response = glue_helper.run_job(
             JobName=job_id)
         
-    def check_status(self, job_names):
-        job_count = len(job_names)
-        # Loop to check overall status periodically
+    def job_status_key(self, job: Dict) -> str:
+        return status_helper.status_key(self.status_prefix, job['from_date'].strftime('%Y-%m-%d'), 
+                                        job['to_date'].strftime('%Y-%m-%d'), self.job_type)
+
+    def fetch_job_statuses(self, jobs: List[Dict]) -> List[Dict]:
+        """Fetch the status objects published by the jobs concurrently. 
+        Statuses left by earlier executions for the same date ranges are
+        ignored, and the final status of succeeded jobs is only fetched once
+        """
+        def fetch(job):
+            key = self.job_status_key(job)
+            if key in self.succeeded_statuses: return self.succeeded_statuses[key]
+            status = status_helper.load_job_status(self.glue_assets_bucket, key)
+            if not status or status['started_at'] < self.started_at: return None
+            if status['state'] == 'SUCCEEDED': self.succeeded_statuses[key] = status
+            return status
+        with ThreadPoolExecutor(max_workers=MONITOR_MAX_CONCURRENCY) as executor:
+            return list(executor.map(fetch, jobs))
+
+    def print_fleet_progress(self, jobs: List[Dict], statuses: List[Dict]) -> None:
+        summary = self.fleet_progress.summarize(statuses, [job['bytes'] for job in jobs])
+        print(f'\tFleet: {status_helper.format_fleet_summary(summary)}')
+
+    def monitor_jobs(self, created_jobs: List[tuple]) -> None:
+        """Check the latest run of the created jobs until all have ended,
+        printing the progress of the whole backfill from the status 
+        objects published by the jobs
+        """
+        job_count = len(created_jobs)
+        job_run_states = {}
         while True:
-            job_run_ended_count = 0
-            job_run_success_count = 0
-            for job_name in job_names:
-                job_status = glue_helper.get_job_run_status(job_name)
-                if glue_helper.is_end_status(job_status): 
-                    job_run_ended_count+=1
-                    if job_status == 'SUCCEEDED': job_run_success_count+=1
+            # Only the jobs still running are checked again
+            running_job_names = [job_name for job_name, _ in created_jobs 
+                                 if not glue_helper.is_end_status(job_run_states.get(job_name))]
+            with ThreadPoolExecutor(max_workers=MONITOR_MAX_CONCURRENCY) as executor:
+                job_run_states.update(zip(running_job_names, executor.map(glue_helper.get_job_run_status, running_job_names)))
+            jobs = [job for _, job in created_jobs]
+            self.print_fleet_progress(jobs, self.fetch_job_statuses(jobs))
+            job_run_ended_count = sum(1 for state in job_run_states.values() if glue_helper.is_end_status(state))
             if job_count == job_run_ended_count: 
                 print(f'\nEnded executing all {job_count} jobs!')
                 break
             print(f'\tProgress: {job_run_ended_count} out of {job_count} jobs ended')
-            time.sleep(30)
+            time.sleep(RUN_POLL_SECONDS)
+        job_run_success_count = sum(1 for state in job_run_states.values() if state == 'SUCCEEDED')
         print(f'Total Jobs: {job_count}, Successful Jobs: {job_run_success_count}')
+        for job_name, _ in created_jobs:
+            if job_run_states[job_name] != 'SUCCEEDED': print(f'\t{job_run_states[job_name]} - {job_name}')
+
+    def measure_day_volumes(self, days: List) -> Dict:
+        """List the cold tier objects of each day to get their count and
+        bytes
+        """
+        cold_tier = config['s3']['cold_tier']
+        day_prefixes = {day: f'{cold_tier["data_prefix"]}startYear={day.year}/startMonth={day.month}/startDay={day.day}/' for day in days}
+        prefix_volumes = s3_helper.get_s3_prefix_volumes(cold_tier['bucket_name'], list(day_prefixes.values()), 
+                                                         config['discovery']['max_concurrency'])
+        return {day: prefix_volumes[prefix] for day, prefix in day_prefixes.items()}
+
+    def plan_jobs(self) -> List[Dict]:
+        """Plan the date range, worker type and worker count of each job,
+        along with its volume and estimated runtime from the volume of its
+        days measured in the cold tier bucket
+        """
+        jobs_config = config['jobs']
+        target_bytes_per_job = int(jobs_config['target_gb_per_job'] * 1024 ** 3)
+        days = [self.from_date + timedelta(days=i) for i in range((self.to_date - self.from_date).days + 1)]
+        day_volumes = self.measure_day_volumes(days)
+        day_bytes = {day: byte_count for day, (_, byte_count) in day_volumes.items()}
+
+        jobs = []
+        for job_days in planning_helper.plan_job_days(days, day_bytes, self.days_per_job, target_bytes_per_job):
+            job = {
+                'from_date': job_days[0],
+                'to_date': job_days[-1],
+                'days': len(job_days),
+                'objects': sum(day_volumes[day][0] for day in job_days),
+                'bytes': sum(day_bytes[day] for day in job_days),
+                'worker_count': jobs_config['worker_count']
+            }
+            if jobs_config['worker_type'] == 'auto':
+                job['worker_type'] = planning_helper.pick_worker_type(max(day_bytes[day] for day in job_days))
+            else:
+                job['worker_type'] = jobs_config['worker_type']
+            job['estimated_seconds'] = planning_helper.estimate_job_seconds(job['bytes'], job['worker_type'], 
+                jobs_config['throughput_mb_per_dpu'])
+            jobs.append(job)
+        return jobs
+
+    def print_plan(self, jobs: List[Dict]) -> None:
+        for job in jobs:
+            print(f"\t{job['from_date'].strftime('%Y-%m-%d')} to {job['to_date'].strftime('%Y-%m-%d')}: {job['days']} days, "
+                  f"{job['objects']} objects, {job['bytes'] / 1024 ** 3:.2f} GB, ~{math.ceil(job['estimated_seconds'] / 60)} min, "
+                  f"{job['worker_count']} x {job['worker_type']}")
+
+    def job_command(self) -> Dict:
+        return {
+                'Name': 'glueetl',
+                'ScriptLocation': f's3://{self.glue_assets_bucket}/{self.glue_assets_job_script_key}',
+                'PythonVersion': '3'
+            }
 
-    def create_jobs(self):
-        days_per_job = self.days_per_job
+    def job_default_arguments(self) -> Dict:
+        return {
+                '--job-language': 'python',
+                '--enable-metrics': '',
+                '--extra-py-files': f's3://{self.glue_assets_bucket}/{self.glue_assets_extra_py_key}',
+                '--additional-python-modules': 'python-snappy,fastavro==1.7.3'
+            }
+
+    def job_run_arguments(self, job: Dict) -> Dict:
+        """Arguments of the job processing a planned date range
+        """
+        return {
+                '--from-date': job['from_date'].strftime('%Y-%m-%d'),
+                '--to-date': job['to_date'].strftime('%Y-%m-%d'),
+                '--job-type': self.job_type
+            }
+
+    def create_jobs(self, jobs: List[Dict]) -> List[tuple]:
+        """Create and start a job for each planned date range, returns the
+        name of each job with its plan
+        """
         batch_timestamp = int(datetime.now().timestamp())
+        created_jobs = []
         
-        while self.from_date <= self.to_date:
-            from_date_str = self.from_date.strftime("%Y-%m-%d")
-            if self.from_date < self.to_date and self.days_per_job > 1:
-                to_date_str = (self.from_date + timedelta(days=days_per_job-1)).strftime("%Y-%m-%d")
-            elif self.from_date < self.to_date and self.days_per_job == 1:
-                to_date_str = from_date_str
-            else:
-                to_date_str = self.to_date.strftime("%Y-%m-%d")
+        for job in jobs:
+            from_date_str = job['from_date'].strftime("%Y-%m-%d")
+            to_date_str = job['to_date'].strftime("%Y-%m-%d")
             
-            job_name = f"{self.job_name_prefix}-{batch_timestamp}-{from_date_str}-{to_date_str}"
-            command = {
-                    'Name': 'glueetl',
-                    'ScriptLocation': f's3://{self.glue_assets_bucket}/{self.glue_assets_job_script_key}',
-                    'PythonVersion': '3'
-                } 
-            default_arguments = {
-                    '--job-language': 'python',
-                    '--enable-metrics': '',
-                    '--extra-py-files': f's3://{self.glue_assets_bucket}/{self.glue_assets_extra_py_key}',
-                    '--additional-python-modules': 'python-snappy',
-                    '--from-date': f"{from_date_str}",
-                    '--to-date': f"{to_date_str}"
-                }
+            job_type_suffix = f'-{self.job_type}' if self.job_type != 'repartition' else ''
+            job_name = f"{self.job_name_prefix}{job_type_suffix}-{batch_timestamp}-{from_date_str}-{to_date_str}"
+            default_arguments = self.job_default_arguments()
+            default_arguments.update(self.job_run_arguments(job))
             job_tags = {
                 'source': 'sitewise-repartitioning'
             }
-            response = glue_helper.create_job(job_name, self.job_role, command,
-                default_arguments, job_tags, '4.0', 2, 'G.2X')
+            response = glue_helper.create_job(job_name, self.job_role, self.job_command(),
+                default_arguments, job_tags, '4.0', job['worker_count'], job['worker_type'])
 
             print(f"\tCreated job {job_name}")
             glue_helper.start_job(job_name)
+            created_jobs.append((job_name, job))
             time.sleep(2)
-            self.from_date += timedelta(days=self.days_per_job)
+        return created_jobs
+
+    def run_queued_jobs(self, jobs: List[Dict]) -> None:
+        """Run the planned jobs as runs of a single job definition, keeping
+        at most jobs.max_concurrent_runs runs in flight. The next run is
+        started as soon as one ends, and failed runs are resubmitted with
+        an exponential backoff up to jobs.max_attempts attempts
+        """
+        max_concurrent_runs = config['jobs']['max_concurrent_runs']
+        max_attempts = config['jobs']['max_attempts']
+        job_name = self.job_name_prefix
+        glue_helper.upsert_job(job_name, self.job_role, self.job_command(), self.job_default_arguments(), 
+            {'source': 'sitewise-repartitioning'}, '4.0', config['jobs']['worker_count'], 
+            jobs[0]['worker_type'], max_concurrent_runs)
+        print(f'\tCreated or updated job {job_name}, running at most {max_concurrent_runs} runs at a time')
+
+        # Jobs waiting to run with the time they can start at, and runs in flight by run id
+        pending = deque({'job': job, 'attempt': 0, 'not_before': 0} for job in jobs)
+        in_flight = {}
+        succeeded = []
+        failed = []
+        while pending or in_flight:
+            # Runs load the catalog snapshot when they start, so it is refreshed before it expires in long backfills
+            if self.job_type == 'repartition' and pending and len(in_flight) < max_concurrent_runs:
+                sitewise_helper.refresh_catalog_snapshot()
+            # Start as many runs as slots are free
+            for _ in range(len(pending)):
+                if len(in_flight) >= max_concurrent_runs: break
+                queued_job = pending.popleft()
+                if queued_job['not_before'] > time.time():
+                    pending.append(queued_job)
+                    continue
+                job = queued_job['job']
+                date_range = f"{job['from_date'].strftime('%Y-%m-%d')} to {job['to_date'].strftime('%Y-%m-%d')}"
+                try:
+                    run_id = glue_helper.start_job_run(job_name, self.job_run_arguments(job), job['worker_count'], job['worker_type'])
+                except Exception as e:
+                    if not glue_helper.is_capacity_error(e): raise
+                    # Runs outside of this queue are using the capacity, try again at the next check
+                    queued_job['not_before'] = time.time() + RUN_POLL_SECONDS
+                    pending.appendleft(queued_job)
+                    break
+                queued_job['attempt'] += 1
+                in_flight[run_id] = queued_job
+                print(f"\tStarted run {run_id} for {date_range} (attempt {queued_job['attempt']} of {max_attempts})")
+
+            time.sleep(RUN_POLL_SECONDS)
+
+            # Check the runs in flight
+            run_ids = list(in_flight)
+            with ThreadPoolExecutor(max_workers=MONITOR_MAX_CONCURRENCY) as executor:
+                states = list(executor.map(lambda run_id: glue_helper.get_job_run_state(job_name, run_id), run_ids))
+            for run_id, state in zip(run_ids, states):
+                if not glue_helper.is_end_status(state): continue
+                queued_job = in_flight[run_id]
+                del in_flight[run_id]
+                job = queued_job['job']
+                date_range = f"{job['from_date'].strftime('%Y-%m-%d')} to {job['to_date'].strftime('%Y-%m-%d')}"
+                if state == 'SUCCEEDED':
+                    succeeded.append(job)
+                elif queued_job['attempt'] < max_attempts:
+                    retry_seconds = min(RUN_RETRY_BASE_SECONDS * 2 ** (queued_job['attempt'] - 1), RUN_RETRY_MAX_SECONDS)
+                    queued_job['not_before'] = time.time() + retry_seconds
+                    pending.append(queued_job)
+                    print(f"\tRun {run_id} for {date_range} ended with {state}, retrying in {retry_seconds} secs")
+                    continue
+                else:
+                    failed.append(job)
+                print(f"\tRun {run_id} for {date_range} ended with {state}")
+            print(f'\tProgress: {len(succeeded) + len(failed)} out of {len(jobs)} runs ended, {len(in_flight)} in flight')
+            self.print_fleet_progress(jobs, self.fetch_job_statuses(jobs))
+
+        print(f'\nTotal runs: {len(jobs)}, Successful runs: {len(succeeded)}, Failed runs: {len(failed)}')
+        for job in failed:
+            print(f"\tFAILED - {job['from_date'].strftime('%Y-%m-%d')} to {job['to_date'].strftime('%Y-%m-%d')}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -99,6 +282,10 @@ if __name__ == "__main__":
     parser.add_argument('days_per_job', help='Maximum days per ETL job')
     parser.add_argument('job_name_prefix', help='Prefix for job name')
     parser.add_argument('glue_role_arn', help='ARN of IAM role')
+    parser.add_argument('--dry-run', action='store_true', help='Print the plan of the jobs without creating them')
+    parser.add_argument('--monitor', action='store_true', help='Wait for the created jobs to end, printing their progress')
+    parser.add_argument('--job-type', choices=['repartition', 'compaction'], default='repartition', 
+                        help='Repartition the cold tier data, or compact the repartitioned data files of each day')
     args = parser.parse_args()
     
     script_start = time.time()
@@ -112,7 +299,7 @@ if __name__ == "__main__":
         datetime.strptime(args.to_date, '%Y-%m-%d')
     except ValueError: raise Exception("\nInvalid input for 'from_date' and/or 'to_date'")  
     # Check if full job name is UTF-8 strong and not more than 255 bytes long
-    if len(f"{args.job_name_prefix}-{int(datetime.now().timestamp())}-{args.from_date}-{args.to_date}".encode('utf-8')) > 255: raise Exception("\nInvalid input for 'job_name_prefix'")  
+    if len(f"{args.job_name_prefix}-{args.job_type}-{int(datetime.now().timestamp())}-{args.from_date}-{args.to_date}".encode('utf-8')) > 255: raise Exception("\nInvalid input for 'job_name_prefix'")  
     # Check if the glue_role_arn follows ARN format
     if not args.glue_role_arn.startswith('arn:aws:iam:'): raise Exception("\nInvalid input for 'glue_role_arn'")
 
@@ -131,8 +318,6 @@ if __name__ == "__main__":
 
     from_date = datetime.strptime(from_date_str, '%Y-%m-%d')
     to_date = datetime.strptime(to_date_str, '%Y-%m-%d')
-    total_days = (to_date - from_date).days + 1
-    total_jobs = math.ceil(total_days/int(days_per_job))
 
     handler = GlueJobRunner(job_name_prefix,
                             glue_role_arn,
@@ -141,9 +326,26 @@ if __name__ == "__main__":
                             to_date,
                             glue_assets_bucket,
                             glue_assets_job_script_key,
-                            glue_assets_extra_py_key)
+                            glue_assets_extra_py_key,
+                            args.job_type)
     
-    print(f'\nCreating {total_jobs} Glue ETL jobs to process data between {from_date_str} and {to_date_str}..')
-    handler.create_jobs()
+    action = 'compact' if args.job_type == 'compaction' else 'process'
+    jobs = handler.plan_jobs()
+    print(f'\nPlanned {len(jobs)} Glue ETL jobs to {action} data between {from_date_str} and {to_date_str}:')
+    handler.print_plan(jobs)
+
+    if not args.dry_run:
+        # List the timeseries once and share them with all jobs through the catalog snapshot, compaction doesn't need them
+        if args.job_type == 'repartition':
+            timeseries_ids = sitewise_helper.get_timeseries_catalog(publish=True)
+            print(f'Total timeseries identified: {len(timeseries_ids)}')
+
+        if config['jobs']['mode'] == 'runs':
+            print(f'\nRunning {len(jobs)} Glue ETL job runs to {action} data between {from_date_str} and {to_date_str}..')
+            handler.run_queued_jobs(jobs)
+        else:
+            print(f'\nCreating {len(jobs)} Glue ETL jobs to {action} data between {from_date_str} and {to_date_str}..')
+            created_jobs = handler.create_jobs(jobs)
+            if args.monitor: handler.monitor_jobs(created_jobs)
     
     print(f'** Total execution time: {round((time.time() - script_start))} seconds **')
\ No newline at end of file
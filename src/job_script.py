@@ -3,28 +3,48 @@
 
 import os
 import sys
+import argparse
 from datetime import datetime, timedelta
 import time
 import json
 import avro
 import avro.schema
-from avro.datafile import DataFileWriter, DataFileReader
-from avro.io import DatumWriter, DatumReader
 import shutil
-from typing import List, Dict
+import queue
+import resource
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Set
 import helpers.common as common_helper 
 import helpers.s3 as s3_helper 
 import helpers.sitewise as sitewise_helper
 import helpers.globals as globals
-from itertools import repeat
-from multiprocessing import cpu_count, Pool, freeze_support
-from awsglue.utils import getResolvedOptions
+import helpers.merge as merge_helper
+import helpers.avro_container as avro_container_helper
+import helpers.index as index_helper
+import helpers.buffers as buffers_helper
+import helpers.inventory as inventory_helper
+import helpers.download as download_helper
+import helpers.planning as planning_helper
+import helpers.status as status_helper
+import helpers.metrics as metrics_helper
+import helpers.compaction as compaction_helper
+from multiprocessing import freeze_support
+try:
+    from awsglue.utils import getResolvedOptions
+except ImportError:
+    # Outside of AWS Glue, such as in benchmarks, the job arguments are parsed with argparse
+    def getResolvedOptions(argv: List[str], options: List[str]) -> Dict:
+        parser = argparse.ArgumentParser()
+        for option in options: parser.add_argument(f'--{option}', required=True)
+        return vars(parser.parse_known_args(argv[1:])[0])
 
 dir = os.path.abspath(os.path.dirname(__file__))
 root_dir = os.path.abspath(os.path.dirname(dir))
 
 # Get Glue job arguments
-args = getResolvedOptions(sys.argv, ['from-date', 'to-date'])
+# The job type is optional, jobs created before compaction existed only repartition
+args = getResolvedOptions(sys.argv, ['from-date', 'to-date'] + (['job-type'] if '--job-type' in sys.argv else []))
 # Load config yaml
 config = globals.config
 # Load AVRO schema to use for merging
@@ -37,128 +57,768 @@ cold_tier_bucket_data_prefix = config['s3']['cold_tier']['data_prefix']
 repartitioned_bucket_name = config['s3']['repartitioned']['bucket_name']
 repartitioned_bucket_data_prefix = config['s3']['repartitioned']['data_prefix']
 repartitioned_bucket_index_prefix = config['s3']['repartitioned']['index_prefix']
+discovery_max_concurrency = config['discovery']['max_concurrency']
+discovery_inventory_bucket_name = config['discovery']['inventory_bucket_name']
+discovery_inventory_manifest_prefix = config['discovery']['inventory_manifest_prefix']
+download_max_concurrency = config['download']['max_concurrency']
+download_range_size_bytes = config['download']['range_size_mb'] * 1024 * 1024
+download_small_object_size_bytes = config['download']['small_object_size_kb'] * 1024
+download_small_object_batch_size = config['download']['small_object_batch_size']
+incremental_mode = config['incremental']['mode']
+merge_mode = config['merge']['mode']
+merge_target_file_size_bytes = config['merge']['target_file_size_mb'] * 1024 * 1024
+merge_sort_output = config['merge']['sort_output']
+merge_deduplicate = config['merge']['deduplicate']
+merge_dedup_memory_budget_bytes = config['merge']['dedup_memory_budget_mb'] * 1024 * 1024
+merge_output_format = config['merge']['output_format']
+merge_parquet_row_group_size = config['merge']['parquet_row_group_size']
+merge_bucket_count = config['merge']['bucket_count']
+merge_avro_engine = config['merge']['avro_engine']
+merged_data_file_extension = '.parquet' if merge_output_format == 'parquet' else '.avro'
+pipeline_enabled = config['pipeline']['enabled']
+pipeline_queue_depth = config['pipeline']['queue_depth']
+streaming_enabled = config['streaming']['enabled']
+streaming_memory_budget_bytes = config['streaming']['memory_budget_mb'] * 1024 * 1024
+upload_multipart_enabled = config['upload']['multipart_enabled']
+upload_part_size_bytes = config['upload']['part_size_mb'] * 1024 * 1024
+upload_max_concurrency = config['upload']['max_concurrency']
+glue_assets_bucket_name = config['s3']['glue_assets']['bucket_name']
+glue_assets_status_prefix = config['s3']['glue_assets']['status_prefix']
+metrics_enabled = config['metrics']['enabled']
+metrics_namespace = config['metrics']['namespace']
+metrics_profile_merge = config['metrics']['profile_merge']
+metrics_profile_prefix = config['metrics']['profile_prefix']
+compaction_max_files_per_day = config['compaction']['max_files_per_day']
+compaction_small_file_size_bytes = config['compaction']['small_file_size_mb'] * 1024 * 1024
+compaction_min_small_files = config['compaction']['min_small_files']
 
 date_start = args['from_date']
 date_end = args['to_date']
+job_type = args.get('job_type', 'repartition')
 local_tmp_raw_dir_name = 'raw'
 local_tmp_merged_dir_name = 'merged'
 TMP_SITEWISE_PATH = '/tmp/sitewise'
 local_tmp_raw_dir_path = f'{TMP_SITEWISE_PATH}/{local_tmp_raw_dir_name}'
 local_tmp_merged_dir_path = f'{TMP_SITEWISE_PATH}/{local_tmp_merged_dir_name}'
+local_tmp_profiles_dir_path = f'{TMP_SITEWISE_PATH}/profiles'
 
-script_start_timestamp = int(datetime.now().timestamp())
+# Name of the object recording the keys to delete once the compacted files of a day are swapped in
+COMPACTION_SWAP_NAME = 'swap.json'
+# Options changing the content of the merged data files, part of the digest naming them
+merge_output_options = {'mode': merge_mode, 'target_file_size': merge_target_file_size_bytes, 'sort_output': merge_sort_output, 
+                        'deduplicate': merge_deduplicate, 'output_format': merge_output_format, 
+                        'parquet_row_group_size': merge_parquet_row_group_size, 'bucket_count': merge_bucket_count}
 
-def filter_keys(keys, all_timeseries_ids: List[str], previous_timeseries_ids: List[str]) -> List[str]:
-    """Filter S3 keys whose timeseries is 1/ part of the target 
-    timeseries list and 2/ not previously processed for the day
-    """
-    filtered_keys = []
-    new_timeseries_ids = []
-    for key in keys:
-        timeseries_id = s3_helper.timeseries_id_from_key(key)
-        if timeseries_id in all_timeseries_ids and timeseries_id not in previous_timeseries_ids:
-            filtered_keys.append(key)
-            new_timeseries_ids.append(timeseries_id) if timeseries_id not in new_timeseries_ids else None
-    
-    return filtered_keys, new_timeseries_ids
+# AVRO records are encoded and decoded by the engine configured
+avro_engine = avro_container_helper.set_default_engine(merge_avro_engine)
+# In streaming mode, raw objects are held in memory and only spill to the raw day directories
+buffer_store = buffers_helper.SpillingBufferStore(local_tmp_raw_dir_path, streaming_memory_budget_bytes) if streaming_enabled else None
+# Downloads of all days share the same threads and S3 connections
+download_engine = download_helper.DownloadEngine(download_max_concurrency, download_range_size_bytes, 
+                                                 download_small_object_size_bytes, download_small_object_batch_size)
+# Peak memory and disk usage per day
+day_usage = {}
+# Progress published for the job controller, listed bytes of a day are done once the day is uploaded or skipped
+job_status = status_helper.JobStatus(glue_assets_bucket_name, status_helper.status_key(glue_assets_status_prefix, date_start, date_end, job_type), 
+                                     date_start, date_end)
+day_listed_bytes = {}
+# Days completed by previous attempts of the job are skipped by a retry
+checkpoints = status_helper.DayCheckpoints(glue_assets_bucket_name, 
+                                           status_helper.checkpoint_key(glue_assets_status_prefix, date_start, date_end, job_type))
+# Metrics of each stage of each day, emitted as CloudWatch EMF JSON lines
+metrics_emitter = metrics_helper.MetricsEmitter(metrics_namespace, {'JobRange': f'{date_start}_{date_end}', 'JobType': job_type}, metrics_enabled)
 
-def get_avro_file_name(day_directory) -> str:
-    """Retrieve the AVRO file name from the merged day 
+def get_data_file_names(day_directory) -> List[str]:
+    """Retrieve the AVRO or Parquet data file names from the merged day 
     directory
     """  
-    file_name = None
-    for name in os.listdir(day_directory):
-        if name.endswith(".avro"): file_name = name
-    return file_name
+    return sorted(name for name in os.listdir(day_directory) if name.endswith(merged_data_file_extension))
+
+def get_merged_data_file_name(shard_index: int, digest: str, bucket: int = None) -> str:
+    """Name of a merged data file after the digest of its inputs and its
+    bucket, numbered when the day is split into size-bounded shards
+    """
+    file_name = f'merged_series_{digest}'
+    if bucket is not None: file_name += f'_bucket{bucket:04d}'
+    if merge_target_file_size_bytes: file_name += f'_part{shard_index:04d}'
+    return f'{file_name}{merged_data_file_extension}'
 
-def download_objects(filtered_keys: List[str], day_wise_folder: str) -> None:
-    """Download the S3 files into day-wise directory
+def create_merged_writer(open_data_file, digest: str):
+    """Create the writer of the merged data files of a day, with a writer
+    per bucket when bucketing. Data files are opened for writing with 
+    open_data_file from their name
+    """
+    def create_writer(bucket=None):
+        def open_shard(shard_index):
+            merged_data_file_name = get_merged_data_file_name(shard_index, digest, bucket)
+            return merged_data_file_name, open_data_file(merged_data_file_name)
+        return merge_helper.ShardedWriter(avro_schema_parsed, open_shard, merge_target_file_size_bytes, codec='snappy',
+            output_format=merge_output_format, parquet_row_group_size=merge_parquet_row_group_size)
+    if merge_bucket_count: return merge_helper.BucketedWriter(avro_schema_parsed, merge_bucket_count, create_writer)
+    return create_writer()
+
+def stream_s3_object(bucket: str, key: str, day_wise_folder: str) -> int:
+    """Read S3 object for the provided key into the buffer store
+    """
+    def read(body, size: int) -> int:
+        buffer_store.add(day_wise_folder, s3_helper.filename_from_key(key), size, body)
+        return size
+    return s3_helper.read_s3_object(bucket, key, read)
+
+def download_objects(filtered_objects: List[Dict], day_wise_folder: str, bucket: str = cold_tier_bucket_name) -> None:
+    """Download the S3 files into day-wise directory, largest first. Large
+    files are downloaded in concurrent byte ranges
     """  
-    download_start = time.time()
-    #Download source objects from S3 Cold Tier to local day-wise directory
+    #Download source objects from S3 Cold Tier, or merged files to compact, to local day-wise directory
     print(f"\tDownloading S3 objects..")
-    Pool(cpu_count() - 1).starmap(s3_helper.download_s3_object, zip(repeat(cold_tier_bucket_name), filtered_keys, repeat(day_wise_folder)))
-    print(f'\t\t** Download time: {round(time.time() - download_start)} secs **')
+    timer = metrics_helper.StageTimer()
+    if streaming_enabled:
+        download_object = lambda s3_object: stream_s3_object(bucket, s3_object['Key'], day_wise_folder)
+        open_ranged_object = lambda s3_object: buffer_store.reserve(day_wise_folder, s3_helper.filename_from_key(s3_object['Key']), 
+                                                                    s3_object['Size'])
+        discard_ranged_object = lambda s3_object: buffer_store.release(day_wise_folder, s3_helper.filename_from_key(s3_object['Key']))
+    else:
+        download_object = lambda s3_object: s3_helper.download_s3_object(bucket, s3_object['Key'], day_wise_folder)
+        open_ranged_object = lambda s3_object: buffers_helper.FileRangeWriter(
+            f'{local_tmp_raw_dir_path}/{day_wise_folder}/{s3_helper.filename_from_key(s3_object["Key"])}', s3_object['Size'])
+        discard_ranged_object = lambda s3_object: os.remove(f'{local_tmp_raw_dir_path}/{day_wise_folder}/{s3_helper.filename_from_key(s3_object["Key"])}')
+    download_range = lambda s3_object, start, end: s3_helper.get_s3_object_range(bucket, s3_object['Key'], start, end)
+    stats = download_engine.download(filtered_objects, download_object, open_ranged_object, download_range, discard_ranged_object)
+    print(f'\t\t{stats["objects"]} objects ({stats["ranged_objects"]} in byte ranges), {stats["bytes"] / 1048576:.1f} MB at '
+          f'{download_helper.format_throughput(stats)}')
+    print(f'\t\t{s3_helper.download_limiter.format_stats()}')
+    print(f'\t\t** Download time: {stats["seconds"]:.1f} secs **')
+    metrics_emitter.emit(day_wise_folder, 'download', timer, objects=stats['objects'], bytes_in=stats['bytes'], 
+                         disk_bytes=directory_size(f'{local_tmp_raw_dir_path}/{day_wise_folder}'))
+    job_status.record_stage(day_wise_folder, 'download', timer.wall_seconds(), stats['objects'], stats['bytes'])
+
+def s3_day_prefix_from_folder(day_directory: str) -> str:
+    """Build the date partition prefix from the day directory name
+    """
+    folder_date = datetime.strptime(day_directory, '%Y-%m-%d').date()
+    return f'startYear={folder_date.strftime("%Y")}/startMonth={folder_date.month}/startDay={folder_date.day}/'
+
+def open_merged_data_file(day_directory: str, file_name: str):
+    """Open the merged data file for writing, either as a local file or
+    as a multipart upload to the repartitioned bucket
+    """
+    if upload_multipart_enabled:
+        s3_data_file_key_name = f'{repartitioned_bucket_data_prefix}{s3_day_prefix_from_folder(day_directory)}{file_name}'
+        return s3_helper.MultipartUploadWriter(repartitioned_bucket_name, s3_data_file_key_name, 
+                                               upload_part_size_bytes, upload_max_concurrency)
+    return open(f'{local_tmp_merged_dir_path}/{day_directory}/{file_name}', 'wb')
 
 def merge_s3_objects(day_directory: str) -> None:
     """Merge raw AVRO files for the day into a single file
     """
-    #Create daily directories if doesn't exist, else empty the root directory
-    if not os.path.exists(local_tmp_merged_dir_path): os.mkdir(local_tmp_merged_dir_path)
-    else:  
-        for child_dir in common_helper.visible_child_dirs(local_tmp_merged_dir_path):
-            shutil.rmtree(f'{local_tmp_merged_dir_path}/{child_dir}')
-
-    merge_start = time.time()
+    timer = metrics_helper.StageTimer()
     print(f"\tStarted merging AVRO data files and index files for each day..")
     tmp_raw_directory_path = local_tmp_raw_dir_path + "/" + day_directory
     tmp_merge_directory_path = local_tmp_merged_dir_path + "/" + day_directory
     
-    # Create day directory for merging if doesn't exist
-    if not os.path.exists(tmp_merge_directory_path): os.mkdir(tmp_merge_directory_path)
+    # Create day directory for merging, empty it if it exists from a previous attempt
+    if os.path.exists(tmp_merge_directory_path): shutil.rmtree(tmp_merge_directory_path)
+    os.mkdir(tmp_merge_directory_path)
 
-    merged_data_file_name = f'merged_series_{script_start_timestamp}.avro' 
-    avro_writer = DataFileWriter(open(tmp_merge_directory_path + "/" + merged_data_file_name, "wb"), DatumWriter(), avro_schema_parsed, codec='snappy')
+    # Data files are named after the cold tier objects merged, a retry merging the same objects overwrites them
+    with open(f'{tmp_raw_directory_path}/manifest-new.json', 'r') as f:
+        new_objects = json.load(f)
+    digest = index_helper.data_file_digest([f'{relative_key}:{etag}' for relative_key, (etag, _) in new_objects.items()], 
+                                           merge_output_options)
+    merged_writer = create_merged_writer(lambda file_name: open_merged_data_file(day_directory, file_name), digest)
     index_file = ''
     
     # Loop through each file in the day directory
+    data_file_paths = []
     for target_file in os.listdir(tmp_raw_directory_path):
         file_path = tmp_raw_directory_path + "/" + target_file
-        # Merge AVRO files into one file
-        if target_file.endswith(".avro"):
-            reader = DataFileReader(open(file_path, "rb"), DatumReader())
-            records = [record for record in reader]
-            reader.close()
-            for record in records:
-                avro_writer.append(record)
+        # Merge AVRO files into one file, spilled objects are merged from the buffer store
+        if target_file.endswith(".avro") and not streaming_enabled:
+            data_file_paths.append(file_path)
         # Combine timeseries ids from index files
         if target_file.endswith(".txt"):
             with open(file_path, 'r') as f:
                 file_content = f.read()
             index_file += file_content if not index_file else f'\n{file_content}'
     
-    avro_writer.close()
+    # Objects are merged in the order of their names, so that a retry splits the day into the same shards under the same digest
+    if streaming_enabled:
+        data_file_names = sorted(buffer_store.file_names(day_directory))
+        open_file = lambda file_name: buffer_store.open(day_directory, file_name)
+        release_file = lambda file_name: buffer_store.release(day_directory, file_name)
+    else:
+        data_file_names = sorted(data_file_paths)
+        open_file = lambda file_name: open(file_name, 'rb')
+        release_file = None
+    profile_path_prefix = f'{local_tmp_profiles_dir_path}/{day_directory}-merge'
+    dedup_stats = {'duplicates': 0, 'spilled_runs': 0}
+    try:
+        with metrics_helper.profile(metrics_profile_merge, profile_path_prefix):
+            if merge_deduplicate:
+                # Series that don't fit in the memory budget are sorted in runs spilled next to the raw files
+                dedup_spill_dir = f'{tmp_raw_directory_path}/dedup'
+                if not os.path.exists(dedup_spill_dir): os.mkdir(dedup_spill_dir)
+                record_counts = merge_helper.merge_avro_files_deduplicated(data_file_names, merged_writer, s3_helper.timeseries_id_from_key,
+                    merge_dedup_memory_budget_bytes, dedup_spill_dir, open_file=open_file, release_file=release_file, stats=dedup_stats)
+            elif merge_sort_output:
+                record_counts = merge_helper.merge_avro_files_sorted(data_file_names, merged_writer, s3_helper.timeseries_id_from_key,
+                    open_file=open_file, release_file=release_file)
+            else:
+                record_counts = merge_helper.merge_avro_files(data_file_names, merged_writer, merge_mode, open_file=open_file, release_file=release_file,
+                    series_id_from_file_name=s3_helper.timeseries_id_from_key)
+            merged_writer.close()
+    except Exception:
+        # Don't leave an incomplete multipart upload or uploaded shards behind
+        if upload_multipart_enabled:
+            closed_shards = merged_writer.closed_shards()
+            merged_writer.abort()
+            for shard in closed_shards:
+                s3_helper.delete_s3_object(repartitioned_bucket_name, f'{repartitioned_bucket_data_prefix}{s3_day_prefix_from_folder(day_directory)}{shard["name"]}')
+        raise
+    record_day_usage(day_directory, tmp_raw_directory_path, tmp_merge_directory_path)
+
+    # Add the merged data files and their series to the file index of the day
+    file_index = index_helper.load_file_index(f'{tmp_raw_directory_path}/files-previous.json')
+    index_helper.add_files(file_index, merged_writer.shards, merge_bucket_count)
+    index_helper.write_file_index(f'{tmp_merge_directory_path}/{index_helper.FILE_INDEX_NAME}', file_index)
+    index_helper.write_stats_files(tmp_merge_directory_path, merged_writer.shards)
+
+    # Add the merged cold tier objects and their record counts to the manifest of the day
+    manifest = index_helper.load_manifest(f'{tmp_raw_directory_path}/manifest-previous.json')
+    record_counts = {s3_helper.filename_from_key(file_name): count for file_name, count in record_counts.items()}
+    index_helper.add_objects(manifest, new_objects, record_counts)
+    index_helper.write_manifest(f'{tmp_merge_directory_path}/{index_helper.MANIFEST_NAME}', manifest)
+
+    # Keep the list of data files replaced by a rebuild of the day until they are removed after upload
+    replaced_file_index_path = f'{tmp_raw_directory_path}/files-replaced.json'
+    if os.path.exists(replaced_file_index_path): shutil.copy(replaced_file_index_path, f'{tmp_merge_directory_path}/files-replaced.json')
 
     # Write combined timeseries ids to a single index file
     if index_file:
         with open(tmp_merge_directory_path + '/timeseries.txt', 'w') as f:
             f.write(index_file)
 
-    print(f'{day_directory}: ** Merge Time: {round(time.time() - merge_start)} secs **')
+    merge_description = 'deduplicated' if merge_deduplicate else 'sorted' if merge_sort_output else f'{merge_mode} mode'
+    print(f'\tMerged {merged_writer.record_count} records in {merged_writer.block_count} blocks and {len(merged_writer.shards)} files ({merge_description}, {merged_writer.blocks_recompressed} blocks re-compressed)')
+    if merge_deduplicate: print(f"\tDropped {dedup_stats['duplicates']} duplicate records, {dedup_stats['spilled_runs']} sorted runs spilled to disk")
+    if metrics_profile_merge: upload_merge_profile(day_directory, profile_path_prefix)
+    print(f'{day_directory}: ** Merge Time: {timer.wall_seconds():.1f} secs **')
+    metrics_emitter.emit(day_directory, 'merge', timer, objects=len(new_objects), bytes_in=sum(size for _, size in new_objects.values()),
+                         bytes_out=sum(shard['bytes'] for shard in merged_writer.shards), records=merged_writer.record_count,
+                         disk_bytes=day_usage[day_directory][1], duplicates=dedup_stats['duplicates'])
+    job_status.record_stage(day_directory, 'merge', timer.wall_seconds())
+
+def upload_merge_profile(day_directory: str, profile_path_prefix: str) -> None:
+    """Print the top functions of the merge profile of the day and upload
+    the profile files to the Glue assets bucket
+    """
+    print(metrics_helper.format_profile_summary(f'{profile_path_prefix}.prof'))
+    for suffix in ('.prof', '.tracemalloc.txt'):
+        profile_key = f'{metrics_profile_prefix}{date_start}_{date_end}/{day_directory}-merge{suffix}'
+        s3_helper.upload_file_to_s3(glue_assets_bucket_name, f'{profile_path_prefix}{suffix}', profile_key)
+    print(f'\tUploaded merge profile to s3://{glue_assets_bucket_name}/{metrics_profile_prefix}{date_start}_{date_end}/{day_directory}-merge.*')
+
+def directory_size(directory_path: str) -> int:
+    """Get the total size of the files in a directory
+    """
+    return sum(os.path.getsize(f'{directory_path}/{name}') for name in os.listdir(directory_path))
+
+def record_day_usage(day_directory: str, tmp_raw_directory_path: str, tmp_merge_directory_path: str) -> None:
+    """Record the peak memory and disk usage for the day, measured once
+    the merged file is written
+    """
+    merged_bytes = directory_size(tmp_merge_directory_path)
+    if streaming_enabled:
+        stats = buffer_store.day_stats.get(day_directory, {})
+        peak_memory_bytes = stats.get('peak_memory_bytes', 0)
+        peak_disk_bytes = stats.get('peak_disk_bytes', 0) + merged_bytes
+    else:
+        peak_memory_bytes = 0
+        peak_disk_bytes = directory_size(tmp_raw_directory_path) + merged_bytes
+    day_usage[day_directory] = (peak_memory_bytes, peak_disk_bytes)
+
+def print_day_usage() -> None:
+    """Print the peak memory and disk usage of each processed day
+    """
+    if not day_usage: return
+    memory_budget = f'{streaming_memory_budget_bytes / 1048576:.0f} MB' if streaming_enabled else 'streaming disabled'
+    print(f'\nPeak usage per day (memory budget: {memory_budget})')
+    for day_directory, (peak_memory_bytes, peak_disk_bytes) in day_usage.items():
+        print(f'\t{day_directory}: memory {peak_memory_bytes / 1048576:.1f} MB, disk {peak_disk_bytes / 1048576:.1f} MB')
+    print(f'\tProcess peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB')
 
 def upload_to_repartitioned_data_s3_bucket(day_directory: str) -> None:
     """Upload merged files to the new S3 bucket
     """  
-    folder_date = datetime.strptime(day_directory, '%Y-%m-%d').date()
-    s3_day_prefix = f'startYear={folder_date.strftime("%Y")}/startMonth={folder_date.month}/startDay={folder_date.day}/'
+    s3_day_prefix = s3_day_prefix_from_folder(day_directory)
     
     # Configure local file names and paths
-    raw_folder_day_path = local_tmp_raw_dir_path + "/" + day_directory
     merged_folder_day_path = local_tmp_merged_dir_path + "/" + day_directory
-
-    local_data_file_name = get_avro_file_name(merged_folder_day_path)
-    if not local_data_file_name: return False
-    local_data_file_path = f'{merged_folder_day_path}/{local_data_file_name}'
     local_index_file_path = merged_folder_day_path + "/timeseries.txt"
-    
-    # Configure S3 keys
-    s3_data_file_key_name = f'{repartitioned_bucket_data_prefix}{s3_day_prefix}{local_data_file_name}'
     s3_index_file_key_name = f'{repartitioned_bucket_index_prefix}{s3_day_prefix}timeseries.txt'
 
-    upload_start = time.time()
+    timer = metrics_helper.StageTimer()
+    # Local files to upload with their keys
+    upload_files = []
+
+    if upload_multipart_enabled:
+        # The data files were uploaded while they were being merged
+        print(f"Started uploading re-partitioned index files for each day")
+    else:
+        local_data_file_names = get_data_file_names(merged_folder_day_path)
+        if not local_data_file_names: return False
 
-    print(f"Started uploading re-partitioned AVRO data files and index file for each day")
-    s3_helper.upload_file_to_s3(repartitioned_bucket_name, local_data_file_path, s3_data_file_key_name)
-    # Upload and overwrite if index file already exists in S3
-    s3_helper.upload_file_to_s3(repartitioned_bucket_name, local_index_file_path, s3_index_file_key_name)
-    print(f"{day_directory}: ** Upload Time: {round(time.time() - upload_start)} secs **")
+        print(f"Started uploading re-partitioned {merge_output_format.upper()} data files and index files for each day")
+        uploaded_file_count = 0
+        for local_data_file_name in local_data_file_names:
+            s3_data_file_key_name = f'{repartitioned_bucket_data_prefix}{s3_day_prefix}{local_data_file_name}'
+            local_data_file_path = f'{merged_folder_day_path}/{local_data_file_name}'
+            # Data files are named after their inputs, so one of the same size was uploaded by a previous attempt
+            if s3_helper.get_s3_object_size(repartitioned_bucket_name, s3_data_file_key_name) == os.path.getsize(local_data_file_path):
+                uploaded_file_count += 1
+                continue
+            upload_files.append((local_data_file_path, s3_data_file_key_name))
+        if uploaded_file_count: print(f"\tSkipped {uploaded_file_count} data files already uploaded by a previous attempt")
+    # Upload the statistics of the new data files
+    for local_stats_file_name in sorted(name for name in os.listdir(merged_folder_day_path) if name.endswith('.stats.json')):
+        upload_files.append((f'{merged_folder_day_path}/{local_stats_file_name}', 
+                             f'{repartitioned_bucket_index_prefix}{s3_day_prefix}{local_stats_file_name}'))
+    # Upload and overwrite if index files already exist in S3
+    for index_file_name in (index_helper.FILE_INDEX_NAME, index_helper.MANIFEST_NAME):
+        upload_files.append((f'{merged_folder_day_path}/{index_file_name}', 
+                             f'{repartitioned_bucket_index_prefix}{s3_day_prefix}{index_file_name}'))
+    upload_files.append((local_index_file_path, s3_index_file_key_name))
+    for local_file_path, s3_key in upload_files:
+        s3_helper.upload_file_to_s3(repartitioned_bucket_name, local_file_path, s3_key)
+
+    # Remove the data files of previous runs that were replaced by a rebuild of the day
+    replaced_file_index = index_helper.load_file_index(f'{merged_folder_day_path}/files-replaced.json')
+    # A rebuild of the same objects writes data files of the same name, which must be kept
+    current_file_names = {file['name'] for file in index_helper.load_file_index(f'{merged_folder_day_path}/{index_helper.FILE_INDEX_NAME}')['files']}
+    replaced_file_index['files'] = [file for file in replaced_file_index['files'] if file['name'] not in current_file_names]
+    for replaced_file in replaced_file_index['files']:
+        s3_helper.delete_s3_object(repartitioned_bucket_name, f'{repartitioned_bucket_data_prefix}{s3_day_prefix}{replaced_file["name"]}')
+        if 'stats' in replaced_file:
+            s3_helper.delete_s3_object(repartitioned_bucket_name, f'{repartitioned_bucket_index_prefix}{s3_day_prefix}{replaced_file["stats"]}')
+    if replaced_file_index['files']: print(f"\tRemoved {len(replaced_file_index['files'])} replaced data files")
+    print(f"{day_directory}: ** Upload Time: {timer.wall_seconds():.1f} secs **")
+    metrics_emitter.emit(day_directory, 'upload', timer, objects=len(upload_files), 
+                         bytes_out=sum(os.path.getsize(local_file_path) for local_file_path, _ in upload_files))
+    job_status.record_stage(day_directory, 'upload', timer.wall_seconds())
+
+def cleanup_day(day_wise_folder: str) -> None:
+    """Remove the local raw and merged directories for the day
+    """
+    for day_path in (f'{local_tmp_raw_dir_path}/{day_wise_folder}', f'{local_tmp_merged_dir_path}/{day_wise_folder}'):
+        if os.path.exists(day_path): shutil.rmtree(day_path)
+    job_status.day_done(day_listed_bytes.pop(day_wise_folder, 0))
+    checkpoints.day_done(day_wise_folder)
 
-def process_day(filtered_keys: List[str], day_wise_folder: str) -> None:
+def process_day(filtered_objects: List[Dict], day_wise_folder: str) -> None:
     """Process the data for the given day
     """  
-    download_objects(filtered_keys, day_wise_folder)
+    download_objects(filtered_objects, day_wise_folder)
     merge_s3_objects(day_wise_folder)
     upload_to_repartitioned_data_s3_bucket(day_wise_folder)
+    cleanup_day(day_wise_folder)
+
+def download_previous_index_file(s3_day_prefix: str, index_file_name: str, local_file_path: str) -> bool:
+    """Download an index file of the day from the repartitioned bucket, 
+    if exists
+    """
+    index_key = f'{repartitioned_bucket_index_prefix}{s3_day_prefix}{index_file_name}'
+    if not s3_helper.s3_prefix_exists(repartitioned_bucket_name, index_key): return False
+    with open(local_file_path, 'w+b') as f:
+        s3_helper.download_fileobj(repartitioned_bucket_name, index_key, f)
+    return True
+
+def day_wise_folder_from_date(date_loop_dt) -> str:
+    """Get the name of the local directories of a day, also naming the
+    day in checkpoints, statuses and metrics
+    """
+    return f"{date_loop_dt.year}-{date_loop_dt.month}-{date_loop_dt.day}"
+
+def s3_day_prefix_from_date(date_loop_dt) -> str:
+    """Get the S3 prefix of a day partition, relative to the data prefix
+    """
+    return f'startYear={date_loop_dt.strftime("%Y")}/startMonth={date_loop_dt.month}/startDay={date_loop_dt.day}/'
+
+def discover_s3_objects(dates: List) -> Dict:
+    """List the cold tier objects of all days upfront, either from the 
+    cold tier bucket with the days listed concurrently or from an S3 
+    Inventory. Returns the objects of each day
+    """
+    discovery_start = time.time()
+    cold_tier_day_prefixes = [f'{cold_tier_bucket_data_prefix}{s3_day_prefix_from_date(date_loop_dt)}' for date_loop_dt in dates]
+    if discovery_inventory_bucket_name:
+        print(f'Retrieving all keys from the S3 Inventory at s3://{discovery_inventory_bucket_name}/{discovery_inventory_manifest_prefix}')
+        s3_objects_per_prefix = inventory_helper.get_inventory_objects(discovery_inventory_bucket_name, 
+                                                                       discovery_inventory_manifest_prefix, cold_tier_day_prefixes)
+    else:
+        print(f'Retrieving all keys for {len(dates)} days, listing {discovery_max_concurrency} days at a time')
+        s3_objects_per_prefix = s3_helper.get_all_s3_object_summaries_for_prefixes(cold_tier_bucket_name, 
+                                                                                   cold_tier_day_prefixes, discovery_max_concurrency)
+    s3_objects_per_day = {date_loop_dt: s3_objects_per_prefix[prefix] for date_loop_dt, prefix in zip(dates, cold_tier_day_prefixes)}
+    print(f'Discovered {sum(len(s3_objects) for s3_objects in s3_objects_per_day.values())} objects in {round(time.time() - discovery_start, 1)} secs')
+    return s3_objects_per_day
+
+def prepare_day(date_loop_dt, all_timeseries_ids: Set[str], s3_objects: List[Dict]) -> tuple:
+    """Identify the new S3 objects to process for the day, out of all the
+    S3 objects of the day, and create the local index for newly detected
+    timeseries. Returns the filtered objects and the day-wise folder name, 
+    or None if there is nothing to process
+    """
+    s3_day_prefix = s3_day_prefix_from_date(date_loop_dt)
+    day_wise_folder = day_wise_folder_from_date(date_loop_dt)
+    print(f'\nReviewing --> year: {date_loop_dt.year}, month: {date_loop_dt.month}, day: {date_loop_dt.day}')
+    
+    cold_tier_day_prefix = f'{cold_tier_bucket_data_prefix}{s3_day_prefix}'
+    print(f'\t# of keys with prefix {cold_tier_day_prefix}: {len(s3_objects)}')
+    if len(s3_objects) == 0:
+        print(f'\tNo Cold tier data! Skipping this day')
+        job_status.day_done(0)
+        checkpoints.day_done(day_wise_folder)
+        return None
+
+    raw_day_wise_folder_path = f"{local_tmp_raw_dir_path}/{day_wise_folder}"
+
+    # Create daily directories if doesn't exist
+    if not os.path.exists(raw_day_wise_folder_path): os.mkdir(raw_day_wise_folder_path)  
+
+    previous_timeseries_ids = set()
+
+    # Download and read previous index file for the day, if exists
+    previous_index_local_path = f'{raw_day_wise_folder_path}/timeseries-previous.txt'
+    if download_previous_index_file(s3_day_prefix, 'timeseries.txt', previous_index_local_path):
+        with open(previous_index_local_path, 'r') as f2:
+            previous_timeseries_ids = set(f2.read().splitlines())
+        print(f'\t# of timeseries previously processed: {len(previous_timeseries_ids)}')
+
+    # Download and read previous manifest for the day, if exists
+    previous_manifest_local_path = f'{raw_day_wise_folder_path}/manifest-previous.json'
+    download_previous_index_file(s3_day_prefix, index_helper.MANIFEST_NAME, previous_manifest_local_path)
+    previous_objects = index_helper.load_manifest(previous_manifest_local_path)['objects']
+    # Days merged before manifests were kept would have all their objects merged again, duplicating their records
+    if incremental_mode == 'objects' and previous_timeseries_ids and not previous_objects:
+        previous_objects = planning_helper.manifest_objects_of_timeseries(s3_objects, cold_tier_day_prefix, previous_timeseries_ids)
+        index_helper.write_manifest(previous_manifest_local_path, {'objects': previous_objects})
+        print(f'\t# of objects of timeseries processed before the manifest: {len(previous_objects)}')
+
+    rebuild = False
+    if incremental_mode == 'objects':
+        grouped_objects, changed_count = planning_helper.group_changed_objects_by_timeseries(
+            s3_objects, cold_tier_day_prefix, all_timeseries_ids, previous_objects)
+        # Records of changed objects are already part of the merged data files, so the day is rebuilt
+        if changed_count > 0:
+            print(f'\t# of objects changed since previously processed: {changed_count}, rebuilding the day')
+            rebuild = True
+        # New objects of timeseries already merged may duplicate merged records, so the day is rebuilt to drop them
+        elif merge_deduplicate and previous_objects and \
+                not set(grouped_objects).isdisjoint(planning_helper.timeseries_ids_from_keys(list(previous_objects))):
+            print(f'\tNew objects found for timeseries previously processed, rebuilding the day to deduplicate')
+            rebuild = True
+        if rebuild:
+            grouped_objects = planning_helper.group_objects_by_timeseries(s3_objects, all_timeseries_ids)
+            previous_timeseries_ids = set()
+            for previous_file_path in (previous_index_local_path, previous_manifest_local_path):
+                if os.path.exists(previous_file_path): os.remove(previous_file_path)
+        print(f'\t# of new or changed objects detected: {sum(len(objects) for objects in grouped_objects.values())}')
+    else:
+        # Only timeseries not previously processed for the day
+        grouped_objects = planning_helper.group_objects_by_timeseries(s3_objects, all_timeseries_ids, previous_timeseries_ids)
+    filtered_objects = planning_helper.flatten_grouped_objects(grouped_objects)
+    new_timeseries_ids = [timeseries_id for timeseries_id in grouped_objects if timeseries_id not in previous_timeseries_ids]
+
+    # Create local index for newly detected timeseries
+    new_timeseries_count = len(new_timeseries_ids)
+    if new_timeseries_count > 0:
+        print(f'\t# of new timeseries detected: {new_timeseries_count}')
+        with open(local_tmp_raw_dir_path + '/' + day_wise_folder + '/timeseries-new.txt', 'w') as f:
+            f.write('\n'.join(new_timeseries_ids))
+
+    # Start processing objects
+    if len(filtered_objects) > 0:
+        # Download previous file index for the day, if exists. A rebuild replaces the previous data files
+        previous_file_index_name = 'files-replaced.json' if rebuild else 'files-previous.json'
+        download_previous_index_file(s3_day_prefix, index_helper.FILE_INDEX_NAME, f'{raw_day_wise_folder_path}/{previous_file_index_name}')
+
+        # Keep the ETag and size of the objects to process for the manifest
+        new_objects = {s3_object['Key'][len(cold_tier_day_prefix):]: [s3_object['ETag'], s3_object['Size']] for s3_object in filtered_objects}
+        with open(f'{raw_day_wise_folder_path}/manifest-new.json', 'w') as f:
+            json.dump(new_objects, f)
+
+        print(f'\tFound new data to process, starting to download')
+        day_listed_bytes[day_wise_folder] = sum(s3_object['Size'] for s3_object in s3_objects)
+        return filtered_objects, day_wise_folder
+
+    print(f'\tSkip, no new data')
+    job_status.day_done(sum(s3_object['Size'] for s3_object in s3_objects))
+    checkpoints.day_done(day_wise_folder)
+    # Remove any existing directory for the day
+    if os.path.exists(raw_day_wise_folder_path): shutil.rmtree(raw_day_wise_folder_path)
+    return None
+
+def put_until_failed(stage_queue: queue.Queue, item, failed: threading.Event) -> None:
+    """Put an item on a bounded stage queue, giving up if another stage
+    failed and stopped consuming
+    """
+    while not failed.is_set():
+        try:
+            stage_queue.put(item, timeout=1)
+            return
+        except queue.Full: continue
+
+def run_pipeline_stage(stage_function, input_queue: queue.Queue, output_queue: queue.Queue, 
+                       failed: threading.Event, errors: List[Exception]) -> None:
+    """Run a pipeline stage until the end of the input is reached. Items 
+    for which the stage function returns None are not passed on
+    """
+    try:
+        while not failed.is_set():
+            try: item = input_queue.get(timeout=1)
+            except queue.Empty: continue
+            if item is None: break
+            result = stage_function(item)
+            if result is not None and output_queue is not None: put_until_failed(output_queue, result, failed)
+    except Exception as e:
+        errors.append(e)
+        failed.set()
+    finally:
+        if output_queue is not None: put_until_failed(output_queue, None, failed)
+
+def process_days_pipelined(dates: List, all_timeseries_ids: Set[str], s3_objects_per_day: Dict) -> None:
+    """Process the days with download, merge and upload running as
+    concurrent stages, so the next day downloads while the current day
+    merges and the previous day uploads. Days pass through every stage
+    in the provided order
+    """
+    def download_stage(date_loop_dt):
+        day = prepare_day(date_loop_dt, all_timeseries_ids, s3_objects_per_day[date_loop_dt])
+        if day is None: return None
+        filtered_objects, day_wise_folder = day
+        download_objects(filtered_objects, day_wise_folder)
+        return day_wise_folder
+
+    def merge_stage(day_wise_folder):
+        merge_s3_objects(day_wise_folder)
+        # Raw files are no longer needed once merged
+        shutil.rmtree(f'{local_tmp_raw_dir_path}/{day_wise_folder}')
+        return day_wise_folder
+
+    def upload_stage(day_wise_folder):
+        upload_to_repartitioned_data_s3_bucket(day_wise_folder)
+        cleanup_day(day_wise_folder)
+
+    date_queue = queue.Queue()
+    for date_loop_dt in dates: date_queue.put(date_loop_dt)
+    date_queue.put(None)
+    downloaded_queue = queue.Queue(maxsize=pipeline_queue_depth)
+    merged_queue = queue.Queue(maxsize=pipeline_queue_depth)
+    failed = threading.Event()
+    errors = []
+
+    stages = [
+        (download_stage, date_queue, downloaded_queue),
+        (merge_stage, downloaded_queue, merged_queue),
+        (upload_stage, merged_queue, None)
+    ]
+    threads = [threading.Thread(target=run_pipeline_stage, args=(stage_function, input_queue, output_queue, failed, errors))
+               for stage_function, input_queue, output_queue in stages]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    if errors: raise errors[0]
+
+def load_day_file_index(date_loop_dt) -> Dict:
+    """Load the file index of a day partition from the repartitioned 
+    bucket, or return an empty index if the day has none
+    """
+    index_key = f'{repartitioned_bucket_index_prefix}{s3_day_prefix_from_date(date_loop_dt)}{index_helper.FILE_INDEX_NAME}'
+    if not s3_helper.s3_prefix_exists(repartitioned_bucket_name, index_key): return {'files': []}
+    return json.loads(s3_helper.get_s3_object_bytes(repartitioned_bucket_name, index_key))
+
+def compaction_staging_prefix(s3_day_prefix: str) -> str:
+    """Get the prefix the compacted files of a day are staged under
+    """
+    return f'{repartitioned_bucket_index_prefix}{s3_day_prefix}compaction/'
+
+def recover_compaction_swap(date_loop_dt, file_index: Dict) -> None:
+    """Finish the swap of a compaction of the day interrupted by a failed
+    attempt. If the file index was overwritten, the replaced files are
+    deleted, otherwise the compacted files are
+    """
+    s3_day_prefix = s3_day_prefix_from_date(date_loop_dt)
+    swap_key = f'{compaction_staging_prefix(s3_day_prefix)}{COMPACTION_SWAP_NAME}'
+    if not s3_helper.s3_prefix_exists(repartitioned_bucket_name, swap_key): return
+    swap = json.loads(s3_helper.get_s3_object_bytes(repartitioned_bucket_name, swap_key))
+    file_names = {file['name'] for file in file_index['files']}
+    swapped = any(name in file_names for name in swap['compacted_files'])
+    s3_helper.delete_s3_objects(repartitioned_bucket_name, swap['swapped_keys'] if swapped else swap['abandoned_keys'])
+    s3_helper.delete_s3_object(repartitioned_bucket_name, swap_key)
+    print(f'\t{day_wise_folder_from_date(date_loop_dt)}: finished the swap of an interrupted compaction, '
+          f'removed the {"replaced" if swapped else "compacted"} files')
+
+def list_unindexed_files(date_loop_dt, file_index: Dict) -> List[Dict]:
+    """List the data files of a day partition missing from its file index,
+    written by runs that predate the index
+    """
+    indexed_file_names = {file['name'] for file in file_index['files']}
+    s3_objects = s3_helper.get_all_s3_object_summaries(repartitioned_bucket_name, 
+                                                       f'{repartitioned_bucket_data_prefix}{s3_day_prefix_from_date(date_loop_dt)}')
+    return [compaction_helper.unindexed_file(file_name, s3_object['Size']) for s3_object in s3_objects
+            for file_name in [s3_helper.filename_from_key(s3_object['Key'])] if file_name not in indexed_file_names]
+
+def plan_compaction(dates: List) -> Dict:
+    """Load the file index and list the data files of all days 
+    concurrently, and select the data files to compact after finishing
+    interrupted swaps. Returns the file index and the files to compact of
+    each day needing compaction
+    """
+    def load(date_loop_dt):
+        file_index = load_day_file_index(date_loop_dt)
+        recover_compaction_swap(date_loop_dt, file_index)
+        return file_index, list_unindexed_files(date_loop_dt, file_index)
+    with ThreadPoolExecutor(max_workers=discovery_max_concurrency) as executor:
+        day_files = list(executor.map(load, dates))
+    files_per_day = {}
+    for date_loop_dt, (file_index, unindexed_files) in zip(dates, day_files):
+        files = compaction_helper.select_files_to_compact(file_index, merged_data_file_extension, compaction_max_files_per_day, 
+                                                          compaction_small_file_size_bytes, compaction_min_small_files, merge_target_file_size_bytes,
+                                                          merge_bucket_count, unindexed_files)
+        if files: files_per_day[date_loop_dt] = (file_index, files)
+    return files_per_day
+
+def compact_day(date_loop_dt, file_index: Dict, files: List[Dict]) -> None:
+    """Merge the selected data files of a day partition into files of the
+    target size, then swap them with the files they replace
+    """
+    s3_day_prefix = s3_day_prefix_from_date(date_loop_dt)
+    day_wise_folder = day_wise_folder_from_date(date_loop_dt)
+    tmp_raw_directory_path = f'{local_tmp_raw_dir_path}/{day_wise_folder}'
+    tmp_merge_directory_path = f'{local_tmp_merged_dir_path}/{day_wise_folder}'
+    for day_path in (tmp_raw_directory_path, tmp_merge_directory_path):
+        if os.path.exists(day_path): shutil.rmtree(day_path)
+        os.mkdir(day_path)
+    input_bytes = sum(file['bytes'] for file in files)
+    print(f'\nCompacting --> year: {date_loop_dt.year}, month: {date_loop_dt.month}, day: {date_loop_dt.day}')
+    unindexed_file_count = sum(1 for file in files if file['records'] is None)
+    print(f'\t{len(files)} of {len(file_index["files"]) + unindexed_file_count} data files selected, {input_bytes / 1048576:.1f} MB'
+          + (f', {unindexed_file_count} missing from the file index' if unindexed_file_count else ''))
+
+    data_objects = [{'Key': f'{repartitioned_bucket_data_prefix}{s3_day_prefix}{file["name"]}', 'Size': file['bytes']} for file in files]
+    download_objects(data_objects, day_wise_folder, repartitioned_bucket_name)
+
+    timer = metrics_helper.StageTimer()
+    if streaming_enabled: open_file = lambda file_name: buffer_store.open(day_wise_folder, file_name)
+    else: open_file = lambda file_name: open(f'{tmp_raw_directory_path}/{file_name}', 'rb')
+    def load_stats(file):
+        if 'stats' not in file: return None
+        stats_key = f'{repartitioned_bucket_index_prefix}{s3_day_prefix}{file["stats"]}'
+        if not s3_helper.s3_prefix_exists(repartitioned_bucket_name, stats_key): return None
+        return json.loads(s3_helper.get_s3_object_bytes(repartitioned_bucket_name, stats_key))
+    # Compacted files are written locally, they must be complete before they replace the files of the day. They
+    # are named after the files they replace, so a retry compacting the same files writes files of the same name
+    digest = index_helper.data_file_digest([file['name'] for file in files], merge_output_options)
+    compacted_writer = create_merged_writer(lambda file_name: open(f'{tmp_merge_directory_path}/{file_name}', 'wb'), digest)
+    # Records of unindexed files are counted from their blocks
+    expected_record_count = sum(file['records'] if file['records'] is not None else compaction_helper.count_file_records(file, open_file) 
+                                for file in files)
+    record_count = compaction_helper.compact_files(files, compacted_writer, open_file, load_stats)
+    compacted_writer.close()
+    if streaming_enabled:
+        for file in files: buffer_store.release(day_wise_folder, file['name'])
+    if record_count != expected_record_count:
+        raise Exception(f'\nCompaction of {day_wise_folder} read {record_count} records, the files hold {expected_record_count}')
+    record_day_usage(day_wise_folder, tmp_raw_directory_path, tmp_merge_directory_path)
+
+    # The compacted files replace the selected files in the file index, the other files are kept
+    compacted_file_names = {file['name'] for file in files}
+    compacted_file_index = {**file_index, 'files': [file for file in file_index['files'] if file['name'] not in compacted_file_names]}
+    index_helper.add_files(compacted_file_index, compacted_writer.shards, merge_bucket_count)
+    index_helper.write_file_index(f'{tmp_merge_directory_path}/{index_helper.FILE_INDEX_NAME}', compacted_file_index)
+    index_helper.write_stats_files(tmp_merge_directory_path, compacted_writer.shards)
+    output_bytes = sum(shard['bytes'] for shard in compacted_writer.shards)
+    print(f'\tCompacted {record_count} records into {len(compacted_writer.shards)} files, {output_bytes / 1048576:.1f} MB')
+    print(f'{day_wise_folder}: ** Compaction Time: {timer.wall_seconds():.1f} secs **')
+    metrics_emitter.emit(day_wise_folder, 'merge', timer, objects=len(files), bytes_in=input_bytes, bytes_out=output_bytes, 
+                         records=record_count, disk_bytes=day_usage[day_wise_folder][1])
+    job_status.record_stage(day_wise_folder, 'merge', timer.wall_seconds())
+
+    swap_compacted_files(day_wise_folder, s3_day_prefix, compacted_writer.shards, files)
+    cleanup_day(day_wise_folder)
+
+def swap_compacted_files(day_wise_folder: str, s3_day_prefix: str, shards: List[Dict], replaced_files: List[Dict]) -> None:
+    """Swap the compacted data files of a day partition with the files
+    they replace. Compacted files and their statistics are uploaded first,
+    the files to a staging prefix, then the files are copied into the day
+    partition and the file index is overwritten to reference them before
+    the replaced files are deleted. Readers of the file index always find
+    a complete set of files, readers listing the day partition see both
+    the compacted and the replaced files from the first copy until the
+    replaced files are deleted. The keys to delete are recorded in the
+    staging prefix beforehand, so the next compaction of the day finishes
+    a swap interrupted by a failure
+    """
+    timer = metrics_helper.StageTimer()
+    tmp_merge_directory_path = f'{local_tmp_merged_dir_path}/{day_wise_folder}'
+    staging_prefix = compaction_staging_prefix(s3_day_prefix)
+    data_keys = {shard['name']: f'{repartitioned_bucket_data_prefix}{s3_day_prefix}{shard["name"]}' for shard in shards}
+    # Compacted files of the same name and size were copied into the day partition by a previous attempt
+    copied_shards = [shard for shard in shards if s3_helper.get_s3_object_size(repartitioned_bucket_name, data_keys[shard['name']]) != shard['bytes']]
+    staged_keys = [f'{staging_prefix}{shard["name"]}' for shard in copied_shards]
+    stats_keys = [f'{repartitioned_bucket_index_prefix}{s3_day_prefix}{index_helper.stats_file_name(shard["name"])}' for shard in shards]
+    replaced_keys = []
+    for replaced_file in replaced_files:
+        replaced_keys.append(f'{repartitioned_bucket_data_prefix}{s3_day_prefix}{replaced_file["name"]}')
+        if 'stats' in replaced_file: replaced_keys.append(f'{repartitioned_bucket_index_prefix}{s3_day_prefix}{replaced_file["stats"]}')
+    swap = {
+        'compacted_files': [shard['name'] for shard in shards],
+        'swapped_keys': replaced_keys + staged_keys,
+        'abandoned_keys': list(data_keys.values()) + stats_keys + staged_keys
+    }
+    s3_helper.put_s3_object(repartitioned_bucket_name, f'{staging_prefix}{COMPACTION_SWAP_NAME}', 
+                            json.dumps(swap, separators=(',', ':')).encode('utf-8'))
+
+    # Everything outside the day partition is uploaded before the first copy, to keep the window with duplicates short
+    upload_files = [(f'{tmp_merge_directory_path}/{shard["name"]}', staged_key) for shard, staged_key in zip(copied_shards, staged_keys)]
+    upload_files += [(f'{tmp_merge_directory_path}/{index_helper.stats_file_name(shard["name"])}', stats_key) 
+                     for shard, stats_key in zip(shards, stats_keys)]
+    for local_file_path, s3_key in upload_files:
+        s3_helper.upload_file_to_s3(repartitioned_bucket_name, local_file_path, s3_key)
+    for shard, staged_key in zip(copied_shards, staged_keys):
+        s3_helper.copy_s3_object(repartitioned_bucket_name, staged_key, data_keys[shard['name']])
+
+    # Overwriting the file index swaps the compacted files in
+    index_file_path = f'{tmp_merge_directory_path}/{index_helper.FILE_INDEX_NAME}'
+    s3_helper.upload_file_to_s3(repartitioned_bucket_name, index_file_path, 
+                                f'{repartitioned_bucket_index_prefix}{s3_day_prefix}{index_helper.FILE_INDEX_NAME}')
+    upload_files.append((index_file_path, None))
+    s3_helper.delete_s3_objects(repartitioned_bucket_name, swap['swapped_keys'])
+    s3_helper.delete_s3_object(repartitioned_bucket_name, f'{staging_prefix}{COMPACTION_SWAP_NAME}')
+    print(f'\tSwapped in {len(shards)} compacted files, removed {len(replaced_files)} replaced data files')
+    print(f"{day_wise_folder}: ** Upload Time: {timer.wall_seconds():.1f} secs **")
+    metrics_emitter.emit(day_wise_folder, 'upload', timer, objects=len(upload_files), 
+                         bytes_out=sum(os.path.getsize(path) for path, _ in upload_files))
+    job_status.record_stage(day_wise_folder, 'upload', timer.wall_seconds())
+
+def start_compaction(dates: List) -> None:
+    """Compact the data files of the day partitions holding too many or
+    too small files
+    """
+    print(f'Configured repartitioned bucket name: {repartitioned_bucket_name}')
+    print(f'Configured compaction thresholds: more than {compaction_max_files_per_day} files per day, or at least '
+          f'{compaction_min_small_files} files smaller than {compaction_small_file_size_bytes / 1048576:.0f} MB')
+    print(f'Configured AVRO engine: {avro_engine.name}')
+    files_per_day = plan_compaction(dates)
+    job_status.plan(len(dates), sum(file['bytes'] for _, files in files_per_day.values() for file in files))
+    print(f'{len(files_per_day)} of {len(dates)} days need compaction')
+
+    for date_loop_dt in dates:
+        if date_loop_dt not in files_per_day:
+            job_status.day_done(0)
+            continue
+        file_index, files = files_per_day[date_loop_dt]
+        day_listed_bytes[day_wise_folder_from_date(date_loop_dt)] = sum(file['bytes'] for file in files)
+        compact_day(date_loop_dt, file_index, files)
 
 def start() -> None:
     """Start the execution
@@ -167,77 +827,76 @@ def start() -> None:
     date_start_dt = datetime.strptime(date_start, '%Y-%m-%d').date()
     date_end_dt = datetime.strptime(date_end, '%Y-%m-%d').date()
 
-    # Variable to loop through calender
+    print(f'Starting to {"compact" if job_type == "compaction" else "process"} timeseries data between {date_start_dt} and {date_end_dt}')
+
+    # Remove the local files left behind by a failed attempt, then create daily directories
+    if os.path.exists(TMP_SITEWISE_PATH): shutil.rmtree(TMP_SITEWISE_PATH)
+    os.mkdir(TMP_SITEWISE_PATH)
+    os.mkdir(local_tmp_raw_dir_path)
+    os.mkdir(local_tmp_merged_dir_path)
+    if metrics_profile_merge: os.mkdir(local_tmp_profiles_dir_path)
+
+    # Loop through the configured time period, newest day first
+    dates = []
     date_loop_dt = date_end_dt
-    print(f'Starting to process timeseries data between {date_start_dt} and {date_end_dt}')
+    while date_loop_dt >= date_start_dt:
+        dates.append(date_loop_dt)
+        date_loop_dt = date_loop_dt - timedelta(days=1)
+
+    # Skip the days completed by previous attempts of the job
+    completed_days = checkpoints.load()
+    if completed_days:
+        dates = [date_loop_dt for date_loop_dt in dates if day_wise_folder_from_date(date_loop_dt) not in completed_days]
+        print(f'Resuming after a previous attempt, {len(completed_days)} days already completed, {len(dates)} days left')
 
+    if job_type == 'compaction': start_compaction(dates)
+    else: start_repartitioning(dates)
+    print(f'\nDownloaded {download_engine.total_stats["objects"]} objects with {download_max_concurrency} threads at '
+          f'{download_helper.format_throughput(download_engine.total_stats)}')
+    print(f'\t{s3_helper.download_limiter.format_stats()}')
+    print(f'\t{s3_helper.upload_limiter.format_stats()}')
+    print(f'\nTotals per stage')
+    for line in metrics_helper.format_stage_totals(metrics_emitter.stage_totals()): print(f'\t{line}')
+    print_day_usage()
+
+def start_repartitioning(dates: List) -> None:
+    """Repartition the cold tier data of the days provided
+    """
+    if not dates: return
     # Get the list of all relevant timeseries ids from SiteWise
-    all_timeseries_ids = sitewise_helper.get_all_timeseries_ids()
+    all_timeseries_ids = set(sitewise_helper.get_timeseries_catalog())
     print(f'Configured timeseries mode: {timeseries_type}')
     print(f'Configured cold tier bucket name: {cold_tier_bucket_name}')
     print(f'Configured cold tier bucket data prefix: {cold_tier_bucket_data_prefix}')
     print(f'Configured repartitioned bucket name: {repartitioned_bucket_name}')
     print(f'Configured repartitioned bucket data prefix: {repartitioned_bucket_data_prefix}')
     print(f'Configured repartitioned bucket index prefix: {repartitioned_bucket_index_prefix}')
+    print(f'Configured AVRO engine: {avro_engine.name}')
     print(f'Total timeseries identified: {len(all_timeseries_ids)}')
- 
-    # Create daily directories if doesn't exist
-    if not os.path.exists(TMP_SITEWISE_PATH): os.mkdir(TMP_SITEWISE_PATH)
-    if not os.path.exists(local_tmp_raw_dir_path): os.mkdir(local_tmp_raw_dir_path)
 
-    # Loop through the configured time period
-    while date_loop_dt >= date_start_dt:
-        s3_day_prefix = f'startYear={date_loop_dt.strftime("%Y")}/startMonth={date_loop_dt.month}/startDay={date_loop_dt.day}/'
-        print(f'\nReviewing --> year: {date_loop_dt.year}, month: {date_loop_dt.month}, day: {date_loop_dt.day}')
-        
-        # Get a list of all s3 object keys for the day
-        print(f'\tRetrieving all keys with prefix: {cold_tier_bucket_data_prefix}{s3_day_prefix}')
-        s3_object_keys = s3_helper.get_all_s3_objects(cold_tier_bucket_name, f'{cold_tier_bucket_data_prefix}{s3_day_prefix}')
-
-        if len(s3_object_keys) == 0:
-            print(f'\tNo Cold tier data! Skipping this day')
-        else:
-            day_wise_folder = f"{date_loop_dt.year}-{date_loop_dt.month}-{date_loop_dt.day}"
-            raw_day_wise_folder_path = f"{local_tmp_raw_dir_path}/{day_wise_folder}"
-
-            # Create daily directories if doesn't exist
-            if not os.path.exists(raw_day_wise_folder_path): os.mkdir(raw_day_wise_folder_path)  
-        
-            previous_index_key = f'{repartitioned_bucket_index_prefix}{s3_day_prefix}timeseries.txt'
-            previous_timeseries_ids = []
-        
-            # Download and read previous index file for the day, if exists
-            if s3_helper.s3_prefix_exists(repartitioned_bucket_name, previous_index_key):
-                previous_index_local_path = local_tmp_raw_dir_path + '/' + day_wise_folder + '/timeseries-previous.txt'
-                with open(previous_index_local_path, 'w+b') as f1:
-                    s3_helper.download_fileobj(repartitioned_bucket_name, previous_index_key, f1)
-                with open(previous_index_local_path, 'r') as f2:
-                    previous_timeseries_ids = f2.read().splitlines()
-                print(f'\t# of timeseries previously processed: {len(previous_timeseries_ids)}')
-
-            filtered_keys, new_timeseries_ids = filter_keys(s3_object_keys, all_timeseries_ids, previous_timeseries_ids)
-
-            # Create local index for newly detected timeseries
-            new_timeseries_count = len(new_timeseries_ids)
-            if new_timeseries_count > 0:
-                print(f'\t# of new timeseries detected: {new_timeseries_count}')
-                with open(local_tmp_raw_dir_path + '/' + day_wise_folder + '/timeseries-new.txt', 'w') as f:
-                    f.write('\n'.join(new_timeseries_ids))
-
-            # Start processing objects
-            if len(filtered_keys) > 0:
-                print(f'\tFound new data to process, starting to download')
-                process_day(filtered_keys, day_wise_folder)
-            else:
-                print(f'\tSkip, no new data')
-                # Remove any existing directory for the day
-                if os.path.exists(raw_day_wise_folder_path): shutil.rmtree(raw_day_wise_folder_path)
+    # Get a list of all s3 objects for each day
+    s3_objects_per_day = discover_s3_objects(dates)
+    job_status.plan(len(dates), sum(s3_object['Size'] for s3_objects in s3_objects_per_day.values() for s3_object in s3_objects))
 
-        date_loop_dt = date_loop_dt - timedelta(days=1)
+    if pipeline_enabled:
+        print(f'Pipelining download, merge and upload with a queue depth of {pipeline_queue_depth}')
+        process_days_pipelined(dates, all_timeseries_ids, s3_objects_per_day)
+    else:
+        for date_loop_dt in dates:
+            day = prepare_day(date_loop_dt, all_timeseries_ids, s3_objects_per_day[date_loop_dt])
+            if day is not None: process_day(*day)
 
 if __name__ == "__main__":
     freeze_support()
-    start()
+    try:
+        start()
+    except Exception:
+        job_status.finish('FAILED')
+        raise
+    job_status.finish('SUCCEEDED')
+    # A later run of the same date range processes all days again
+    checkpoints.clear()
+    download_engine.close()
     print('\nCleaning up the file system..')
     shutil.rmtree(f'{TMP_SITEWISE_PATH}')
     print('\nScript execution successfully completed!!')
\ No newline at end of file
@@ -0,0 +1,183 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import io
+import types
+import shutil
+import hashlib
+import threading
+from typing import List, Dict
+from botocore.exceptions import ClientError
+
+# Size of the chunks read to copy files
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def client_error(code: str, operation_name: str) -> ClientError:
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation_name)
+
+class LocalS3Client:
+    """S3-compatible stand-in for the subset of the boto3 S3 client used by
+    the jobs. Buckets are directories of the root directory and objects
+    are files named after their key, so objects are read from and written
+    to the local disk like they are transferred over the network by S3
+    """
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        self.lock = threading.Lock()
+        self.etags = {}
+        self.multipart_uploads = {}
+        # Retry handlers registered by the jobs are never called, there is no throttling
+        self.meta = types.SimpleNamespace(events=types.SimpleNamespace(register=lambda *args, **kwargs: None))
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root_dir, bucket, key)
+
+    def _etag(self, bucket: str, key: str) -> str:
+        """ETag of an object, the MD5 of its content computed once
+        """
+        path = self._path(bucket, key)
+        stat = os.stat(path)
+        cache_key = (bucket, key, stat.st_size, stat.st_mtime_ns)
+        etag = self.etags.get(cache_key)
+        if etag is None:
+            md5 = hashlib.md5()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''): md5.update(chunk)
+            etag = f'"{md5.hexdigest()}"'
+            with self.lock: self.etags[cache_key] = etag
+        return etag
+
+    def _check_exists(self, bucket: str, key: str, operation_name: str) -> str:
+        path = self._path(bucket, key)
+        if not os.path.isfile(path): raise client_error('NoSuchKey' if operation_name != 'HeadObject' else '404', operation_name)
+        return path
+
+    def _write(self, bucket: str, key: str, chunks) -> None:
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial object
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks: f.write(chunk)
+        os.replace(tmp_path, path)
+
+    def _list_keys(self, bucket: str, prefix: str) -> List[str]:
+        bucket_dir = os.path.join(self.root_dir, bucket)
+        # Only walk the deepest directory covering the prefix
+        base_dir = os.path.join(bucket_dir, prefix[:prefix.rfind('/') + 1])
+        keys = []
+        for dir_path, _, file_names in os.walk(base_dir):
+            for file_name in file_names:
+                if file_name.endswith('.tmp'): continue
+                key = os.path.relpath(os.path.join(dir_path, file_name), bucket_dir).replace(os.sep, '/')
+                if key.startswith(prefix): keys.append(key)
+        keys.sort()
+        return keys
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', StartAfter: str = '', ContinuationToken: str = None,
+                        MaxKeys: int = 1000, **kwargs) -> Dict:
+        keys = self._list_keys(Bucket, Prefix)
+        start_after = ContinuationToken or StartAfter
+        if start_after: keys = [key for key in keys if key > start_after]
+        page = keys[:MaxKeys]
+        response = {'IsTruncated': len(keys) > MaxKeys, 'KeyCount': len(page), 'Prefix': Prefix}
+        if page:
+            response['Contents'] = [{'Key': key, 'Size': os.path.getsize(self._path(Bucket, key)), 'ETag': self._etag(Bucket, key)}
+                                    for key in page]
+        if response['IsTruncated']: response['NextContinuationToken'] = page[-1]
+        return response
+
+    def get_paginator(self, operation_name: str):
+        if operation_name != 'list_objects_v2': raise NotImplementedError(operation_name)
+        client = self
+        class ListObjectsV2Paginator:
+            def paginate(self, **kwargs):
+                kwargs.pop('PaginationConfig', None)
+                continuation_token = None
+                while True:
+                    response = client.list_objects_v2(ContinuationToken=continuation_token, **kwargs)
+                    yield response
+                    if not response['IsTruncated']: break
+                    continuation_token = response['NextContinuationToken']
+        return ListObjectsV2Paginator()
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> Dict:
+        path = self._check_exists(Bucket, Key, 'HeadObject')
+        return {'ContentLength': os.path.getsize(path), 'ETag': self._etag(Bucket, Key)}
+
+    def get_object(self, Bucket: str, Key: str, Range: str = None, **kwargs) -> Dict:
+        path = self._check_exists(Bucket, Key, 'GetObject')
+        if Range:
+            start, end = (int(position) for position in Range[len('bytes='):].split('-'))
+            with open(path, 'rb') as f:
+                f.seek(start)
+                data = f.read(end - start + 1)
+            return {'Body': io.BytesIO(data), 'ContentLength': len(data), 'ETag': self._etag(Bucket, Key)}
+        return {'Body': open(path, 'rb'), 'ContentLength': os.path.getsize(path), 'ETag': self._etag(Bucket, Key)}
+
+    def download_fileobj(self, Bucket: str, Key: str, Fileobj, **kwargs) -> None:
+        path = self._check_exists(Bucket, Key, 'GetObject')
+        with open(path, 'rb') as f: shutil.copyfileobj(f, Fileobj, COPY_CHUNK_SIZE)
+
+    def download_file(self, Bucket: str, Key: str, Filename: str, **kwargs) -> None:
+        shutil.copyfile(self._check_exists(Bucket, Key, 'GetObject'), Filename)
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str, **kwargs) -> None:
+        with open(Filename, 'rb') as f: self._write(Bucket, Key, iter(lambda: f.read(COPY_CHUNK_SIZE), b''))
+
+    def upload_fileobj(self, Fileobj, Bucket: str, Key: str, **kwargs) -> None:
+        self._write(Bucket, Key, iter(lambda: Fileobj.read(COPY_CHUNK_SIZE), b''))
+
+    def put_object(self, Bucket: str, Key: str, Body=b'', **kwargs) -> Dict:
+        if isinstance(Body, str): Body = Body.encode('utf-8')
+        if isinstance(Body, (bytes, bytearray, memoryview)): self._write(Bucket, Key, [Body])
+        else: self.upload_fileobj(Body, Bucket, Key)
+        return {'ETag': self._etag(Bucket, Key)}
+
+    def copy(self, CopySource: Dict, Bucket: str, Key: str, **kwargs) -> None:
+        source_path = self._check_exists(CopySource['Bucket'], CopySource['Key'], 'CopyObject')
+        with open(source_path, 'rb') as f: self._write(Bucket, Key, iter(lambda: f.read(COPY_CHUNK_SIZE), b''))
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> Dict:
+        path = self._path(Bucket, Key)
+        if os.path.isfile(path): os.remove(path)
+        return {}
+
+    def delete_objects(self, Bucket: str, Delete: Dict, **kwargs) -> Dict:
+        for s3_object in Delete['Objects']: self.delete_object(Bucket, s3_object['Key'])
+        return {'Deleted': [{'Key': s3_object['Key']} for s3_object in Delete['Objects']]}
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs) -> Dict:
+        with self.lock:
+            upload_id = str(len(self.multipart_uploads) + 1)
+            self.multipart_uploads[upload_id] = {}
+        return {'UploadId': upload_id, 'Bucket': Bucket, 'Key': Key}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body, **kwargs) -> Dict:
+        data = bytes(Body) if isinstance(Body, (bytes, bytearray, memoryview)) else Body.read()
+        with self.lock: self.multipart_uploads[UploadId][PartNumber] = data
+        return {'ETag': f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: Dict, **kwargs) -> Dict:
+        with self.lock: parts = self.multipart_uploads.pop(UploadId)
+        self._write(Bucket, Key, (parts[part['PartNumber']] for part in MultipartUpload['Parts']))
+        return {'Bucket': Bucket, 'Key': Key, 'ETag': self._etag(Bucket, Key)}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> Dict:
+        with self.lock: self.multipart_uploads.pop(UploadId, None)
+        return {}
+
+class LocalSiteWiseClient:
+    """Stand-in for the IoT SiteWise client, listing a fixed set of
+    timeseries
+    """
+    def __init__(self, timeseries_ids: List[str]):
+        self.timeseries_ids = timeseries_ids
+
+    def list_time_series(self, timeSeriesType: str = None, maxResults: int = 50, nextToken: str = None, **kwargs) -> Dict:
+        start = int(nextToken or 0)
+        response = {'TimeSeriesSummaries': [{'timeSeriesId': timeseries_id}
+                                            for timeseries_id in self.timeseries_ids[start:start + maxResults]]}
+        if start + maxResults < len(self.timeseries_ids): response['nextToken'] = str(start + maxResults)
+        return response
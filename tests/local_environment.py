@@ -0,0 +1,17 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+import benchmark
+
+# Helpers reading config.yml use the benchmark config and the local S3 and SiteWise stand-ins, set up once for all tests
+s3_dir = tempfile.mkdtemp(prefix='sitewise-tests-')
+atexit.register(shutil.rmtree, s3_dir, True)
+config = benchmark.load_benchmark_config([])
+s3_client = benchmark.install_local_environment(config, s3_dir, [])
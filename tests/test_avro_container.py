@@ -0,0 +1,86 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import io
+import os
+import sys
+import json
+import unittest
+import avro.schema
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+import benchmark
+import helpers.avro_container as avro_container_helper
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CODECS = ['null', 'deflate']
+
+class AvroEnginesTest(unittest.TestCase):
+    def setUp(self):
+        with open(f'{root_dir}/avro_schema.json', 'r') as f:
+            self.schema_json = json.load(f)
+        self.schema = avro.schema.parse(json.dumps(self.schema_json))
+        # Records of all value types, some versioned
+        self.records = benchmark.generate_records(2000, list(benchmark.VALUE_FIELDS))
+        # Schema of the containers written before recordVersion was added
+        self.earlier_schema = avro.schema.parse(json.dumps({**self.schema_json,
+                                                            'fields': [field for field in self.schema_json['fields'] if field['name'] != 'recordVersion']}))
+        self.engines = [avro_container_helper.create_engine(name) for name in avro_container_helper.ENGINES]
+
+    def write_container(self, records: list, codec: str, engine, schema: avro.schema.Schema = None) -> bytes:
+        buffer = io.BytesIO()
+        writer = avro_container_helper.AvroContainerWriter(buffer, schema or self.schema, codec=codec, engine=engine)
+        for record in records: writer.append(record)
+        writer.flush()
+        return buffer.getvalue()
+
+    def test_engines_decode_the_records_encoded(self):
+        for codec in CODECS:
+            for engine in self.engines:
+                with self.subTest(codec=codec, engine=engine.name):
+                    data = self.write_container(self.records, codec, engine)
+                    reader = avro_container_helper.AvroContainerReader(io.BytesIO(data))
+                    self.assertEqual(reader.codec, codec)
+                    block_records = [record for record_count, block_data in reader.iter_blocks()
+                                     for record in avro_container_helper.iter_block_records(record_count, block_data, codec, self.schema, engine=engine)]
+                    self.assertEqual(block_records, self.records)
+                    self.assertEqual(list(avro_container_helper.iter_container_records(io.BytesIO(data), self.schema, engine=engine)), self.records)
+
+    def test_engines_encode_the_same_blocks(self):
+        for codec in CODECS:
+            with self.subTest(codec=codec):
+                engine_blocks = []
+                for engine in self.engines:
+                    reader = avro_container_helper.AvroContainerReader(io.BytesIO(self.write_container(self.records, codec, engine)))
+                    engine_blocks.append([avro_container_helper.decompress(codec, block_data) for _, block_data in reader.iter_blocks()])
+                for blocks in engine_blocks[1:]: self.assertEqual(blocks, engine_blocks[0])
+
+    def test_records_of_an_earlier_schema_resolved(self):
+        # recordVersion resolves to null
+        earlier_records = [{name: value for name, value in record.items() if name != 'recordVersion'} for record in self.records]
+        data = self.write_container(earlier_records, 'deflate', self.engines[0], self.earlier_schema)
+        for engine in self.engines:
+            with self.subTest(engine=engine.name):
+                self.assertEqual(list(avro_container_helper.iter_container_records(io.BytesIO(data), self.schema, engine=engine)),
+                                 [{**record, 'recordVersion': None} for record in self.records])
+
+    def test_blocks_copied_unless_the_schemas_differ(self):
+        containers = [self.write_container(self.records[:1000], 'deflate', self.engines[0]),
+                      self.write_container([{name: value for name, value in record.items() if name != 'recordVersion'} for record in self.records[1000:2000]],
+                                           'null', self.engines[0], self.earlier_schema)]
+        for engine in self.engines:
+            with self.subTest(engine=engine.name):
+                buffer = io.BytesIO()
+                writer = avro_container_helper.AvroContainerWriter(buffer, self.schema, codec='null', engine=engine)
+                self.assertEqual(avro_container_helper.append_container_blocks(io.BytesIO(containers[0]), writer), 1000)
+                copied_block_count = writer.block_count
+                self.assertEqual(copied_block_count, len(list(avro_container_helper.AvroContainerReader(io.BytesIO(containers[0])).iter_blocks())))
+                # The blocks of the earlier schema are decoded and their records appended
+                self.assertEqual(avro_container_helper.append_container_blocks(io.BytesIO(containers[1]), writer), 1000)
+                writer.flush()
+                self.assertEqual(writer.blocks_recompressed, copied_block_count)
+                self.assertEqual(list(avro_container_helper.iter_container_records(io.BytesIO(buffer.getvalue()), self.schema, engine=engine)),
+                                 self.records[:1000] + [{**record, 'recordVersion': None} for record in self.records[1000:2000]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+import time
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+import helpers.download as download_helper
+import helpers.buffers as buffers_helper
+
+class DownloadEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = download_helper.DownloadEngine(4, range_size=10)
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.engine.close()
+        self.dir.cleanup()
+
+    def test_failed_range_raises_its_error_and_discards_the_object(self):
+        s3_objects = [{'Key': f'raw_{i}.avro', 'Size': 100} for i in range(4)]
+        discarded = []
+
+        def download_range(s3_object, start, end):
+            if s3_object['Key'] == 'raw_1.avro' and start == 50: raise ValueError('range failed')
+            time.sleep(0.01)
+            return b'x' * (end - start + 1)
+
+        def discard_ranged_object(s3_object):
+            os.remove(f'{self.dir.name}/{s3_object["Key"]}')
+            discarded.append(s3_object['Key'])
+
+        with self.assertRaisesRegex(ValueError, 'range failed'):
+            self.engine.download(s3_objects, None, lambda s3_object: buffers_helper.FileRangeWriter(f'{self.dir.name}/{s3_object["Key"]}', 100),
+                                 download_range, discard_ranged_object)
+        self.assertIn('raw_1.avro', discarded)
+        # Objects are either complete or removed
+        for s3_object in s3_objects:
+            if s3_object['Key'] not in discarded:
+                with open(f'{self.dir.name}/{s3_object["Key"]}', 'rb') as f: self.assertEqual(f.read(), b'x' * 100)
+
+    def test_ranged_objects_written(self):
+        s3_objects = [{'Key': 'raw_0.avro', 'Size': 25}]
+        stats = self.engine.download(s3_objects, None, lambda s3_object: buffers_helper.FileRangeWriter(f'{self.dir.name}/{s3_object["Key"]}', 25),
+                                     lambda s3_object, start, end: bytes(range(start, end + 1)))
+        self.assertEqual(stats['bytes'], 25)
+        with open(f'{self.dir.name}/raw_0.avro', 'rb') as f: self.assertEqual(f.read(), bytes(range(25)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+import gzip
+import json
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from local_environment import s3_client
+import helpers.inventory as inventory_helper
+
+BUCKET = 'test-inventory'
+PARQUET_SCHEMA = ('message s3.inventory { required binary bucket (STRING); required binary key (STRING); optional int64 size; '
+                  'optional binary e_tag (STRING);}')
+
+class InventoryTest(unittest.TestCase):
+    def put_manifest(self, prefix: str, file_format: str, file_schema: str, files: list = ()) -> None:
+        manifest = {'fileFormat': file_format, 'fileSchema': file_schema, 'files': [{'key': key} for key in files]}
+        s3_client.put_object(Bucket=BUCKET, Key=f'{prefix}2022-05-06T00-00Z/manifest.json', Body=json.dumps(manifest).encode('utf-8'))
+
+    def test_csv_objects_read_per_prefix(self):
+        rows = '"cold","raw/day%3D5/raw_s1_0.avro","100","abc"\n"cold","raw/day%3D4/raw_s1_0.avro","200","def"\n'
+        s3_client.put_object(Bucket=BUCKET, Key='csv/data/0.csv.gz', Body=gzip.compress(rows.encode('utf-8')))
+        self.put_manifest('csv/', 'CSV', 'Bucket, Key, Size, ETag', ['csv/data/0.csv.gz'])
+        self.assertEqual(inventory_helper.get_inventory_objects(BUCKET, 'csv/', ['raw/day=5/']),
+                         {'raw/day=5/': [{'Key': 'raw/day=5/raw_s1_0.avro', 'ETag': 'abc', 'Size': 100}]})
+
+    def test_missing_etag_field_named(self):
+        self.put_manifest('csv-no-etag/', 'CSV', 'Bucket, Key, Size')
+        with self.assertRaisesRegex(Exception, "doesn't list the optional field 'ETag'"):
+            inventory_helper.get_inventory_objects(BUCKET, 'csv-no-etag/', ['raw/'])
+        self.put_manifest('parquet-no-etag/', 'Parquet', PARQUET_SCHEMA.replace(' optional binary e_tag (STRING);', ''))
+        with self.assertRaisesRegex(Exception, "doesn't list the optional field 'ETag'"):
+            inventory_helper.get_inventory_objects(BUCKET, 'parquet-no-etag/', ['raw/'])
+
+    def test_parquet_schema_fields(self):
+        self.assertEqual(inventory_helper.get_field_names({'fileFormat': 'Parquet', 'fileSchema': PARQUET_SCHEMA}), 
+                         ['bucket', 'key', 'size', 'e_tag'])
+
+if __name__ == '__main__':
+    unittest.main()
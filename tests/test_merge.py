@@ -0,0 +1,229 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import io
+import os
+import sys
+import json
+import tempfile
+import unittest
+from unittest import mock
+import avro.schema
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+import helpers.merge as merge_helper
+import helpers.index as index_helper
+import helpers.compaction as compaction_helper
+import helpers.avro_container as avro_container_helper
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def raw_datum(series_id: str, time_in_seconds: int, value: float = 1.0, version: int = None) -> dict:
+    return {'seriesId': series_id, 'timeInSeconds': time_in_seconds, 'offsetInNanos': 0, 'quality': 'GOOD', 'doubleValue': value,
+            'stringValue': None, 'integerValue': None, 'booleanValue': None, 'jsonValue': None, 'recordVersion': version}
+
+def series_id_from_file_name(file_name: str) -> str:
+    return file_name.split('_')[1]
+
+class MergeTestCase(unittest.TestCase):
+    def setUp(self):
+        with open(f'{root_dir}/avro_schema.json', 'r') as f:
+            self.schema = avro.schema.parse(json.dumps(json.load(f)))
+        self.files = {}
+
+    def open_file(self, file_name: str):
+        f = io.BytesIO()
+        # Keep the content once the writer closes the file
+        f.close = lambda: self.files.__setitem__(file_name, f.getvalue())
+        return f
+
+    def open_shard(self, shard_index: int):
+        return f'part{shard_index}', self.open_file(f'part{shard_index}')
+
+    def write_file(self, file_name: str, records: list) -> None:
+        writer = avro_container_helper.AvroContainerWriter(self.open_file(file_name), self.schema, codec='null')
+        for record in records: writer.append(record)
+        writer.close()
+
+    def read_file(self, file_name: str) -> list:
+        return list(avro_container_helper.iter_container_records(io.BytesIO(self.files[file_name]), self.schema))
+
+    def encode(self, record: dict) -> bytes:
+        buffer = io.BytesIO()
+        avro_container_helper.create_engine('avro').record_encoder(self.schema, buffer)(record)
+        return buffer.getvalue()
+
+class ShardedWriterTest(MergeTestCase):
+
+    def test_no_empty_shard_when_the_last_block_crosses_the_target_size(self):
+        writer = merge_helper.ShardedWriter(self.schema, self.open_shard, target_file_size=1024, codec='null')
+        writer.start_series('s1')
+        record_count = 0
+        # Append blocks until one crosses the target size, then stop
+        while not writer.closed_shards():
+            writer.append_block(10, b''.join(self.encode(raw_datum('s1', record_count + i)) for i in range(10)), 'null')
+            record_count += 10
+        writer.close()
+        self.assertEqual([shard['name'] for shard in writer.shards], ['part0'])
+        self.assertEqual(writer.shards[0]['records'], record_count)
+        self.assertEqual(sorted(self.files), ['part0'])
+
+    def test_next_shard_opened_once_data_follows(self):
+        writer = merge_helper.ShardedWriter(self.schema, self.open_shard, target_file_size=1024, codec='null')
+        writer.start_series('s1')
+        while not writer.closed_shards():
+            writer.append_block(10, b''.join(self.encode(raw_datum('s1', i)) for i in range(10)), 'null')
+        writer.start_series('s2')
+        writer.append(raw_datum('s2', 0))
+        writer.close()
+        self.assertEqual([shard['series'] for shard in writer.shards], [{'s1'}, {'s2'}])
+        self.assertEqual(writer.shards[1]['records'], 1)
+        self.assertEqual(self.read_file('part1'), [raw_datum('s2', 0)])
+
+class SortedMergeTest(MergeTestCase):
+    def setUp(self):
+        super().setUp()
+        # Timestamps of each series interleave across its files
+        self.write_file('raw_s2_a.avro', [raw_datum('s2', t) for t in (0, 2, 4)])
+        self.write_file('raw_s2_b.avro', [raw_datum('s2', t) for t in (1, 3, 5)])
+        self.write_file('raw_s1_a.avro', [raw_datum('s1', t) for t in (10, 12)])
+        self.write_file('raw_s1_b.avro', [raw_datum('s1', t) for t in (11,)])
+        self.input_names = ['raw_s2_a.avro', 'raw_s2_b.avro', 'raw_s1_a.avro', 'raw_s1_b.avro']
+
+    def open_input(self, file_name: str):
+        return io.BytesIO(self.files[file_name])
+
+    def test_records_sorted_per_series(self):
+        writer = merge_helper.ShardedWriter(self.schema, self.open_shard, codec='null')
+        record_counts = merge_helper.merge_avro_files_sorted(self.input_names, writer, series_id_from_file_name, open_file=self.open_input)
+        writer.close()
+        self.assertEqual(record_counts, {'raw_s2_a.avro': 3, 'raw_s2_b.avro': 3, 'raw_s1_a.avro': 2, 'raw_s1_b.avro': 1})
+        records = self.read_file('part0')
+        self.assertEqual([(record['seriesId'], record['timeInSeconds']) for record in records],
+                         [('s1', 10), ('s1', 11), ('s1', 12)] + [('s2', t) for t in range(6)])
+        stats = writer.shards[0]['stats']
+        self.assertTrue(stats['sorted'])
+        self.assertEqual((stats['series_min'], stats['series_max']), ('s1', 's2'))
+        self.assertEqual(stats['series']['s2']['time_min'], [0, 0])
+        self.assertEqual(stats['series']['s2']['time_max'], [5, 0])
+
+    def test_unsorted_output_flagged(self):
+        writer = merge_helper.ShardedWriter(self.schema, self.open_shard, codec='null')
+        merge_helper.merge_avro_files(self.input_names, writer, 'record', open_file=self.open_input,
+                                      series_id_from_file_name=series_id_from_file_name)
+        writer.close()
+        self.assertEqual(writer.shards[0]['records'], 9)
+        self.assertFalse(writer.shards[0]['stats']['sorted'])
+
+class DeduplicatedMergeTest(MergeTestCase):
+    def setUp(self):
+        super().setUp()
+        # The points of the first file overlap those of the second, written in reverse order, from 10 to 19, some with the same version
+        first = [raw_datum('s1', t, 1.0, t % 3 or None) for t in range(20)]
+        second = [raw_datum('s1', t, 2.0, t % 2 + 1) for t in reversed(range(10, 30))]
+        self.write_file('raw_s1_a.avro', first)
+        self.write_file('raw_s1_b.avro', second)
+        self.write_file('raw_s0_a.avro', [raw_datum('s0', 5, 3.0, 1), raw_datum('s0', 5, 4.0, 1)])
+        self.input_names = ['raw_s1_a.avro', 'raw_s1_b.avro', 'raw_s0_a.avro']
+        # Highest version of each point, the first record read among those of the same version
+        expected = {}
+        for record in first + second:
+            point = (record['seriesId'], record['timeInSeconds'])
+            if point not in expected or merge_helper.record_version(record) > merge_helper.record_version(expected[point]): 
+                expected[point] = record
+        self.expected = [raw_datum('s0', 5, 3.0, 1)] + [expected[point] for point in sorted(expected)]
+        self.spill_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.spill_dir.cleanup)
+
+    def merge(self, memory_budget: int) -> dict:
+        writer = merge_helper.ShardedWriter(self.schema, self.open_shard, codec='null')
+        stats = {}
+        record_counts = merge_helper.merge_avro_files_deduplicated(self.input_names, writer, series_id_from_file_name, memory_budget,
+            self.spill_dir.name, open_file=lambda file_name: io.BytesIO(self.files[file_name]), stats=stats)
+        writer.close()
+        self.assertEqual(record_counts, {'raw_s1_a.avro': 20, 'raw_s1_b.avro': 20, 'raw_s0_a.avro': 2})
+        self.assertEqual(stats['duplicates'], 11)
+        self.assertTrue(writer.shards[0]['stats']['sorted'])
+        return stats
+
+    def test_in_memory(self):
+        stats = self.merge(1024 * 1024)
+        self.assertEqual(stats['spilled_runs'], 0)
+        self.assertEqual(self.read_file('part0'), self.expected)
+
+    def test_spilled_runs(self):
+        # Room for 4 records in memory
+        stats = self.merge(4 * merge_helper.DECODED_RECORD_BYTES)
+        self.assertGreater(stats['spilled_runs'], 2)
+        self.assertEqual(self.read_file('part0'), self.expected)
+        self.assertEqual(os.listdir(self.spill_dir.name), [])
+
+class BucketedWriterTest(MergeTestCase):
+    def create_writer(self, bucket: int) -> merge_helper.ShardedWriter:
+        open_shard = lambda shard_index: (f'bucket{bucket}_part{shard_index}', self.open_file(f'bucket{bucket}_part{shard_index}'))
+        return merge_helper.ShardedWriter(self.schema, open_shard, target_file_size=2048, codec='null')
+
+    @mock.patch.object(avro_container_helper, 'SYNC_INTERVAL', 512)
+    def test_series_only_in_the_files_of_their_bucket(self):
+        # CRC-32 of the seriesId modulo the bucket count, as computed by Athena
+        self.assertEqual([index_helper.series_bucket(series_id, 4) for series_id in ('s00', 's01', 's02', 's03')], [0, 2, 0, 2])
+        series_ids = [f's{i:02d}' for i in range(40)]
+        writer = merge_helper.BucketedWriter(self.schema, 4, self.create_writer)
+        for series_id in series_ids:
+            writer.start_series(series_id)
+            for t in range(20): writer.append(raw_datum(series_id, t))
+        writer.close()
+        file_index = index_helper.add_files({'files': []}, writer.shards, 4)
+        self.assertEqual(sorted({file['bucket'] for file in file_index['files']}), [0, 1, 2, 3])
+        # Small blocks make buckets span several files
+        self.assertGreater(len(file_index['files']), 4)
+
+        series_files = {}
+        for file in file_index['files']:
+            self.assertTrue(file['name'].startswith(f'bucket{file["bucket"]}_'))
+            for record in self.read_file(file['name']): series_files.setdefault(record['seriesId'], set()).add(file['name'])
+        for series_id in series_ids:
+            bucket = index_helper.series_bucket(series_id, 4)
+            bucket_files = {file['name'] for file in file_index['files'] if file['bucket'] == bucket}
+            self.assertLessEqual(series_files[series_id], bucket_files)
+            self.assertEqual({file['name'] for file in index_helper.files_for_series(file_index, series_id)}, bucket_files)
+        self.assertEqual(sum(file['records'] for file in file_index['files']), 40 * 20)
+
+class CompactionTest(MergeTestCase):
+    def indexed_file(self, file_name: str, records: list) -> dict:
+        writer = merge_helper.ShardedWriter(self.schema, lambda shard_index: (file_name, self.open_file(file_name)), codec='null')
+        writer.start_series(records[0]['seriesId'])
+        for record in records: writer.append(record)
+        writer.close()
+        return index_helper.add_files({'files': []}, writer.shards)['files'][0]
+
+    def test_unindexed_files_selected_with_the_small_files(self):
+        file_index = {'files': [{'name': 'small.avro', 'bytes': 10, 'records': 1}, {'name': 'large.avro', 'bytes': 1000, 'records': 100}]}
+        unindexed_files = [compaction_helper.unindexed_file(file_name, size) 
+                           for file_name, size in (('legacy_small.avro', 10), ('legacy_large.avro', 1000), ('timeseries.txt', 10))]
+        self.assertEqual(compaction_helper.select_files_to_compact(file_index, '.avro', 10, 100, 2), [])
+        # The small legacy file makes two small files, and the large one is selected too so the index of the compacted day lists all its files
+        files = compaction_helper.select_files_to_compact(file_index, '.avro', 10, 100, 2, unindexed_files=unindexed_files)
+        self.assertEqual([file['name'] for file in files], ['small.avro', 'legacy_small.avro', 'legacy_large.avro'])
+        files = compaction_helper.select_files_to_compact(file_index, '.avro', 3, 100, 10, unindexed_files=unindexed_files)
+        self.assertEqual([file['name'] for file in files], ['small.avro', 'large.avro', 'legacy_small.avro', 'legacy_large.avro'])
+
+    def test_unindexed_files_compacted_by_record(self):
+        indexed_file = self.indexed_file('indexed.avro', [raw_datum('s1', t) for t in range(5)])
+        self.write_file('legacy.avro', [raw_datum('s2', t) for t in range(3)] + [raw_datum('s3', t) for t in range(4)])
+        files = [indexed_file, compaction_helper.unindexed_file('legacy.avro', len(self.files['legacy.avro']))]
+        open_file = lambda file_name: io.BytesIO(self.files[file_name])
+        self.assertEqual(compaction_helper.count_file_records(files[1], open_file), 7)
+
+        writer = merge_helper.ShardedWriter(self.schema, self.open_shard, codec='null')
+        record_count = compaction_helper.compact_files(files, writer, open_file, lambda file: None)
+        writer.close()
+        self.assertEqual(record_count, 12)
+        compacted_file = index_helper.add_files({'files': []}, writer.shards)['files'][0]
+        self.assertEqual(compacted_file['series'], ['s1', 's2', 's3'])
+        self.assertEqual(compacted_file['records'], 12)
+        self.assertEqual(self.read_file('part0'), [raw_datum('s1', t) for t in range(5)] + [raw_datum('s2', t) for t in range(3)] 
+                                                  + [raw_datum('s3', t) for t in range(4)])
+
+if __name__ == '__main__':
+    unittest.main()
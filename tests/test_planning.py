@@ -0,0 +1,37 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import local_environment
+import helpers.planning as planning_helper
+
+DAY_PREFIX = 'raw/startYear=2022/startMonth=5/startDay=5/'
+
+def s3_object(timeseries_id: str, index: int, etag: str = 'etag') -> dict:
+    return {'Key': f'{DAY_PREFIX}seriesBucket=00/raw_{timeseries_id}_{index}.avro', 'ETag': etag, 'Size': 100 + index}
+
+class ObjectsModeTransitionTest(unittest.TestCase):
+    def test_legacy_day_only_processes_new_timeseries(self):
+        # The day was merged for s1 and s2 before manifests were kept, s3 is new
+        s3_objects = [s3_object('s1', 0), s3_object('s1', 1), s3_object('s2', 0), s3_object('s3', 0)]
+        previous_objects = planning_helper.manifest_objects_of_timeseries(s3_objects, DAY_PREFIX, {'s1', 's2'})
+        self.assertEqual(previous_objects, {'seriesBucket=00/raw_s1_0.avro': ['etag', 100, None], 'seriesBucket=00/raw_s1_1.avro': ['etag', 101, None],
+                                            'seriesBucket=00/raw_s2_0.avro': ['etag', 100, None]})
+        grouped_objects, changed_count = planning_helper.group_changed_objects_by_timeseries(s3_objects, DAY_PREFIX, {'s1', 's2', 's3'}, 
+                                                                                            previous_objects)
+        self.assertEqual(grouped_objects, {'s3': [s3_object('s3', 0)]})
+        self.assertEqual(changed_count, 0)
+
+    def test_changed_objects_counted(self):
+        previous_objects = planning_helper.manifest_objects_of_timeseries([s3_object('s1', 0)], DAY_PREFIX, {'s1'})
+        grouped_objects, changed_count = planning_helper.group_changed_objects_by_timeseries(
+            [s3_object('s1', 0, 'etag2'), s3_object('s1', 1)], DAY_PREFIX, {'s1'}, previous_objects)
+        self.assertEqual(grouped_objects, {'s1': [s3_object('s1', 0, 'etag2'), s3_object('s1', 1)]})
+        self.assertEqual(changed_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import io
+import os
+import sys
+import json
+import unittest
+from unittest import mock
+import avro.schema
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from local_environment import s3_client, config
+import helpers.reader as reader_helper
+import helpers.merge as merge_helper
+import helpers.index as index_helper
+import helpers.avro_container as avro_container_helper
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+repartitioned = config['s3']['repartitioned']
+DAY_PREFIX = 'startYear=2022/startMonth=5/startDay=5/'
+# 2022-05-05T00:00:00Z
+DAY_START = 1651708800
+SERIES_IDS = ['s1', 's2', 's3']
+
+def raw_datum(series_id: str, time_in_seconds: int) -> dict:
+    return {'seriesId': series_id, 'timeInSeconds': time_in_seconds, 'offsetInNanos': 0, 'quality': 'GOOD', 'doubleValue': 1.0,
+            'stringValue': None, 'integerValue': None, 'booleanValue': None, 'jsonValue': None, 'recordVersion': None}
+
+class RepartitionedReaderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(f'{root_dir}/avro_schema.json', 'r') as f:
+            schema = avro.schema.parse(json.dumps(json.load(f)))
+        data = io.BytesIO()
+        data.close = lambda: None
+        cls.records = [raw_datum(series_id, DAY_START + t * 60) for series_id in SERIES_IDS for t in range(300)]
+        # Small blocks make each series span several blocks
+        with mock.patch.object(avro_container_helper, 'SYNC_INTERVAL', 1024):
+            writer = merge_helper.ShardedWriter(schema, lambda shard_index: ('merged.avro', data), codec='null')
+            for record in cls.records:
+                if record['seriesId'] != writer.series_id: writer.start_series(record['seriesId'])
+                writer.append(record)
+            writer.close()
+        cls.data = data.getvalue()
+        cls.stats = writer.shards[0]['stats']
+        file_index = index_helper.add_files({'files': []}, writer.shards)
+        s3_client.put_object(Bucket=repartitioned['bucket_name'], Key=f'{repartitioned["data_prefix"]}{DAY_PREFIX}merged.avro', Body=data.getvalue())
+        s3_client.put_object(Bucket=repartitioned['bucket_name'], Key=f'{repartitioned["index_prefix"]}{DAY_PREFIX}merged.avro.stats.json',
+                             Body=json.dumps(cls.stats).encode('utf-8'))
+        s3_client.put_object(Bucket=repartitioned['bucket_name'], Key=f'{repartitioned["index_prefix"]}{DAY_PREFIX}{index_helper.FILE_INDEX_NAME}',
+                             Body=json.dumps(file_index).encode('utf-8'))
+
+    def expected_records(self, series_ids: list, start_time: int, end_time: int) -> list:
+        return [record for record in self.records if record['seriesId'] in series_ids and start_time <= record['timeInSeconds'] < end_time]
+
+    def block_records(self, block: dict) -> list:
+        header = avro_container_helper.AvroContainerReader(io.BytesIO(self.data))
+        f = io.BytesIO(self.data[block['offset']:block['offset'] + block['length']])
+        return [record for record_count, data in avro_container_helper.iter_container_blocks(f, header.sync_marker)
+                for record in avro_container_helper.iter_block_records(record_count, data, header.codec, avro.schema.parse(header.schema_json))]
+
+    def test_ranges_coalesced(self):
+        self.assertEqual(reader_helper.coalesce_ranges([[100, 110], [0, 10], [15, 20], [5, 12]], 5), [[0, 20], [100, 110]])
+        self.assertEqual(reader_helper.coalesce_ranges([[0, 10], [16, 20]], 5), [[0, 10], [16, 20]])
+
+    def test_blocks_of_the_series_in_the_time_range_planned(self):
+        start_time, end_time = DAY_START + 3600, DAY_START + 7200
+        reader = reader_helper.RepartitionedReader()
+        reads = reader.plan_reads(['s2'], start_time, end_time)
+        self.assertEqual(len(reads), 1)
+        self.assertEqual(reads[0]['key'], f'{repartitioned["data_prefix"]}{DAY_PREFIX}merged.avro')
+        self.assertEqual(reads[0]['header_length'], self.stats['blocks'][0]['offset'])
+        blocks = reads[0]['blocks']
+        self.assertEqual(blocks, reader_helper.select_blocks(self.stats, ['s2'], start_time, end_time))
+        self.assertLess(len(blocks), len(self.stats['blocks']))
+        for block in blocks:
+            self.assertEqual(list(block['series']), ['s2'])
+            self.assertTrue(reader_helper.time_overlaps(*block['series']['s2'][1:], start_time, end_time))
+        # The selected blocks hold all the records of the series in the time range, the other blocks none
+        expected_records = self.expected_records(['s2'], start_time, end_time)
+        self.assertEqual([record for block in blocks for record in self.block_records(block) if record in expected_records], expected_records)
+        for block in self.stats['blocks']:
+            if block not in blocks: self.assertFalse(any(record in expected_records for record in self.block_records(block)))
+        self.assertEqual(reader.stats['requests'], 2)
+
+        # Days without a file index are skipped
+        self.assertEqual(reader.plan_reads(['s2'], DAY_START + 86400, DAY_START + 2 * 86400), [])
+
+    def test_records_of_the_series_in_the_time_range_read(self):
+        start_time, end_time = DAY_START + 3600, DAY_START + 7200
+        reader = reader_helper.RepartitionedReader()
+        self.assertEqual(list(reader.read(['s1', 's3', 'unknown'], start_time, end_time)),
+                         self.expected_records(['s1', 's3'], start_time, end_time))
+        block_count = len(reader_helper.select_blocks(self.stats, ['s1', 's3'], start_time, end_time))
+        # files.json, the statistics, the header and a single GET for the blocks of both series, 256 KB apart at most.
+        # The blocks of s2 fetched between them aren't decoded
+        self.assertEqual({name: reader.stats[name] for name in ('files', 'requests', 'blocks', 'records')},
+                         {'files': 1, 'requests': 4, 'blocks': block_count, 'records': 2 * 60})
+        self.assertLess(reader.stats['bytes'], len(self.data))
+
+    @mock.patch.object(reader_helper, 'RANGE_COALESCE_GAP_BYTES', 0)
+    def test_distant_blocks_fetched_separately(self):
+        start_time, end_time = DAY_START + 3600, DAY_START + 7200
+        reader = reader_helper.RepartitionedReader()
+        self.assertEqual(list(reader.read(['s1', 's3'], start_time, end_time)), self.expected_records(['s1', 's3'], start_time, end_time))
+        # The blocks of s2 between those of s1 and s3 are not fetched
+        self.assertEqual(reader.stats['requests'], 2 + 1 + 2)
+
+if __name__ == '__main__':
+    unittest.main()
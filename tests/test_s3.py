@@ -0,0 +1,129 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from local_environment import s3_client
+import helpers.s3 as s3_helper
+
+BUCKET = 'test-uploads'
+PART_SIZE = s3_helper.MIN_MULTIPART_PART_SIZE
+
+def part_data(part_count: int, remainder: int) -> bytes:
+    # Each part holds a different byte, so parts out of order are detected
+    return b''.join(bytes([part_number]) * PART_SIZE for part_number in range(part_count)) + b'\xff' * remainder
+
+class FakeClock:
+    def __init__(self, now: float = 100.0):
+        self.now = now
+
+    def monotonic(self) -> float:
+        return self.now
+
+def throttling_error() -> ClientError:
+    return ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Please reduce your request rate.'}}, 'GetObject')
+
+class AdaptiveConcurrencyLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(s3_helper.time, 'monotonic', self.clock.monotonic)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_limit_grows_by_one_per_limit_successes(self):
+        limiter = s3_helper.AdaptiveConcurrencyLimiter('Test', 2, 4)
+        concurrencies = []
+        for _ in range(6):
+            limiter.on_success()
+            concurrencies.append(limiter.stats()['concurrency'])
+        # 2.5, 2.9, 3.24, 3.55, 3.83, 4
+        self.assertEqual(concurrencies, [2, 2, 3, 3, 3, 4])
+        for _ in range(10): limiter.on_success()
+        self.assertEqual(limiter.stats(), {'concurrency': 4, 'peak_concurrency': 4, 'throttles': 0, 'errors': 0})
+
+    def test_limit_halved_at_most_once_per_second(self):
+        limiter = s3_helper.AdaptiveConcurrencyLimiter('Test', 16, 16)
+        for _ in range(3): limiter.on_throttle()
+        self.assertEqual(limiter.stats()['concurrency'], 8)
+        self.clock.now += s3_helper.DECREASE_INTERVAL_SECONDS / 2
+        limiter.on_error()
+        self.assertEqual(limiter.stats()['concurrency'], 8)
+        self.clock.now += s3_helper.DECREASE_INTERVAL_SECONDS / 2
+        limiter.on_throttle()
+        self.assertEqual(limiter.stats()['concurrency'], 4)
+        for _ in range(5):
+            self.clock.now += s3_helper.DECREASE_INTERVAL_SECONDS
+            limiter.on_throttle()
+        self.assertEqual(limiter.stats(), {'concurrency': 1, 'peak_concurrency': 16, 'throttles': 9, 'errors': 1})
+
+    @mock.patch.object(s3_helper.time, 'sleep')
+    def test_throttled_calls_retried(self, sleep):
+        limiter = s3_helper.AdaptiveConcurrencyLimiter('Test', 4, 4)
+        function = mock.Mock(side_effect=[throttling_error(), throttling_error(), 'data'])
+        self.assertEqual(limiter.call(function, 'key'), 'data')
+        self.assertEqual(function.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(limiter.stats()['throttles'], 2)
+
+        function = mock.Mock(side_effect=throttling_error())
+        with self.assertRaises(ClientError): limiter.call(function)
+        self.assertEqual(function.call_count, s3_helper.MAX_THROTTLED_ATTEMPTS)
+        self.assertEqual(limiter.stats()['throttles'], 2 + s3_helper.MAX_THROTTLED_ATTEMPTS)
+
+    def test_other_errors_not_retried(self):
+        limiter = s3_helper.AdaptiveConcurrencyLimiter('Test', 4, 4)
+        function = mock.Mock(side_effect=ValueError('no retry'))
+        with self.assertRaisesRegex(ValueError, 'no retry'): limiter.call(function)
+        self.assertEqual(function.call_count, 1)
+        self.assertEqual(limiter.stats(), {'concurrency': 2, 'peak_concurrency': 4, 'throttles': 0, 'errors': 1})
+
+class MultipartUploadWriterTest(unittest.TestCase):
+    def get_object(self, key: str) -> bytes:
+        return s3_client.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+
+    def test_small_object_uploaded_with_a_single_put(self):
+        with mock.patch.object(s3_client, 'create_multipart_upload', wraps=s3_client.create_multipart_upload) as create_multipart_upload:
+            with s3_helper.MultipartUploadWriter(BUCKET, 'small.avro', PART_SIZE, 4) as writer:
+                writer.write(b'header')
+                writer.write(b'records')
+        create_multipart_upload.assert_not_called()
+        self.assertEqual(self.get_object('small.avro'), b'headerrecords')
+
+    def test_parts_completed_in_order(self):
+        upload_part = s3_client.upload_part
+        def slow_first_part(**kwargs):
+            # The first part finishes last
+            if kwargs['PartNumber'] == 1: time.sleep(0.2)
+            return upload_part(**kwargs)
+
+        data = part_data(3, 1000)
+        with mock.patch.object(s3_client, 'upload_part', side_effect=slow_first_part):
+            with s3_helper.MultipartUploadWriter(BUCKET, 'parts.avro', PART_SIZE, 4) as writer:
+                # Writes don't line up with the parts
+                for i in range(0, len(data), 1024 * 1024 + 7): writer.write(data[i:i + 1024 * 1024 + 7])
+                self.assertEqual(writer.tell(), len(data))
+        self.assertEqual(self.get_object('parts.avro'), data)
+
+    def test_failed_part_aborts_the_upload(self):
+        upload_part = s3_client.upload_part
+        def failing_second_part(**kwargs):
+            if kwargs['PartNumber'] == 2: raise ValueError('part failed')
+            return upload_part(**kwargs)
+
+        with mock.patch.object(s3_client, 'upload_part', side_effect=failing_second_part), \
+             mock.patch.object(s3_client, 'abort_multipart_upload', wraps=s3_client.abort_multipart_upload) as abort_multipart_upload:
+            with self.assertRaisesRegex(ValueError, 'part failed'):
+                # The failure is raised by a later write or on close, either way the upload is aborted on exit
+                with s3_helper.MultipartUploadWriter(BUCKET, 'failed.avro', PART_SIZE, 4) as writer:
+                    writer.write(part_data(3, 0))
+        abort_multipart_upload.assert_called_once_with(Bucket=BUCKET, Key='failed.avro', UploadId=writer.upload_id)
+        self.assertIsNone(s3_helper.get_s3_object_size(BUCKET, 'failed.avro'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+import gzip
+import json
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from local_environment import s3_client
+import helpers.sitewise as sitewise_helper
+
+class CatalogSnapshotTest(unittest.TestCase):
+    def load_snapshot(self) -> dict:
+        body = s3_client.get_object(Bucket=sitewise_helper.glue_assets_bucket_name, Key=sitewise_helper.catalog_snapshot_key)['Body'].read()
+        return json.loads(gzip.decompress(body))
+
+    def test_snapshot_refreshed_once_older_than_half_the_ttl(self):
+        half_ttl_seconds = sitewise_helper.catalog_ttl_seconds / 2
+        with mock.patch('time.time', return_value=1000.0): sitewise_helper.publish_catalog_snapshot(['s0'])
+        with mock.patch.object(sitewise_helper.sw_client, 'timeseries_ids', ['s1', 's2']):
+            with mock.patch('time.time', return_value=1000.0 + half_ttl_seconds - 1): sitewise_helper.refresh_catalog_snapshot()
+            self.assertEqual(self.load_snapshot()['timeseries_ids'], ['s0'])
+            with mock.patch('time.time', return_value=1000.0 + half_ttl_seconds): sitewise_helper.refresh_catalog_snapshot()
+        snapshot = self.load_snapshot()
+        self.assertEqual(snapshot['timeseries_ids'], ['s1', 's2'])
+        self.assertEqual(snapshot['created_at'], int(1000.0 + half_ttl_seconds))
+
+if __name__ == '__main__':
+    unittest.main()